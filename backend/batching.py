@@ -0,0 +1,186 @@
+"""
+Multi-frame model requests and tolerant parsing of the answers.
+
+One generate_content call carries up to N frames ("Image 1:", im, "Image 2:",
+im, ...) and asks for a JSON array of per-frame counts, so per-call overhead
+and request-based rate limits are paid once per batch instead of per frame.
+
+- MicroBatcher: collects frames from concurrent callers until the batch is
+  full (max_batch) or the first frame has waited max_wait_ms, sends one
+  request and fans the per-frame results back out through futures.
+- parse_counts / parse_batch: pull the first JSON object/array out of the
+  answer wherever it is (code fences, prose around it), then validate each
+  item on its own, so one bad entry only fails that frame.
+"""
+import re, json, time, queue, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from backend.metrics import INGEST_STAGE, MODEL_BATCH, timed
+
+PROMPT = """
+You are analyzing a parking lot from a drone.
+Count how many parking spaces are visible.
+Tell me:
+- How many are occupied by cars
+- How many are open
+Keep the estimated total as (occupied + open).
+Return ONLY JSON in the format:
+{"open_spots": X, "occupied": Y}
+"""
+
+BATCH_PROMPT = """
+You are analyzing {n} drone photos of parking lots, labelled Image 1 to Image {n}.
+For each image separately, count how many parking spaces are visible,
+how many are occupied by cars and how many are open.
+Return ONLY a JSON array with exactly one object per image, in order:
+[{{"frame": 1, "open_spots": X, "occupied": Y}}, {{"frame": 2, "open_spots": X, "occupied": Y}}, ...]
+"""
+
+OCCUPIED_KEYS = ("occupied", "taken_spots", "taken")
+OPEN_KEYS = ("open_spots", "open", "free")
+_JSON_START = re.compile(r"[\[{]")
+
+Counts = Tuple[int, int]  # (occupied, open_spots)
+
+
+def request_parts(images: list) -> list:
+    """generate_content parts: the single-frame prompt for one image, the batch prompt otherwise."""
+    if len(images) == 1:
+        return [PROMPT, images[0]]
+    parts = [BATCH_PROMPT.format(n=len(images))]
+    for i, im in enumerate(images, 1):
+        parts += [f"Image {i}:", im]
+    return parts
+
+
+def response_text(resp) -> str:
+    # the SDK raises on .text when the answer was blocked or empty
+    try:
+        return resp.text or ""
+    except Exception:
+        return ""
+
+
+def extract_json(text: str):
+    """First JSON object or array in text, ignoring code fences and prose around it; None if there is none."""
+    decoder = json.JSONDecoder()
+    for m in _JSON_START.finditer(text):
+        try:
+            value, _ = decoder.raw_decode(text, m.start())
+        except ValueError:
+            continue
+        if isinstance(value, dict) or (isinstance(value, list) and any(isinstance(v, dict) for v in value)):
+            return value
+    return None
+
+
+def _count(item: dict, keys) -> Optional[int]:
+    for key in keys:
+        value = item.get(key)
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return int(value) if value >= 0 else None
+        if isinstance(value, str) and value.strip().isdigit():
+            return int(value.strip())
+    return None
+
+
+def item_counts(item) -> Optional[Counts]:
+    """(occupied, open_spots) from one answer object, or None unless both are non-negative numbers."""
+    if not isinstance(item, dict):
+        return None
+    occupied, open_spots = _count(item, OCCUPIED_KEYS), _count(item, OPEN_KEYS)
+    if occupied is None or open_spots is None:
+        return None
+    return occupied, open_spots
+
+
+def parse_counts(text: str) -> Optional[Counts]:
+    """Counts for a single-frame answer (an object, or a one-element array)."""
+    return parse_batch(text, 1)[0]
+
+
+def parse_batch(text: str, n: int) -> List[Optional[Counts]]:
+    """
+    n per-frame results, None where the answer has no usable entry. Items are
+    matched by their 1-based "frame" number when every item has a valid one,
+    by position otherwise.
+    """
+    value = extract_json(text)
+    if isinstance(value, dict):
+        nested = next((value[k] for k in ("frames", "results", "images") if isinstance(value.get(k), list)), None)
+        value = nested if nested is not None else [value]
+    if not isinstance(value, list):
+        return [None] * n
+
+    items = [v for v in value if isinstance(v, dict)]
+    frames = [v.get("frame") for v in items]
+    if items and all(isinstance(f, int) and 1 <= f <= n for f in frames) and len(set(frames)) == len(frames):
+        out = [None] * n
+        for f, item in zip(frames, items):
+            out[f - 1] = item_counts(item)
+        return out
+    out = [item_counts(item) for item in items[:n]]
+    return out + [None] * (n - len(out))
+
+
+class MicroBatcher:
+    """
+    submit(im) -> Future[Optional[Counts]]; the future raises if the model call
+    itself failed (e.g. a 429), and holds None if only this frame's entry was
+    unusable. At most `concurrency` requests are in flight; while they are,
+    arriving frames accumulate into the next (fuller) batch.
+    """
+
+    def __init__(self, model, max_batch: int = 4, max_wait_ms: float = 250, concurrency: int = 2,
+                 name: str = "gemini"):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max(1, concurrency))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="model-batch")
+        self._thread = threading.Thread(target=self._collect, name="model-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, im) -> Future:
+        fut = Future()
+        self._queue.put((im, fut, time.monotonic()))
+        return fut
+
+    def detect(self, im) -> Optional[Counts]:
+        return self.submit(im).result()
+
+    def _collect(self):
+        while True:
+            first = self._queue.get()
+            self._slots.acquire()
+            batch = [first]
+            deadline = first[2] + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            images = [im for im, _, _ in batch]
+            MODEL_BATCH.observe(len(images), detector=self.name)
+            with timed(INGEST_STAGE, stage="model_call", detector=self.name):
+                resp = self.model.generate_content(request_parts(images))
+            with timed(INGEST_STAGE, stage="parse", detector=self.name):
+                results = parse_batch(response_text(resp), len(images))
+        except Exception as e:
+            for _, fut, _ in batch:
+                fut.set_exception(e)
+        else:
+            for (_, fut, _), counts in zip(batch, results):
+                fut.set_result(counts)
+        finally:
+            self._slots.release()
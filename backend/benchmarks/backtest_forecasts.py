@@ -0,0 +1,177 @@
+"""
+Rolling-origin backtest of the forecasters.
+
+    python -m backend.benchmarks.backtest_forecasts --source synthetic --weeks 6 --origins 48
+    python -m backend.benchmarks.backtest_forecasts --source bundled --horizon 0.005 --step 0.05 --min-train 2
+
+For each origin the engine is fitted on every record up to the origin and
+scored on the records that follow within the horizon, bucketed by lead time
+(step minutes). Reports MAE / MAPE per horizon step, fit / predict wall time
+and peak memory: worker max RSS always, and the traced peak of one fit with
+--memory (a second, tracemalloc-instrumented fit, so timings stay clean).
+Origins run in a process pool; each worker loads the dataset once.
+
+Engines: auto (moving average / random forest, as /forecast?model=auto),
+seasonal (online SeasonalForecaster replayed up to the origin).
+"""
+import os, json, time, argparse, resource, tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backend.predictor import SeasonalForecaster, fit_forecaster, predict_at
+from backend.benchmarks.bench_forecasters import synthetic_history
+
+ENGINES = ("auto", "seasonal")
+BUNDLED = os.path.join(os.path.dirname(__file__), "..", "parking_history.json")
+
+_data = None  # per-process dataset: (records, timestamps as DatetimeIndex, taken as ndarray)
+
+
+def load_records(source: str, weeks: int, every: int, seed: int) -> list:
+    if source == "synthetic":
+        df = synthetic_history(weeks, every, seed)
+        return [{"timestamp": t.isoformat(), "taken_spots": int(v), "estimated_total": int(n)}
+                for t, v, n in zip(df["timestamp"], df["taken_spots"], df["estimated_total"])]
+    with open(source, "r") as f:
+        if source.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+    return sorted(records, key=lambda r: r["timestamp"])
+
+
+def _init(records):
+    global _data
+    _data = (records, pd.DatetimeIndex(pd.to_datetime([r["timestamp"] for r in records])),
+             np.array([r["taken_spots"] for r in records], dtype=float))
+
+
+def _fit(engine: str, train: list):
+    if engine == "seasonal":
+        model = SeasonalForecaster()
+        for r in train:
+            model.add(r)
+        return model.fitted()
+    return fit_forecaster(train)
+
+
+def run_origin(task):
+    """Fit at one origin and score the records inside the horizon → per-step error sums."""
+    engine, origin, horizon_min, step_min, memory = task
+    records, times, taken = _data
+    end = times.searchsorted(times[origin] + pd.Timedelta(minutes=horizon_min), "right")
+    test_times, truth = times[origin + 1:end], taken[origin + 1:end]
+
+    t0 = time.perf_counter()
+    fitted = _fit(engine, records[:origin + 1])
+    fit_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    pred = predict_at(fitted, test_times) if len(test_times) else np.empty(0)
+    predict_s = time.perf_counter() - t0
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        predict_at(_fit(engine, records[:origin + 1]), test_times)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+
+    lead = (test_times - times[origin]).total_seconds().to_numpy() / 60
+    steps = np.maximum(1, np.ceil(lead / step_min)).astype(int)
+    err = np.abs(pred - truth)
+    nonzero = truth > 0
+    per_step = {}
+    for k in np.unique(steps):
+        m = steps == k
+        mz = m & nonzero
+        per_step[int(k)] = (int(m.sum()), float(err[m].sum()), int(mz.sum()), float((err[mz] / truth[mz]).sum()))
+    return engine, fit_s, predict_s, peak, rss, per_step
+
+
+def origins_for(n_records: int, min_train: int, count: int) -> list:
+    if n_records - 1 <= min_train:
+        raise SystemExit(f"need more than {min_train + 1} records for a backtest, have {n_records}")
+    return sorted(set(np.linspace(min_train, n_records - 2, num=min(count, n_records - 1 - min_train)).astype(int)))
+
+
+def summarize(results, step_min: float) -> dict:
+    out = {}
+    for engine in sorted({r[0] for r in results}):
+        rows = [r for r in results if r[0] == engine]
+        steps = {}
+        for *_, per_step in rows:
+            for k, (n, abs_sum, nz, ape_sum) in per_step.items():
+                acc = steps.setdefault(k, [0, 0.0, 0, 0.0])
+                acc[0] += n; acc[1] += abs_sum; acc[2] += nz; acc[3] += ape_sum
+        out[engine] = {
+            "origins": len(rows),
+            "fit_ms_mean": round(1000 * float(np.mean([r[1] for r in rows])), 3),
+            "predict_ms_mean": round(1000 * float(np.mean([r[2] for r in rows])), 3),
+            "traced_peak_mb_max": round(max(r[3] for r in rows) / 2 ** 20, 2) if rows[0][3] is not None else None,
+            "worker_rss_mb_max": round(max(r[4] for r in rows) / 1024, 1),
+            "steps": [{"step": k, "lead_minutes": round(k * step_min, 3), "n": n,
+                       "mae": round(a / n, 3) if n else None,
+                       "mape": round(100 * p / nz, 2) if nz else None}
+                      for k, (n, a, nz, p) in sorted(steps.items())],
+        }
+        total_n = sum(s[0] for s in steps.values())
+        out[engine]["mae"] = round(sum(s[1] for s in steps.values()) / total_n, 3) if total_n else None
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--source", default="synthetic", help="synthetic, bundled (backend/parking_history.json) or a history .json/.jsonl file")
+    ap.add_argument("--weeks", type=int, default=6)
+    ap.add_argument("--every", type=int, default=15, help="synthetic: minutes between records")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--engines", default=",".join(ENGINES))
+    ap.add_argument("--origins", type=int, default=48)
+    ap.add_argument("--min-train", type=int, default=None, help="records before the first origin")
+    ap.add_argument("--horizon", type=float, default=24, help="hours")
+    ap.add_argument("--step", type=float, default=60, help="minutes per horizon step")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--memory", action="store_true", help="also trace the peak allocation of each fit")
+    ap.add_argument("--json", help="write the summary here as JSON")
+    args = ap.parse_args()
+
+    source = BUNDLED if args.source == "bundled" else args.source
+    records = load_records(source, args.weeks, args.every, args.seed)
+    min_train = args.min_train if args.min_train is not None else max(1, len(records) // 4)
+    origins = origins_for(len(records), min_train, args.origins)
+    engines = [e for e in args.engines.split(",") if e]
+    tasks = [(e, o, args.horizon * 60, args.step, args.memory) for e in engines for o in origins]
+    print(f"{len(records)} records, {len(origins)} origins x {len(engines)} engines, "
+          f"horizon {args.horizon} h in {args.step}-minute steps, {args.workers} workers")
+
+    t0 = time.perf_counter()
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init, initargs=(records,)) as pool:
+            results = list(pool.map(run_origin, tasks, chunksize=max(1, len(tasks) // (args.workers * 4))))
+    else:
+        _init(records)
+        results = [run_origin(t) for t in tasks]
+    wall = time.perf_counter() - t0
+
+    summary = summarize(results, args.step)
+    for engine, s in summary.items():
+        print(f"\n[{engine}] MAE {s['mae']} | fit {s['fit_ms_mean']} ms | predict {s['predict_ms_mean']} ms "
+              f"| traced peak {s['traced_peak_mb_max']} MB | worker RSS {s['worker_rss_mb_max']} MB "
+              f"over {s['origins']} origins")
+        print(f"{'step':>5} {'lead min':>9} {'n':>6} {'MAE':>8} {'MAPE %':>8}")
+        for row in s["steps"]:
+            print(f"{row['step']:>5} {row['lead_minutes']:>9} {row['n']:>6} "
+                  f"{row['mae'] if row['mae'] is not None else '-':>8} {row['mape'] if row['mape'] is not None else '-':>8}")
+    print(f"\nwall time {wall:.2f}s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "records": len(records), "wall_seconds": round(wall, 3),
+                       "engines": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Frames/s and model requests with and without micro-batching, against the fake model.
+
+    python -m backend.benchmarks.bench_batching [--frames 96] [--callers 16] [--inflight 2] [--sizes 1,2,4,8]
+
+`callers` threads call GeminiDetector.detect concurrently (as the ingest
+workers do). The model allows at most `inflight` concurrent requests (a
+stand-in for the quota), so every configuration gets the same request
+budget; batch size 1 is the unbatched path. Per-request latency is
+--latency ms plus --per-image ms for each extra frame in the request.
+"""
+import time, argparse, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from backend.detectors import FakeGenerativeModel, GeminiDetector
+
+
+class LimitedModel:
+    """At most `inflight` generate_content calls at once; counts requests."""
+
+    def __init__(self, model, inflight: int):
+        self.model = model
+        self.slots = threading.Semaphore(inflight)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, parts):
+        with self.slots:
+            with self.lock:
+                self.requests += 1
+            return self.model.generate_content(parts)
+
+
+def run(size: int, args) -> dict:
+    model = LimitedModel(FakeGenerativeModel(latency_ms=args.latency, jitter_ms=args.latency / 10,
+                                             malformed_rate=args.malformed, per_image_ms=args.per_image, seed=0),
+                         args.inflight)
+    detector = GeminiDetector(model, batch_size=size, batch_wait_ms=args.wait, batch_concurrency=args.inflight)
+
+    def one(_):
+        t0 = time.perf_counter()
+        ok = detector.detect(None)["ok"]
+        return time.perf_counter() - t0, ok
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.callers) as pool:
+        results = list(pool.map(one, range(args.frames)))
+    wall = time.perf_counter() - t0
+    lat = np.array([r[0] for r in results]) * 1000
+    return {"size": size, "wall": wall, "fps": args.frames / wall, "requests": model.requests,
+            "p50": np.percentile(lat, 50), "p95": np.percentile(lat, 95),
+            "failed": sum(not r[1] for r in results)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--frames", type=int, default=96)
+    ap.add_argument("--callers", type=int, default=16)
+    ap.add_argument("--inflight", type=int, default=2, help="concurrent model requests allowed")
+    ap.add_argument("--sizes", default="1,2,4,8")
+    ap.add_argument("--latency", type=float, default=300, help="ms per request")
+    ap.add_argument("--per-image", type=float, default=30, help="extra ms per additional frame in a request")
+    ap.add_argument("--wait", type=float, default=50, help="GEMINI_BATCH_WAIT_MS")
+    ap.add_argument("--malformed", type=float, default=0.02, help="per-frame malformed answer rate")
+    args = ap.parse_args()
+
+    print(f"{args.frames} frames, {args.callers} callers, {args.inflight} requests in flight, "
+          f"{args.latency:g} ms + {args.per_image:g} ms/extra frame")
+    print(f"{'batch':>5} {'frames/s':>9} {'requests':>9} {'p50 ms':>8} {'p95 ms':>8} {'failed':>7}")
+    for size in map(int, args.sizes.split(",")):
+        r = run(size, args)
+        print(f"{r['size']:>5} {r['fps']:>9.1f} {r['requests']:>9} {r['p50']:>8.0f} {r['p95']:>8.0f} {r['failed']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Cold-start latency of the API, per endpoint.
+
+    python -m backend.benchmarks.bench_cold_start [--repeat 3] [--json out.json]
+
+Every measurement runs in a fresh interpreter: import backend.main, run the
+lifespan startup (TestClient), then time the first and second request to one
+endpoint. Heavy modules still loaded afterwards are listed, so a stray
+top-level import of pandas / scikit-learn / the Gemini SDK shows up here.
+"""
+import os, sys, json, argparse, subprocess
+import statistics
+
+ENDPOINTS = ["/status", "/history?limit=1", "/telemetry/latest", "/rollups", "/forecast?h=12", "/forecast?h=12&bands=true"]
+HEAVY = ["pandas", "sklearn", "scipy", "google.generativeai"]
+
+PROBE = r"""
+import os, sys, time, json
+t0 = time.perf_counter()
+import backend.main as main
+t_import = time.perf_counter() - t0
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    t_startup = time.perf_counter() - t0 - t_import
+    t1 = time.perf_counter(); status = client.get(sys.argv[1]).status_code; first = time.perf_counter() - t1
+    t1 = time.perf_counter(); client.get(sys.argv[1]); second = time.perf_counter() - t1
+print(json.dumps({"import": t_import, "startup": t_startup, "first": first, "second": second, "status": status,
+                  "loaded": [m for m in json.loads(sys.argv[2]) if m in sys.modules]}))
+"""
+
+
+def probe(endpoint: str, root: str) -> dict:
+    env = dict(os.environ, TELEMETRY_MQTT="0", PYTHONWARNINGS="ignore")
+    out = subprocess.run([sys.executable, "-c", PROBE, endpoint, json.dumps(HEAVY)], cwd=root, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    ap.add_argument("--json", help="write results here as JSON")
+    args = ap.parse_args()
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+    results = {}
+    print(f"{'endpoint':<28} {'import ms':>10} {'startup ms':>11} {'first ms':>9} {'second ms':>10}  heavy modules loaded")
+    for endpoint in args.endpoints.split(","):
+        runs = [probe(endpoint, root) for _ in range(args.repeat)]
+        med = {k: round(1000 * statistics.median(r[k] for r in runs), 1) for k in ("import", "startup", "first", "second")}
+        results[endpoint] = dict(med, status=runs[-1]["status"], loaded=runs[-1]["loaded"])
+        print(f"{endpoint:<28} {med['import']:>10} {med['startup']:>11} {med['first']:>9} {med['second']:>10}  "
+              f"{', '.join(runs[-1]['loaded']) or '-'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version.split()[0], "repeat": args.repeat, "endpoints": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare the random-forest path with the online SeasonalForecaster.
+
+    python -m backend.benchmarks.bench_forecasters [--weeks 4] [--every 5] [--horizon 168]
+
+Builds a synthetic history (weekday/weekend daily curves, slow trend, noise),
+holds out the last `horizon` hours, and reports MAE on the hold-out plus
+fit/update and predict latency for both engines.
+"""
+import time, argparse
+import numpy as np
+import pandas as pd
+
+from backend.predictor import SeasonalForecaster, fit_forecaster, horizon_index, predict_horizon
+
+TOTAL = 200
+
+
+def synthetic_history(weeks: int, every_minutes: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2026-01-05", periods=weeks * 7 * 24 * 60 // every_minutes, freq=f"{every_minutes}min")
+    hour = ts.hour + ts.minute / 60
+    weekday = ts.dayofweek < 5
+    daily = np.where(weekday, 0.55 * np.exp(-((hour - 13) / 4) ** 2), 0.25 * np.exp(-((hour - 15) / 5) ** 2))
+    trend = 0.05 * np.arange(len(ts)) / len(ts)
+    rate = np.clip(0.2 + daily + trend + rng.normal(0, 0.03, len(ts)), 0, 1)
+    return pd.DataFrame({"timestamp": ts, "taken_spots": np.rint(rate * TOTAL).astype(int), "estimated_total": TOTAL})
+
+
+def truth_at(df: pd.DataFrame, times: pd.DatetimeIndex) -> np.ndarray:
+    s = df.set_index("timestamp")["taken_spots"]
+    return s.reindex(times, method="nearest").to_numpy()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--weeks", type=int, default=4)
+    ap.add_argument("--every", type=int, default=5, help="minutes between records")
+    ap.add_argument("--horizon", type=int, default=168, help="hold-out hours")
+    args = ap.parse_args()
+
+    df = synthetic_history(args.weeks, args.every)
+    cut = df["timestamp"].iloc[-1] - pd.Timedelta(hours=args.horizon)
+    train, test = df[df["timestamp"] <= cut], df[df["timestamp"] > cut]
+    records = [{"timestamp": t.isoformat(), "taken_spots": int(v), "estimated_total": TOTAL}
+               for t, v in zip(train["timestamp"], train["taken_spots"])]
+    times = horizon_index(train["timestamp"].iloc[-1], args.horizon, 60)
+    truth = truth_at(test, times)
+    print(f"{len(records)} training records, {len(times)}-step hold-out")
+
+    t0 = time.perf_counter()
+    fitted = fit_forecaster(records)
+    fit_rf = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    rf = np.array([r["taken_spots"] for r in predict_horizon(fitted, args.horizon, 60)])
+    pred_rf = time.perf_counter() - t0
+
+    model = SeasonalForecaster()
+    t0 = time.perf_counter()
+    for r in records:
+        model.add(r)
+    fit_sf = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    sf = np.array([r["taken_spots"] for r in predict_horizon(model.fitted(), args.horizon, 60)])
+    pred_sf = time.perf_counter() - t0
+
+    print(f"{'engine':<10} {'MAE':>7} {'fit/replay s':>13} {'per-update us':>14} {'predict ms':>11}")
+    print(f"{'rf':<10} {np.abs(rf - truth).mean():7.2f} {fit_rf:13.3f} {'-':>14} {pred_rf * 1000:11.2f}")
+    print(f"{'seasonal':<10} {np.abs(sf - truth).mean():7.2f} {fit_sf:13.3f} "
+          f"{fit_sf / len(records) * 1e6:14.1f} {pred_sf * 1000:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark seek vs sequential frame extraction on a synthetic video.
+
+    python -m backend.benchmarks.bench_frame_extraction [--frames 1800] [--size 1280x720]
+
+Writes a temporary MP4 (mp4v, long GOP), then times extract_frames() in both
+modes for sparse and dense sampling so the SEEK_MIN_GAP crossover can be checked.
+"""
+import os, time, shutil, argparse, tempfile
+import cv2
+import numpy as np
+
+from backend.videos_to_frames import extract_frames
+
+
+def make_video(path, n_frames, width, height, fps=30):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(n_frames):
+        frame = background.copy()
+        # a moving "car" so frames are not identical
+        x = (i * 7) % (width - 80)
+        cv2.rectangle(frame, (x, height // 2), (x + 80, height // 2 + 40), (0, 0, 255), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--frames", type=int, default=1800)
+    ap.add_argument("--size", default="1280x720")
+    args = ap.parse_args()
+    width, height = map(int, args.size.split("x"))
+
+    tmp = tempfile.mkdtemp(prefix="bench_frames_")
+    try:
+        video = os.path.join(tmp, "synthetic.mp4")
+        make_video(video, args.frames, width, height)
+        cases = [
+            ("sparse: 10 frames", {"num_frames": 10}),
+            ("dense: every 0.5 s", {"every_seconds": 0.5}),
+            ("dense: 1 per frame-gap of 5", {"every_seconds": 5 / 30}),
+        ]
+        print(f"{'case':<30} {'mode':<11} {'frames':>6} {'seconds':>8}")
+        for label, kwargs in cases:
+            for mode in ("seek", "sequential"):
+                out = os.path.join(tmp, f"out_{mode}")
+                t0 = time.perf_counter()
+                n = extract_frames(video, out, mode=mode, **kwargs)
+                elapsed = time.perf_counter() - t0
+                shutil.rmtree(out, ignore_errors=True)
+                print(f"{label:<30} {mode:<11} {n:>6} {elapsed:>8.3f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
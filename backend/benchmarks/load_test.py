@@ -0,0 +1,294 @@
+"""
+Load test for the API against a local stand-in for the vision model.
+
+    python -m backend.benchmarks.load_test backend/benchmarks/scenarios/mixed.json [--json out.json]
+    python -m backend.benchmarks.load_test scenario.json --url http://127.0.0.1:8000   # running server
+
+By default the harness starts its own server (uvicorn, DETECTOR=fake, the
+scenario's fake_model settings as FAKE_MODEL_* env) on a temporary data dir
+(PARKING_DATA_DIR), seeds one lot per history size, and tears it all down
+afterwards, so no Gemini quota is spent and backend/data is never touched.
+
+A scenario is a list of phases. Each phase runs `concurrency` closed-loop
+clients for `duration` seconds, picking operations by weight from `mix`,
+against a lot seeded with `history_records` records. Ingest operations are
+timed to the 202 and, with "follow_jobs", also to job completion
+(<op>:job), which is where the model latency and the ingest queue show up.
+
+Per phase and operation: throughput, p50/p95/p99/max latency and an error
+breakdown (http_<status>, timeout, connect, job_error); plus the server-side
+fallback / parse-failure / 429 counters from /metrics over the phase.
+"""
+import os, io, sys, json, time, random, shutil, asyncio, argparse, tempfile, subprocess, platform
+from collections import defaultdict
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from backend.benchmarks.bench_forecasters import synthetic_history
+from backend.storage import open_store
+
+OPS = ("ingest_frame", "ingest_upload", "history", "history_range", "forecast", "forecast_bands", "status")
+INGEST_OPS = ("ingest_frame", "ingest_upload")
+SERVER_COUNTERS = ("parking_fallbacks_total", "parking_parse_failures_total", "parking_rate_limited_total")
+JOB_POLL_SEC = 0.05
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+# ---------- Fixtures ----------
+def make_frames(directory: str, n: int, seed: int = 0) -> list:
+    """Distinct JPEGs (random blocks), so the perceptual-hash cache does not absorb the load."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(n):
+        blocks = rng.integers(0, 255, (6, 8, 3), dtype=np.uint8)
+        im = Image.fromarray(blocks).resize((640, 480), Image.NEAREST)
+        path = os.path.join(directory, f"frame_{i:03d}.jpg")
+        im.save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+def lot_for(history_records: int) -> str:
+    return f"load{history_records}"
+
+
+def seed_lot(data_dir: str, history_records: int):
+    """Write a synthetic history for the phase's lot straight into its store (before the server starts)."""
+    every = 5
+    weeks = max(1, -(-history_records * every // (7 * 24 * 60)))
+    df = synthetic_history(weeks, every).tail(history_records)
+    records = [{"timestamp": t.isoformat(), "taken_spots": int(v), "estimated_total": int(n),
+                "open_spots": int(n - v), "source": "load-test seed", "confidence": 0.0}
+               for t, v, n in zip(df["timestamp"], df["taken_spots"], df["estimated_total"])]
+    lot_dir = os.path.join(data_dir, "lots", lot_for(history_records))
+    os.makedirs(lot_dir, exist_ok=True)
+    open_store(lot_dir).rewrite(records)
+
+
+# ---------- Server ----------
+def start_server(data_dir: str, port: int, fake_model: dict, env_overrides: dict):
+    env = dict(os.environ, PARKING_DATA_DIR=data_dir, DETECTOR="fake", TELEMETRY_MQTT="0", PYTHONWARNINGS="ignore")
+    for key, value in fake_model.items():
+        env[f"FAKE_MODEL_{key.upper()}"] = str(value)
+    env.update({k: str(v) for k, v in env_overrides.items()})
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port),
+                             "--log-level", "warning"], cwd=ROOT, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/status", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("server did not come up within 60s")
+
+
+def scrape_counters(client: httpx.Client) -> dict:
+    """Server-side counters from /metrics, keyed by the full series line (name + labels)."""
+    try:
+        text = client.get("/metrics").text
+    except httpx.HTTPError:
+        return {}
+    out = {}
+    for line in text.splitlines():
+        if line.startswith(SERVER_COUNTERS):
+            series, value = line.rsplit(" ", 1)
+            out[series] = float(value)
+    return out
+
+
+# ---------- Load ----------
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def ok(self, op: str, seconds: float):
+        self.latency[op].append(seconds)
+
+    def error(self, op: str, kind: str):
+        self.errors[op][kind] += 1
+
+    def summary(self, wall: float) -> dict:
+        out = {}
+        for op in sorted(set(self.latency) | set(self.errors)):
+            lat = np.array(self.latency[op]) * 1000
+            errors = dict(self.errors[op])
+            n = len(lat) + sum(errors.values())
+            out[op] = {"count": n, "ok": len(lat), "throughput_rps": round(len(lat) / wall, 2),
+                       "error_rate": round(sum(errors.values()) / n, 4) if n else 0.0, "errors": errors}
+            if len(lat):
+                p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+                out[op].update(p50_ms=round(p50, 2), p95_ms=round(p95, 2), p99_ms=round(p99, 2),
+                               mean_ms=round(float(lat.mean()), 2), max_ms=round(float(lat.max()), 2))
+        return out
+
+
+async def follow_job(client: httpx.AsyncClient, op: str, job_id: str, t0: float, rec: Recorder, timeout: float):
+    deadline = t0 + timeout
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(JOB_POLL_SEC)
+        try:
+            job = (await client.get(f"/ingest/jobs/{job_id}")).json()
+        except httpx.HTTPError:
+            continue
+        if job.get("status") == "done":
+            rec.ok(f"{op}:job", time.perf_counter() - t0)
+            return
+        if job.get("status") == "error":
+            rec.error(f"{op}:job", "job_error")
+            return
+    rec.error(f"{op}:job", "timeout")
+
+
+async def request(client: httpx.AsyncClient, op: str, lot: str, frames: list, rng: random.Random):
+    if op == "ingest_frame":
+        return await client.post("/ingest/frame", json={"path": rng.choice(frames), "lot": lot})
+    if op == "ingest_upload":
+        with open(rng.choice(frames), "rb") as f:
+            data = f.read()
+        return await client.post("/ingest/upload", params={"lot": lot},
+                                 files={"file": ("frame.jpg", io.BytesIO(data), "image/jpeg")})
+    if op == "history":
+        return await client.get("/history", params={"limit": 200, "lot": lot})
+    if op == "history_range":
+        return await client.get("/history", params={"since": "2000-01-01T00:00:00", "limit": 5000, "lot": lot})
+    if op == "forecast":
+        return await client.get("/forecast", params={"h": 24, "lot": lot})
+    if op == "forecast_bands":
+        return await client.get("/forecast", params={"h": 24, "lot": lot, "bands": "true"})
+    return await client.get("/status", params={"lot": lot})
+
+
+async def client_loop(client, phase: dict, lot: str, frames: list, rec: Recorder, stop_at: float, seed: int,
+                      pending: list):
+    rng = random.Random(seed)
+    ops, weights = zip(*phase["mix"].items())
+    think = phase.get("think_ms", 0) / 1000
+    while time.perf_counter() < stop_at:
+        op = rng.choices(ops, weights)[0]
+        t0 = time.perf_counter()
+        try:
+            r = await request(client, op, lot, frames, rng)
+        except httpx.TimeoutException:
+            rec.error(op, "timeout")
+        except httpx.TransportError:
+            rec.error(op, "connect")
+        else:
+            body = r.json() if r.headers.get("content-type", "").startswith("application/json") else {}
+            if r.status_code >= 400 or (isinstance(body, dict) and body.get("ok") is False):
+                rec.error(op, f"http_{r.status_code}")
+            else:
+                rec.ok(op, time.perf_counter() - t0)
+                if op in INGEST_OPS and phase.get("follow_jobs") and body.get("job_id"):
+                    pending.append(asyncio.create_task(
+                        follow_job(client, op, body["job_id"], t0, rec, phase.get("job_timeout", 120))))
+        if think:
+            await asyncio.sleep(think)
+
+
+async def run_phase(url: str, phase: dict, lot: str, frames: list, timeout: float, seed: int) -> dict:
+    rec = Recorder()
+    pending = []
+    limits = httpx.Limits(max_connections=phase["concurrency"] * 2, max_keepalive_connections=phase["concurrency"] * 2)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        t0 = time.perf_counter()
+        stop_at = t0 + phase["duration"]
+        await asyncio.gather(*(client_loop(client, phase, lot, frames, rec, stop_at, seed + i, pending)
+                               for i in range(phase["concurrency"])))
+        wall = time.perf_counter() - t0
+        if pending:
+            await asyncio.gather(*pending)  # let queued ingests finish (bounded by job_timeout)
+    ops = rec.summary(wall)
+    total = sum(s["ok"] for op, s in ops.items() if ":" not in op)  # requests, not followed jobs
+    return {"wall_seconds": round(wall, 3), "requests_ok": total, "throughput_rps": round(total / wall, 2),
+            "ops": ops}
+
+
+def diff_counters(before: dict, after: dict) -> dict:
+    return {k: after[k] - before.get(k, 0) for k in sorted(after) if after[k] - before.get(k, 0)}
+
+
+def git_version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("scenario", help="scenario JSON file (see backend/benchmarks/scenarios/)")
+    ap.add_argument("--url", help="load an already running server instead of starting one (no seeding)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--frames", type=int, default=64, help="distinct test frames")
+    ap.add_argument("--timeout", type=float, default=30, help="per-request timeout, seconds")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="write results here as JSON")
+    args = ap.parse_args()
+
+    with open(args.scenario, "r") as f:
+        scenario = json.load(f)
+    for phase in scenario["phases"]:
+        unknown = set(phase["mix"]) - set(OPS)
+        if unknown:
+            raise SystemExit(f"unknown operations in phase {phase.get('name')}: {sorted(unknown)}")
+
+    tmp = tempfile.mkdtemp(prefix="parking_load_")
+    proc = None
+    try:
+        frames = make_frames(os.path.join(tmp, "frames"), args.frames, args.seed)
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            data_dir = os.path.join(tmp, "data")
+            for size in sorted({p.get("history_records", 0) for p in scenario["phases"]}):
+                t0 = time.perf_counter()
+                seed_lot(data_dir, size)
+                print(f"seeded {lot_for(size)} with {size} records in {time.perf_counter() - t0:.1f}s")
+            proc, url = start_server(data_dir, args.port, scenario.get("fake_model", {}), scenario.get("server_env", {}))
+
+        results = []
+        with httpx.Client(base_url=url, timeout=10) as admin:
+            for i, phase in enumerate(scenario["phases"]):
+                lot = phase.get("lot") or lot_for(phase.get("history_records", 0))
+                before = scrape_counters(admin)
+                print(f"\n[{phase.get('name', i)}] {phase['concurrency']} clients x {phase['duration']}s on {lot}")
+                out = asyncio.run(run_phase(url, phase, lot, frames, args.timeout, args.seed + 1000 * i))
+                out.update(name=phase.get("name", str(i)), lot=lot, concurrency=phase["concurrency"],
+                           history_records=phase.get("history_records"),
+                           server_counters=diff_counters(before, scrape_counters(admin)))
+                results.append(out)
+
+                print(f"{out['throughput_rps']} req/s over {out['wall_seconds']}s")
+                print(f"{'op':<22} {'ok':>6} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err %':>6}  errors")
+                for op, s in out["ops"].items():
+                    print(f"{op:<22} {s['ok']:>6} {s['throughput_rps']:>7} {s.get('p50_ms', '-'):>8} "
+                          f"{s.get('p95_ms', '-'):>8} {s.get('p99_ms', '-'):>8} {100 * s['error_rate']:>6.1f}  "
+                          f"{json.dumps(s['errors']) if s['errors'] else '-'}")
+                for series, delta in out["server_counters"].items():
+                    print(f"  server {series} +{delta:g}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scenario": scenario.get("name", os.path.basename(args.scenario)), "version": git_version(),
+                       "python": platform.python_version(), "started_server": proc is not None,
+                       "fake_model": scenario.get("fake_model", {}), "phases": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
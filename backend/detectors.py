@@ -0,0 +1,302 @@
+"""
+Occupancy detectors: the pluggable inference backends behind /ingest/*.
+
+- GeminiDetector: remote vision model, aggregate counts only; with
+  GEMINI_BATCH_SIZE > 1 frames from concurrent ingests share one request
+  (backend/batching.py). Give it INGEST_WORKERS >= batch size x
+  GEMINI_BATCH_CONCURRENCY so batches can fill.
+- LocalStallDetector: CPU-only per-stall classifier against an empty-lot reference
+- NullDetector: no model configured (0 / 0)
+- DETECTOR=fake: the Gemini path against FakeGenerativeModel, a local stand-in
+  with configurable latency, error and malformed-output rates (load tests)
+
+Select one per deployment with DETECTOR=gemini|local|fake|none. Without DETECTOR,
+Gemini is used when GEMINI_API_KEY is set and nothing otherwise (old behaviour).
+"""
+import os, json, time, random, threading
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+# OpenCV is imported by the local stall detector when it is built, Pillow by whoever decodes frames
+if TYPE_CHECKING:
+    from PIL import Image
+
+from backend.batching import MicroBatcher, parse_counts, request_parts, response_text
+from backend.metrics import INGEST_STAGE, PARSE_FAILURES, RATE_LIMITED, timed
+
+BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "1"))  # 1 = one frame per request
+BATCH_WAIT_MS = float(os.getenv("GEMINI_BATCH_WAIT_MS", "250"))
+BATCH_CONCURRENCY = int(os.getenv("GEMINI_BATCH_CONCURRENCY", "2"))
+
+
+class Detector:
+    """
+    detect(im) -> {"occupied": int, "open_spots": int, "ok": bool, ...}
+    ok is False when the numbers are a soft default rather than a real count.
+    """
+    name = "none"
+    source = "fallback"
+    confidence = 0.4
+    cacheable = False  # worth putting the perceptual-hash cache in front of it
+
+    def detect(self, im: "Image.Image") -> dict:
+        raise NotImplementedError
+
+
+class NullDetector(Detector):
+    def detect(self, im: "Image.Image") -> dict:
+        return {"occupied": 0, "open_spots": 0, "ok": True}
+
+
+class GeminiDetector(Detector):
+    name = "gemini"
+    source = "Gemini scan"
+    confidence = 0.75
+    cacheable = True
+
+    def __init__(self, model, batch_size: int = 1, batch_wait_ms: float = BATCH_WAIT_MS,
+                 batch_concurrency: int = BATCH_CONCURRENCY, name: str = "gemini"):
+        self.model = model
+        self.name = name
+        self.batcher = MicroBatcher(model, batch_size, batch_wait_ms, batch_concurrency, name) \
+            if batch_size > 1 else None
+
+    @classmethod
+    def from_env(cls) -> Optional["GeminiDetector"]:
+        try:
+            import google.generativeai as genai
+        except Exception:
+            return None
+        if not os.getenv("GEMINI_API_KEY"):
+            return None
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        return cls(genai.GenerativeModel("gemini-1.5-flash"), batch_size=BATCH_SIZE)
+
+    def detect(self, im: "Image.Image") -> dict:
+        soft_default = {"occupied": 100, "open_spots": 80, "ok": False}
+        try:
+            if self.batcher is not None:
+                counts = self.batcher.detect(im)  # timed per request inside the batcher
+            else:
+                with timed(INGEST_STAGE, stage="model_call", detector=self.name):
+                    resp = self.model.generate_content(request_parts([im]))
+                with timed(INGEST_STAGE, stage="parse", detector=self.name):
+                    counts = parse_counts(response_text(resp))
+        except Exception as e:
+            if "429" in str(e) or type(e).__name__ in ("ResourceExhausted", "TooManyRequests"):
+                RATE_LIMITED.inc(source="model")
+            return soft_default
+        if counts is None:
+            PARSE_FAILURES.inc(detector=self.name)
+            return soft_default
+        return {"occupied": counts[0], "open_spots": counts[1], "ok": True}
+
+
+class FakeModelError(Exception):
+    pass
+
+
+class FakeGenerativeModel:
+    """
+    Stand-in for genai.GenerativeModel: generate_content sleeps for the
+    configured latency (plus per_image_ms for every extra image in a batch),
+    then fails (quota-style 429), answers with something unparseable, or
+    returns plausible counts (plain or fenced JSON, as the real model does).
+    Multi-image requests get a JSON array in which each entry is malformed
+    with malformed_rate on its own. No network, no quota.
+    """
+
+    class Response:
+        def __init__(self, text: str):
+            self.text = text
+
+    MALFORMED = (
+        "I can see roughly {occupied} cars and {open} free spaces.",
+        '{{"open_spots": {open}, "occupied": ',
+        '{{"open_spots": "about {open}", "occupied": "{occupied}ish"}}',
+        "```json\n[{{\"open_spots\": {open}}}]\n```",
+    )
+
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 200, error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, per_image_ms: float = 50, seed: Optional[int] = None):
+        self.latency_ms, self.jitter_ms, self.per_image_ms = latency_ms, jitter_ms, per_image_ms
+        self.error_rate, self.malformed_rate = error_rate, malformed_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeGenerativeModel":
+        seed = os.getenv("FAKE_MODEL_SEED")
+        return cls(latency_ms=float(os.getenv("FAKE_MODEL_LATENCY_MS", "800")),
+                   jitter_ms=float(os.getenv("FAKE_MODEL_JITTER_MS", "200")),
+                   error_rate=float(os.getenv("FAKE_MODEL_ERROR_RATE", "0")),
+                   malformed_rate=float(os.getenv("FAKE_MODEL_MALFORMED_RATE", "0")),
+                   per_image_ms=float(os.getenv("FAKE_MODEL_PER_IMAGE_MS", "50")),
+                   seed=int(seed) if seed else None)
+
+    def generate_content(self, parts):
+        n = sum(1 for p in parts if not isinstance(p, str))
+        with self._lock:  # one RNG shared by the ingest workers
+            delay = (max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) + self.per_image_ms * (n - 1)) / 1000
+            roll = self._rng.random()
+            counts = [(self._rng.randint(0, 150), self._rng.randint(0, 80)) for _ in range(n)]
+            bad_items = [self._rng.random() < self.malformed_rate for _ in range(n)]
+            fenced = self._rng.random() < 0.5
+            template = self._rng.choice(self.MALFORMED)
+        time.sleep(delay)
+        if roll < self.error_rate:
+            raise FakeModelError("429 Resource has been exhausted (fake model)")
+        if n > 1:
+            items = [{"frame": i, "open_spots": "unclear" if bad else o, "occupied": c}
+                     for i, ((c, o), bad) in enumerate(zip(counts, bad_items), 1)]
+            text = json.dumps(items)
+        elif roll < self.error_rate + self.malformed_rate:
+            return self.Response(template.format(occupied=counts[0][0], open=counts[0][1]))
+        else:
+            text = json.dumps({"open_spots": counts[0][1], "occupied": counts[0][0]})
+        return self.Response(f"```json\n{text}\n```" if fenced else text)
+
+
+class LocalStallDetector(Detector):
+    """
+    Classifies each stall of a fixed layout against an empty-lot reference image.
+
+    Layout file (STALL_LAYOUT, JSON):
+        {
+          "reference": "empty_lot.jpg",        # relative to the layout file
+          "stalls": [{"id": "A1", "polygon": [[x, y], ...]}, ...],
+          "threshold": 0.3,                    # optional, score above → occupied
+          "pixel_delta": 40                    # optional, per-pixel change vs reference
+        }
+    Polygons are in reference-image pixels; frames of another size are resized.
+
+    All stalls are scored at once: a label image maps every pixel to its stall
+    and np.bincount sums per-stall changed-pixel share, edge density and
+    intensity variance against the reference in one pass each.
+    """
+    name = "local"
+    source = "local stalls"
+    confidence = 0.6
+
+    def __init__(self, layout_path: str):
+        import cv2
+        with open(layout_path, "r") as f:
+            layout = json.load(f)
+        ref_path = os.path.join(os.path.dirname(os.path.abspath(layout_path)), layout["reference"])
+        reference = cv2.imread(ref_path)
+        if reference is None:
+            raise ValueError(f"cannot read reference image: {ref_path}")
+
+        self.stall_ids = [str(s["id"]) for s in layout["stalls"]]
+        self.threshold = float(layout.get("threshold", 0.3))
+        self.pixel_delta = int(layout.get("pixel_delta", 40))
+        self.size = (reference.shape[1], reference.shape[0])
+
+        # label image: 0 = not a stall, i + 1 = stall i; cropped to the stalls' bounding box
+        labels = np.zeros(reference.shape[:2], dtype=np.int32)
+        for i, stall in enumerate(layout["stalls"]):
+            cv2.fillPoly(labels, [np.asarray(stall["polygon"], dtype=np.int32)], i + 1)
+        ys, xs = np.nonzero(labels)
+        if not len(ys):
+            raise ValueError("stall layout has no pixels inside the reference image")
+        self.polygons = [s["polygon"] for s in layout["stalls"]]
+        self.crop = (slice(ys.min(), ys.max() + 1), slice(xs.min(), xs.max() + 1))
+        self.labels = labels[self.crop]
+        self.n = len(self.stall_ids)
+        self.area = np.maximum(np.bincount(self.labels.ravel(), minlength=self.n + 1)[1:], 1)
+
+        # per-stall bounding boxes (y0, y1, x0, x1) inside the crop, for partial re-evaluation
+        h, w = self.labels.shape
+        self.boxes = np.zeros((self.n, 4), dtype=np.int32)
+        for i, poly in enumerate(self.polygons):
+            x, y, bw, bh = cv2.boundingRect(np.asarray(poly, dtype=np.int32))
+            y0, x0 = y - self.crop[0].start, x - self.crop[1].start
+            self.boxes[i] = (max(0, y0), min(h, y0 + bh), max(0, x0), min(w, x0 + bw))
+
+        self.ref = reference[self.crop]
+        self.ref_edges, self.ref_std = self._features(self.ref, self.labels)
+
+    @classmethod
+    def from_env(cls, layout_path: Optional[str] = None) -> "LocalStallDetector":
+        path = layout_path or os.getenv("STALL_LAYOUT", os.path.join(os.path.dirname(__file__), "data", "stall_layout.json"))
+        return cls(path)
+
+    def _sum(self, values: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        return np.bincount(labels.ravel(), weights=values.ravel(), minlength=self.n + 1)[1:]
+
+    def _features(self, bgr: np.ndarray, labels: np.ndarray):
+        import cv2
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        edges = self._sum(cv2.Canny(gray, 80, 160) > 0, labels) / self.area
+        g = gray.astype(np.float32)
+        mean = self._sum(g, labels) / self.area
+        std = np.sqrt(np.maximum(self._sum(g * g, labels) / self.area - mean ** 2, 0))
+        return edges, std
+
+    def roi(self, bgr: np.ndarray) -> np.ndarray:
+        """The stalls' bounding box of a frame, resized to the reference size if needed."""
+        if (bgr.shape[1], bgr.shape[0]) != self.size:
+            import cv2
+            bgr = cv2.resize(bgr, self.size, interpolation=cv2.INTER_AREA)
+        return bgr[self.crop]
+
+    def classify(self, bgr: np.ndarray, stalls: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Per-stall occupancy as a bool vector aligned with stall_ids.
+        With `stalls` (indices), only the window covering those stalls is
+        processed and only their entries are meaningful.
+        """
+        return self.classify_roi(self.roi(bgr), stalls)
+
+    def classify_roi(self, roi: np.ndarray, stalls: Optional[np.ndarray] = None) -> np.ndarray:
+        import cv2
+        if stalls is None:
+            win = (slice(None), slice(None))
+        else:
+            b = self.boxes[stalls]
+            win = (slice(b[:, 0].min(), b[:, 1].max()), slice(b[:, 2].min(), b[:, 3].max()))
+        roi, ref, labels = roi[win], self.ref[win], self.labels[win]
+        edges, std = self._features(roi, labels)
+        ref_edges, ref_std = (self.ref_edges, self.ref_std) if stalls is None else self._features(ref, labels)
+        # share of the stall that differs clearly from the empty lot
+        changed = self._sum(cv2.absdiff(roi, ref).max(axis=2) > self.pixel_delta, labels) / self.area
+        score = (0.6 * changed
+                 + 0.25 * np.minimum(np.abs(edges - ref_edges) * 4, 1)
+                 + 0.15 * np.minimum(np.abs(std - ref_std) / 64.0, 1))
+        return score > self.threshold
+
+    def detect(self, im: "Image.Image") -> dict:
+        bgr = np.asarray(im.convert("RGB"))[:, :, ::-1]
+        occupied = self.classify(np.ascontiguousarray(bgr))
+        taken = int(occupied.sum())
+        return {"occupied": taken, "open_spots": self.n - taken, "ok": True,
+                "occupied_stalls": [sid for sid, o in zip(self.stall_ids, occupied) if o]}
+
+
+def make_detector(name: Optional[str] = None, layout_path: Optional[str] = None) -> Detector:
+    """
+    Build the configured detector; falls back to NullDetector if it cannot be set up.
+    layout_path overrides STALL_LAYOUT for the local detector (one layout per lot).
+    """
+    name = (name or os.getenv("DETECTOR", "")).lower()
+    if name in ("", "gemini"):
+        detector = GeminiDetector.from_env()
+        if detector:
+            return detector
+        if name == "gemini":
+            print("⚠️ DETECTOR=gemini but Gemini is unavailable (no GEMINI_API_KEY?), using none")
+        return NullDetector()
+    if name == "fake":
+        detector = GeminiDetector(FakeGenerativeModel.from_env(), batch_size=BATCH_SIZE, name="fake")
+        detector.source = "fake model"
+        return detector
+    if name == "local":
+        try:
+            return LocalStallDetector.from_env(layout_path)
+        except Exception as e:
+            print(f"⚠️ local detector unavailable ({e}), using none")
+            return NullDetector()
+    if name != "none":
+        print(f"⚠️ unknown DETECTOR={name}, using none")
+    return NullDetector()
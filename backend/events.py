@@ -0,0 +1,75 @@
+"""
+In-process event bus behind the /events Server-Sent Events stream.
+
+Ingest workers and the forecast trainer publish from plain threads; each SSE
+client owns an asyncio queue that events are handed to with
+call_soon_threadsafe, so publishing never blocks on a slow viewer. A viewer
+whose queue fills up is dropped (it reconnects and replays via Last-Event-ID).
+"""
+import asyncio, itertools, threading
+from collections import deque
+from typing import List, Tuple
+
+QUEUE_SIZE = 256    # per subscriber
+REPLAY_SIZE = 512   # recent events kept for Last-Event-ID resumes
+
+Event = Tuple[int, str, dict]  # (id, kind, data)
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def _put(self, event: Event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventBus:
+    def __init__(self, replay_size: int = REPLAY_SIZE):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._recent = deque(maxlen=replay_size)
+        self._subs = set()
+        self.stats = {"published": 0, "dropped_subscribers": 0}
+
+    def publish(self, kind: str, data: dict) -> int:
+        """Thread-safe; returns the event id."""
+        with self._lock:
+            event = (next(self._ids), kind, data)
+            self._recent.append(event)
+            self.stats["published"] += 1
+            subs = list(self._subs)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._put, event)
+            except RuntimeError:  # loop closed under us
+                self.unsubscribe(sub)
+        return event[0]
+
+    def subscribe(self) -> Subscription:
+        """Call from the event loop that will consume the subscription."""
+        sub = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+            if sub.overflowed:
+                self.stats["dropped_subscribers"] += 1
+
+    def since(self, last_id: int) -> List[Event]:
+        """Buffered events after last_id (older ones are gone; the client should refetch)."""
+        with self._lock:
+            return [e for e in self._recent if e[0] > last_id]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, subscribers=len(self._subs),
+                        last_id=self._recent[-1][0] if self._recent else 0)
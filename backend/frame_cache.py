@@ -0,0 +1,95 @@
+"""
+Perceptual-hash result cache for ingested frames.
+
+While the drone hovers, consecutive snapshots are near-identical. A 64-bit
+dHash of the downscaled grayscale frame lets us recognise them and reuse the
+counts from the earlier model call instead of paying for another one.
+"""
+import os, time, threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+MAX_DISTANCE = int(os.getenv("FRAME_CACHE_DISTANCE", "4"))  # bits out of 64
+MAX_ENTRIES = int(os.getenv("FRAME_CACHE_SIZE", "256"))
+TTL_SECONDS = float(os.getenv("FRAME_CACHE_TTL", "600"))
+
+
+def dhash(image: "Image.Image", size: int = 8) -> int:
+    """
+    Difference hash: shrink to (size+1) x size grayscale and record whether each
+    pixel is brighter than its right neighbour. size=8 → 64-bit int.
+    """
+    from PIL import Image
+    small = image.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = small.tobytes()
+    bits = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class FrameResultCache:
+    """
+    LRU + TTL map from frame hash to a model result. Lookups match any entry
+    within max_distance bits, so small sensor noise or compression changes still hit.
+    The TTL counts from when the model answered; hits do not extend it.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, max_entries: int = MAX_ENTRIES,
+                 ttl_seconds: float = TTL_SECONDS):
+        self.max_distance = max_distance
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # hash -> (stored_at, result)
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "saved_model_calls": 0, "evictions": 0}
+
+    def _expire(self, now: float):
+        # entries are in LRU order, not insertion order, so every one needs checking
+        expired = [h for h, (stored_at, _) in self._entries.items() if now - stored_at > self.ttl_seconds]
+        for h in expired:
+            del self._entries[h]
+        self.stats["evictions"] += len(expired)
+
+    def lookup(self, h: int) -> Optional[Tuple[dict, int]]:
+        """Return (result, distance) of the closest live entry within max_distance."""
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._expire(now)
+            best, best_d = None, self.max_distance + 1
+            for key in self._entries:
+                d = hamming(h, key)
+                if d < best_d:
+                    best, best_d = key, d
+                    if d == 0:
+                        break
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            self.stats["hits"] += 1
+            self.stats["saved_model_calls"] += 1
+            return self._entries[best][1], best_d
+
+    def store(self, h: int, result: dict):
+        with self._lock:
+            self._entries[h] = (time.time(), result)
+            self._entries.move_to_end(h)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return dict(self.stats, entries=len(self._entries),
+                        hit_rate=round(self.stats["hits"] / lookups, 4) if lookups else 0.0)
@@ -1,86 +1,229 @@
-import google.generativeai as genai
-import os, json, time
+# Run from the repo root: python -m backend.frames_to_json [--batch-size 4] [--stub]
+import os, json, time, random, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from PIL import Image
 from dotenv import load_dotenv
 
+from backend.batching import parse_batch, request_parts, response_text
+from backend.detectors import FakeGenerativeModel
+
 # Load API key from .env
 load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-model = genai.GenerativeModel("gemini-1.5-flash")
-results = []
 
 frames_dir = "backend/data/frames/"
+output_jsonl = "backend/parking_history.jsonl"  # checkpoint, appended one line per frame
 output_json = "backend/parking_history.json"
 
-prompt = """
-You are analyzing a parking lot from a drone.
-Count how many parking spaces are visible.
-Tell me:
-- How many are occupied by cars
-- How many are open
-Keep the estimated total as (occupied + open).
-Return ONLY JSON in the format:
-{"open_spots": X, "occupied": Y}
-"""
-
-for filename in sorted(os.listdir(frames_dir)):
-    if filename.endswith(".jpg"):
-        frame_path = os.path.join(frames_dir, filename)
-        img = Image.open(frame_path)
-
-        success = False
-        retries = 0
-
-        while not success and retries < 3:  # retry up to 3 times
-            try:
-                response = model.generate_content([prompt, img])
-                raw = response.text.strip()
-                print(f"🔎 Gemini raw output for {filename}:\n{raw}\n")
-
-                # Clean Gemini output (strip markdown code fences like ```json ... ```)
-                if raw.startswith("```"):
-                    raw = raw.strip("`")  
-                    raw = raw.replace("json", "", 1).strip()
-
-                # Parse JSON if valid
-                if raw.startswith("{") and raw.endswith("}"):
-                    parsed = json.loads(raw)
-
-                    occupied = int(parsed.get("occupied", 0))
-                    open_spots = int(parsed.get("open_spots", 0))
-                    total = occupied + open_spots
-
-                    results.append({
-                        "timestamp": datetime.now().isoformat(),
-                        "frame": filename,
-                        "taken_spots": occupied,
-                        "open_spots": open_spots,
-                        "estimated_total": total,
-                        "confidence": 0.75,
-                        "source": "Gemini scan"
-                    })
-
-                    print(f"✅ Processed {filename}: {occupied} taken / {open_spots} open")
-                    success = True
-                else:
-                    print(f"⚠️ Skipping {filename} - not valid JSON")
-                    success = True  # skip without retry
-
-            except Exception as e:
-                err = str(e)
-                if "429" in err:  # quota exceeded
-                    wait_time = 40
-                    print(f"⏳ Quota exceeded, waiting {wait_time}s before retry...")
-                    time.sleep(wait_time)
-                    retries += 1
-                else:
-                    print(f"⚠️ Error processing {filename}: {e}")
-                    success = True  # don't retry on other errors
-
-# Save all results to JSON
-with open(output_json, "w") as f:
-    json.dump(results, f, indent=2)
-
-print(f"\n📂 Saved {len(results)} entries to {output_json}")
+
+# ---------- Rate limiting ----------
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` requests per second on average, bursts up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def backoff_delay(attempt: int, base: float = 2.0, cap: float = 60.0) -> float:
+    # "full jitter" exponential backoff: uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+# ---------- Model ----------
+def load_model(stub: bool, stub_latency: float, stub_429: float, stub_malformed: float = 0.0):
+    if stub:
+        # local stand-in (backend/detectors.py): no network, no quota
+        return FakeGenerativeModel(latency_ms=stub_latency * 1000, jitter_ms=0, error_rate=stub_429,
+                                   malformed_rate=stub_malformed)
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel("gemini-1.5-flash")
+
+
+# ---------- Checkpoint / output ----------
+def load_checkpoint(path: str) -> dict:
+    """frame filename -> record, for every frame already written to the JSONL checkpoint."""
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    done[record["frame"]] = record
+                except Exception:
+                    continue  # torn last line from an interrupted run
+    return done
+
+
+class CheckpointWriter:
+    """
+    Appends one JSON line per finished frame and flushes it immediately. A torn
+    last line left by an interrupted run is cut off first, so the next record
+    starts on a line of its own instead of being glued to it.
+    """
+
+    def __init__(self, path: str):
+        if os.path.exists(path):
+            with open(path, "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n") + 1)
+                    print(f"⚠️ Dropped a torn last line from {path}")
+        self.f = open(path, "a")
+        self.lock = threading.Lock()
+
+    def write(self, record: dict):
+        with self.lock:
+            self.f.write(json.dumps(record) + "\n")
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+# ---------- Worker ----------
+def process_frames(model, frame_paths: list, bucket: TokenBucket, max_retries: int = 5) -> list:
+    """
+    Run a batch of frames through the model in one request (one frame = the
+    single-frame prompt). Only this batch backs off on a 429; other workers
+    keep going. Unreadable files are skipped and left out of the request.
+    Returns one history record per frame that got usable counts; the others
+    stay out of the checkpoint and are retried on the next run.
+    """
+    filenames, images = [], []
+    for path in frame_paths:
+        try:
+            im = Image.open(path)
+            im.load()  # decode now: a truncated file fails here, not halfway through the request
+        except Exception as e:
+            print(f"⚠️ Skipping {os.path.basename(path)} - unreadable frame: {e}")
+            continue
+        filenames.append(os.path.basename(path))
+        images.append(im)
+    if not images:
+        return []
+    try:
+        return _request(model, filenames, images, bucket, max_retries)
+    finally:
+        for im in images:
+            im.close()
+
+
+def _request(model, filenames: list, images: list, bucket: TokenBucket, max_retries: int) -> list:
+    label = filenames[0] if len(filenames) == 1 else f"{filenames[0]} (+{len(filenames) - 1})"
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            response = model.generate_content(request_parts(images))
+        except Exception as e:
+            if "429" in str(e) and attempt < max_retries:  # quota exceeded
+                wait_time = backoff_delay(attempt)
+                print(f"⏳ {label}: quota exceeded, retry {attempt + 1} in {wait_time:.1f}s")
+                time.sleep(wait_time)
+                continue
+            print(f"⚠️ Error processing {label}: {e}")
+            return []
+
+        records = []
+        for filename, counts in zip(filenames, parse_batch(response_text(response), len(images))):
+            if counts is None:
+                print(f"⚠️ Skipping {filename} - no usable counts in the answer")
+                continue
+            occupied, open_spots = counts
+            print(f"✅ Processed {filename}: {occupied} taken / {open_spots} open")
+            records.append({
+                "timestamp": datetime.now().isoformat(),
+                "frame": filename,
+                "taken_spots": occupied,
+                "open_spots": open_spots,
+                "estimated_total": occupied + open_spots,
+                "confidence": 0.75,
+                "source": "Gemini scan"
+            })
+        return records
+    return []
+
+
+def run(model, frames: str, checkpoint: str, workers: int = 4, rate: float = 1.0,
+        burst: int = 4, max_retries: int = 5, batch_size: int = 1) -> list:
+    """
+    Process every .jpg in `frames` that is not in the checkpoint yet, `batch_size`
+    frames per request, with at most `workers` requests in flight and `rate`
+    requests/second overall.
+    Returns all records (previous runs + this one) sorted by frame name.
+    """
+    done = load_checkpoint(checkpoint)
+    todo = [f for f in sorted(os.listdir(frames)) if f.endswith(".jpg") and f not in done]
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), max(1, batch_size))]
+    print(f"🗂️ {len(done)} frames already processed, {len(todo)} to go in {len(batches)} requests")
+
+    bucket = TokenBucket(rate=rate, capacity=burst)
+    writer = CheckpointWriter(checkpoint)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(process_frames, model, [os.path.join(frames, f) for f in batch], bucket,
+                                   max_retries)
+                       for batch in batches]
+            for fut in as_completed(futures):
+                try:
+                    records = fut.result()
+                except Exception as e:
+                    print(f"⚠️ Request failed: {e}")  # its frames stay out of the checkpoint for the next run
+                    continue
+                for record in records:
+                    writer.write(record)
+                    done[record["frame"]] = record
+    finally:
+        writer.close()
+    return [done[k] for k in sorted(done)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Extract parking counts from frames with Gemini.")
+    ap.add_argument("--frames-dir", default=frames_dir)
+    ap.add_argument("--checkpoint", default=output_jsonl, help="JSONL progress file (resumable)")
+    ap.add_argument("--output", default=output_json, help="final JSON array")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rate", type=float, default=float(os.getenv("GEMINI_RPS", "0.25")),
+                    help="requests per second across all workers (free tier: 15/min)")
+    ap.add_argument("--burst", type=int, default=4)
+    ap.add_argument("--max-retries", type=int, default=5)
+    ap.add_argument("--batch-size", type=int, default=1, help="frames per model request")
+    ap.add_argument("--stub", action="store_true", help="use the local stub model instead of Gemini")
+    ap.add_argument("--stub-latency", type=float, default=0.5)
+    ap.add_argument("--stub-429", type=float, default=0.1)
+    ap.add_argument("--stub-malformed", type=float, default=0.0, help="per-frame malformed answer rate")
+    args = ap.parse_args()
+
+    model = load_model(args.stub, args.stub_latency, args.stub_429, args.stub_malformed)
+    t0 = time.perf_counter()
+    results = run(model, args.frames_dir, args.checkpoint, workers=args.workers,
+                  rate=args.rate, burst=args.burst, max_retries=args.max_retries, batch_size=args.batch_size)
+
+    # Save all results to JSON
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n📂 Saved {len(results)} entries to {args.output} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Bounded background job queue for ingestion.
+
+Routes enqueue work and return a job id right away; a fixed pool of worker
+threads drains the queue. When the queue is full, submit() raises QueueFull
+and the API answers 429 so callers back off instead of piling up threads.
+"""
+import os, time, uuid, queue, threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from backend.metrics import INGEST_STAGE
+
+WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+MAX_PENDING = int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+KEEP_FINISHED = 1000  # finished jobs kept around for polling
+
+QueueFull = queue.Full
+
+
+class JobQueue:
+    def __init__(self, handler: Callable, workers: int = WORKERS, max_pending: int = MAX_PENDING,
+                 keep_finished: int = KEEP_FINISHED):
+        self.handler = handler  # handler(*args) -> JSON-able result, runs on a worker thread
+        self.workers = max(1, workers)
+        self.keep_finished = keep_finished
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._jobs = OrderedDict()  # id -> job dict, oldest first
+        self._lock = threading.Lock()
+        self._threads = []
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, *args) -> dict:
+        """Queue handler(*args); raises QueueFull when max_pending jobs are already waiting."""
+        self.start()
+        job = {"id": uuid.uuid4().hex, "status": "queued", "submitted_at": time.time(),
+               "finished_at": None, "result": None, "error": None}
+        with self._lock:
+            self._jobs[job["id"]] = job
+        try:
+            self._queue.put_nowait((job["id"], args))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job["id"]]
+                self.stats["rejected"] += 1
+            raise
+        with self._lock:
+            self.stats["submitted"] += 1
+            self._trim()
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, pending=self._queue.qsize(), workers=self.workers)
+
+    def _trim(self):
+        # forget the oldest finished jobs; queued/running ones are always kept
+        finished = [k for k, j in self._jobs.items() if j["status"] in ("done", "error")]
+        for k in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[k]
+
+    def _run(self):
+        while True:
+            job_id, args = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job:
+                    job["status"] = "running"
+                    INGEST_STAGE.observe(time.time() - job["submitted_at"], stage="queue_wait")
+            try:
+                result, status, error = self.handler(*args), "done", None
+            except Exception as e:
+                result, status, error = None, "error", str(e)
+            with self._lock:
+                if job:
+                    job.update(status=status, result=result, error=error, finished_at=time.time())
+                self.stats["done" if status == "done" else "failed"] += 1
+            self._queue.task_done()
@@ -0,0 +1,285 @@
+"""
+Per-lot sharding of ingestion state.
+
+Every lot (or camera) gets its own history store, forecast model cache, frame
+result cache, occupancy rollups, online forecaster, stall tracker and preview
+image, so lots never contend on one file or one lock. A lot may also carry a
+telemetry geofence (geofence.json in its data dir) used to gate ingestion.
+The "default" lot keeps the original single-lot paths (data/parking_history.*,
+data/images/latest.jpg); any other lot lives under data/lots/<lot_id>/ and
+data/images/<lot_id>/.
+
+The forecasting side (pandas / scikit-learn via backend.predictor) is only
+imported when a lot's forecast is first asked for, so starting the API and
+ingesting frames never pays for the ML stack.
+
+Rollups are snapshotted to parking_rollups.json every ROLLUP_SAVE_EVERY
+records and on shutdown; opening a lot loads the snapshot and folds in only
+the records appended after it.
+"""
+import os, re, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from backend.events import EventBus
+from backend.detectors import Detector, LocalStallDetector, NullDetector, make_detector
+from backend.frame_cache import FrameResultCache
+from backend.rollups import OccupancyRollups
+from backend.stalls import StallTracker
+from backend.storage import open_store
+from backend.telemetry import load_geofence
+
+DEFAULT_LOT = "default"
+LOT_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# records: fit on raw history | rollups: fit on hourly rollup buckets (cost ~ hours, not records)
+TRAIN_ON = os.getenv("FORECAST_TRAIN_ON", "records")
+TRAIN_WORKERS = int(os.getenv("FORECAST_TRAIN_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+ROLLUP_SAVE_EVERY = int(os.getenv("ROLLUP_SAVE_EVERY", "500"))  # records between rollup snapshots
+ROLLUP_SNAPSHOT = "parking_rollups.json"
+
+
+class Lot:
+    def __init__(self, lot_id: str, data_dir: str, images_dir: str, detector: Detector,
+                 train_pool: ThreadPoolExecutor, legacy_json: Optional[str] = None,
+                 bus: Optional[EventBus] = None):
+        self.id = lot_id
+        self.data_dir = data_dir
+        self.images_dir = images_dir
+        self.preview_path = os.path.join(images_dir, "latest.jpg")
+        os.makedirs(data_dir, exist_ok=True)
+        os.makedirs(images_dir, exist_ok=True)
+
+        self.history = open_store(data_dir, legacy_json=legacy_json)
+        self.bus = bus
+        self.train_pool = train_pool
+        self._forecast = None   # ForecastModelCache, built on first use
+        self._seasonal = None   # SeasonalForecaster, replayed from history on first use
+        self._ml_lock = threading.Lock()
+        # append + fold happen under one lock, so _rollup_seq is exactly what the rollups cover
+        self._append_lock = threading.Lock()
+        self._generation = 0  # bumped by rewrite(), so a replay running across one is discarded
+        self.rollups_path = os.path.join(data_dir, ROLLUP_SNAPSHOT)
+        self._load_rollups()
+        self.frame_cache = FrameResultCache()
+        self.detector = detector
+        self.geofence = load_geofence(os.path.join(data_dir, "geofence.json"))  # [[lat, lon], ...] or None
+        self.stalls = StallTracker(detector) if isinstance(detector, LocalStallDetector) else None
+        if self.stalls is not None:
+            last = self.history.tail(1)
+            if last and last[0].get("stall_state"):
+                self.stalls.restore(last[0]["stall_state"], last[0].get("timestamp"))
+
+    def _snapshot_matches(self, meta: dict) -> bool:
+        # same store, not longer than the history, and the last folded record is still the same one
+        seq = meta.get("seq")
+        if meta.get("history") != os.path.basename(self.history.path) or not isinstance(seq, int) \
+                or not 0 <= seq <= self.history.count():
+            return False
+        if seq == 0:
+            return True
+        last, _ = self.history.after(seq - 1, 1)
+        last = list(last)
+        return bool(last) and last[0].get("timestamp") == meta.get("last_timestamp")
+
+    def _load_rollups(self):
+        """
+        Rollups from the snapshot plus the records appended after it; a full
+        history pass only when there is no usable snapshot (then one is written).
+        """
+        loaded = OccupancyRollups.load(self.rollups_path)
+        if loaded is not None and self._snapshot_matches(loaded[1]):
+            rollups, meta = loaded
+            start = meta["seq"]
+        else:
+            rollups, start = OccupancyRollups(), 0
+        records, stop = self.history.after(start)
+        for record in records:
+            rollups.add(record)
+        self.rollups, self._rollup_seq = rollups, stop
+        self._saved_seq = start
+        if stop - start >= ROLLUP_SAVE_EVERY or (start == 0 and stop):
+            self.save_rollups()
+
+    def save_rollups(self):
+        """Snapshot the rollups with the history position they cover."""
+        with self._append_lock:
+            self._save_rollups()
+
+    def _save_rollups(self):
+        last, _ = self.history.after(self._rollup_seq - 1, 1) if self._rollup_seq else ([], 0)
+        last = list(last)
+        try:
+            self.rollups.save(self.rollups_path, history=os.path.basename(self.history.path), seq=self._rollup_seq,
+                              last_timestamp=last[0].get("timestamp") if last else None)
+            self._saved_seq = self._rollup_seq
+        except OSError as e:
+            print(f"⚠️ could not save rollups for lot {self.id}: {e}")
+
+    def rewrite(self, records: List[dict]):
+        """
+        Replace the lot's history (admin / repair path) and rebuild the rollups
+        from it; the online forecaster is dropped and replayed on its next use.
+        """
+        with self._append_lock:
+            self.history.rewrite(records)
+            rollups = OccupancyRollups()
+            for record in records:
+                rollups.add(record)
+            self.rollups, self._rollup_seq, self._seasonal = rollups, len(records), None
+            self._generation += 1
+            self._save_rollups()
+
+    @property
+    def forecast(self):
+        if self._forecast is None:
+            from backend.predictor import ForecastModelCache
+            with self._ml_lock:
+                if self._forecast is None:
+                    load_history = (lambda: self.rollups.training_records()) if TRAIN_ON == "rollups" \
+                        else self.history.read_all
+                    self._forecast = ForecastModelCache(load_history=load_history, pool=self.train_pool,
+                                                        on_update=self._forecast_updated if self.bus else None)
+        return self._forecast
+
+    def forecast_snapshot(self) -> Optional[dict]:
+        """Model cache stats, or None while no forecast has been asked for (ML stack not loaded)."""
+        return self._forecast.snapshot() if self._forecast is not None else None
+
+    @property
+    def seasonal(self):
+        if self._seasonal is None:
+            from backend.predictor import SeasonalForecaster
+            with self._ml_lock:
+                while self._seasonal is None:
+                    # replay in insertion order (as ingest feeds it) without blocking appends,
+                    # then fold in whatever was appended meanwhile before publishing the model
+                    seasonal, generation = SeasonalForecaster(), self._generation
+                    records, stop = self.history.after(0)
+                    for record in records:
+                        seasonal.add(record)
+                    with self._append_lock:
+                        if generation != self._generation:
+                            continue  # history was rewritten during the replay: start over
+                        records, _ = self.history.after(stop)
+                        for record in records:
+                            seasonal.add(record)
+                        self._seasonal = seasonal
+        return self._seasonal
+
+    def _forecast_updated(self, version, model):
+        self.bus.publish("forecast", {"lot": self.id, "records": version[0], "last_timestamp": version[1],
+                                      "model": model})
+
+    def append(self, record: dict) -> int:
+        """
+        Persist one record and fold it into the rollups (and the online
+        forecaster, once it is in use), then push it to /events viewers and
+        refit the forecast in the background. Returns its sequence number.
+        """
+        with self._append_lock:
+            seq = self.history.append(record)
+            self.rollups.add(record)
+            if self._seasonal is not None:
+                self._seasonal.add(record)
+            self._rollup_seq = seq + 1
+            if self._rollup_seq - self._saved_seq >= ROLLUP_SAVE_EVERY:
+                self._save_rollups()
+        if self.bus is not None:
+            self.bus.publish("record", {"lot": self.id, "record": record})
+        if self._forecast is not None:
+            self._forecast.refresh(self.version())
+        return seq
+
+    def forecast_rows(self, version, horizon_hours: int, step_minutes: int, start=None, model: str = "auto",
+                      quantiles=None):
+        """Forecast rows from the cached auto model (moving average / forest) or the online seasonal one."""
+        from backend.predictor import predict_horizon
+        if model == "seasonal":
+            return predict_horizon(self.seasonal.fitted(), horizon_hours, step_minutes, start=start, quantiles=quantiles)
+        return self.forecast.forecast(version, horizon_hours=horizon_hours, step_minutes=step_minutes, start=start,
+                                      quantiles=quantiles)
+
+    def version(self):
+        """(record count, last timestamp) — cheap, served from the ring buffer."""
+        last = self.history.tail(1)
+        return self.history.count(), (last[0].get("timestamp") if last else None)
+
+
+class LotRegistry:
+    """
+    Creates lots lazily on first use. The configured detector is shared by all
+    lots, except the local stall detector, which is built per lot from
+    data/lots/<lot_id>/stall_layout.json (STALL_LAYOUT for the default lot).
+    """
+
+    def __init__(self, data_dir: str, images_dir: str, detector: Optional[Detector] = None,
+                 legacy_json: Optional[str] = None, bus: Optional[EventBus] = None,
+                 detector_factory: Optional[Callable[[], Detector]] = None):
+        self.data_dir = data_dir
+        self.bus = bus
+        self.images_dir = images_dir
+        self._detector = detector
+        self.detector_factory = detector_factory  # builds the detector on first use when none is given
+        self.legacy_json = legacy_json
+        self.train_pool = ThreadPoolExecutor(max_workers=TRAIN_WORKERS, thread_name_prefix="forecast-train")
+        self._lots: Dict[str, Lot] = {}
+        self._lock = threading.Lock()
+        self._opening: Dict[str, threading.Lock] = {}  # per-lot: opening one lot never blocks the others
+
+    @property
+    def detector(self) -> Detector:
+        if self._detector is None:
+            self._detector = self.detector_factory() if self.detector_factory else NullDetector()
+        return self._detector
+
+    def _paths(self, lot_id: str):
+        if lot_id == DEFAULT_LOT:
+            return self.data_dir, self.images_dir
+        return os.path.join(self.data_dir, "lots", lot_id), os.path.join(self.images_dir, lot_id)
+
+    def _detector_for(self, lot_id: str, data_dir: str) -> Detector:
+        if not isinstance(self.detector, LocalStallDetector) or lot_id == DEFAULT_LOT:
+            return self.detector
+        return make_detector("local", layout_path=os.path.join(data_dir, "stall_layout.json"))
+
+    def get(self, lot_id: str = DEFAULT_LOT, create: bool = True) -> Optional[Lot]:
+        """
+        The Lot for lot_id. Raises ValueError for malformed ids; returns None for
+        a lot that has no data yet when create is False.
+        """
+        if not LOT_ID.match(lot_id or ""):
+            raise ValueError(f"invalid lot id: {lot_id!r}")
+        lot = self._lots.get(lot_id)
+        if lot is not None:
+            return lot
+        with self._lock:
+            opening = self._opening.setdefault(lot_id, threading.Lock())
+        with opening:
+            lot = self._lots.get(lot_id)
+            if lot is None:
+                data_dir, images_dir = self._paths(lot_id)
+                if not create and lot_id != DEFAULT_LOT and not os.path.isdir(data_dir):
+                    return None
+                lot = Lot(lot_id, data_dir, images_dir, self._detector_for(lot_id, data_dir), self.train_pool,
+                          legacy_json=self.legacy_json if lot_id == DEFAULT_LOT else None, bus=self.bus)
+                with self._lock:
+                    self._lots[lot_id] = lot
+            return lot
+
+    def ids(self) -> List[str]:
+        """Every lot with data on disk or loaded in this process."""
+        found = {DEFAULT_LOT, *self._lots}
+        lots_dir = os.path.join(self.data_dir, "lots")
+        if os.path.isdir(lots_dir):
+            found.update(d for d in os.listdir(lots_dir) if LOT_ID.match(d))
+        return sorted(found)
+
+    def all(self) -> List[Lot]:
+        return [self.get(lot_id) for lot_id in self.ids()]
+
+    def close(self):
+        """Snapshot every open lot's rollups (shutdown)."""
+        with self._lock:
+            opened = list(self._lots.values())
+        for lot in opened:
+            lot.save_rollups()
@@ -1,35 +1,56 @@
-import os, json, time
+import os, json, time, asyncio, threading
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, List, Literal, Optional
 
-from fastapi import FastAPI, UploadFile, File, Body
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, UploadFile, File, Body, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from PIL import Image
+import numpy as np  # eager anyway: the telemetry ring buffer and rollups are NumPy arrays
 
-# ML forecast import
-from backend.predictor import forecast_from_history
+# No ML imports here: backend.predictor (pandas, scikit-learn) loads on the first /forecast,
+# OpenCV and Pillow on the first frame
+if TYPE_CHECKING:
+    from PIL import Image
+from backend.frame_cache import dhash
+from backend.jobs import JobQueue, QueueFull
+from backend.metrics import (CAPTURE_STAGE, FALLBACKS, HTTP_REQUESTS, INGEST_STAGE, RATE_LIMITED, REGISTRY,
+                             TELEMETRY_SKIPS, timed)
+from backend.detectors import NullDetector, make_detector
+from backend.events import EventBus
+from backend.lots import DEFAULT_LOT, Lot, LotRegistry
+from backend.telemetry import GATE_ENABLED, RESOLUTIONS, TelemetryService, TelemetryStore, gate
 
-# ---------- Optional Gemini ----------
-USE_GEMINI = True
-try:
-    load_dotenv()
-    import google.generativeai as genai
-    if os.getenv("GEMINI_API_KEY"):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        gemini_model = genai.GenerativeModel("gemini-1.5-flash")
-    else:
-        USE_GEMINI = False
-except Exception:
-    USE_GEMINI = False
+# ---------- Inference backend (DETECTOR=gemini|local|none) ----------
+load_dotenv()
+# Built in the lifespan hook (or on first use outside it): the Gemini SDK import and
+# client setup stay off the import path. DETECTOR_WARMUP=1 also runs one detection
+# on a blank frame at startup so the first real frame does not pay for it.
+DETECTOR_WARMUP = os.getenv("DETECTOR_WARMUP", "0") == "1"
+detector = None
+_detector_lock = threading.Lock()
 
-# ---------- FastAPI App ----------
-app = FastAPI()
+def get_detector():
+    global detector
+    if detector is None:
+        with _detector_lock:
+            if detector is None:
+                detector = make_detector()
+    return detector
+
+# auto: moving average / random forest (ForecastModelCache) | seasonal: online SeasonalForecaster
+DEFAULT_MODEL = os.getenv("FORECAST_MODEL", "auto")
+DEFAULT_QUANTILES = "10,50,90"
 
 # --- Paths ---
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DATA_DIR = os.getenv("PARKING_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
 IMAGES_DIR = os.path.join(DATA_DIR, "images")
 FRAMES_DIR = os.path.join(DATA_DIR, "frames")
 HISTORY_JSON = os.path.join(DATA_DIR, "parking_history.json")
@@ -39,115 +60,589 @@ os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(IMAGES_DIR, exist_ok=True)
 os.makedirs(FRAMES_DIR, exist_ok=True)
 
+# Server-push: new records and forecast refits go out on /events (SSE)
+events = EventBus()
+SSE_KEEPALIVE_SEC = 15
+HISTORY_DEFAULT_LIMIT = 200  # /history tail and cursor pages when no limit is given
+RAW_MAX_SIDE = int(os.getenv("RAW_MAX_SIDE", "8192"))  # /ingest/raw width/height limit, in pixels
+RAW_CHANNELS = (1, 3)  # grayscale or BGR; other layouts would reach the detectors in the wrong order
+
+# One shard per lot/camera: history store (HISTORY_ENGINE=jsonl|sqlite), model cache,
+# frame cache, stall state. Lots open on first use; the default lot imports the old JSON file once.
+lots = LotRegistry(DATA_DIR, IMAGES_DIR, legacy_json=HISTORY_JSON, bus=events, detector_factory=get_detector)
+
+# Drone telemetry: one MQTT subscription for the whole process (TELEMETRY_MQTT=0 disables it)
+TELEMETRY_MQTT = os.getenv("TELEMETRY_MQTT", "1") == "1"
+telemetry = TelemetryStore()
+telemetry_service = TelemetryService(telemetry)
+
+# Frames skipped by the telemetry gate (TELEMETRY_GATE=1), by reason
+gate_stats = {"passed": 0, "skipped": 0, "reasons": {}}
+
+def _warm_up(det):
+    from PIL import Image
+    try:
+        det.detect(Image.new("RGB", (64, 64)))
+        print(f"🔥 {det.name} detector warmed up")
+    except Exception as e:
+        print(f"⚠️ detector warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    # detector client, then telemetry; lots and the ML stack stay lazy
+    det = await run_in_threadpool(get_detector)
+    if DETECTOR_WARMUP and not isinstance(det, NullDetector):
+        await run_in_threadpool(_warm_up, det)
+    if TELEMETRY_MQTT:
+        try:
+            telemetry_service.start()
+        except Exception as e:
+            print(f"⚠️ telemetry MQTT unavailable ({e}), /telemetry stays empty")
+    yield
+    telemetry_service.stop()
+    lots.close()  # rollup snapshots, so the next start does not rescan history
+
+# ---------- FastAPI App ----------
+app = FastAPI(lifespan=lifespan)
+
 # Serve images (preview latest.jpg)
 app.mount("/images", StaticFiles(directory=IMAGES_DIR), name="images")
 
-# ---------- Gemini Prompt ----------
-PROMPT = """
-You are analyzing a parking lot from a drone.
-Count how many parking spaces are visible.
-Tell me:
-- How many are occupied by cars
-- How many are open
-Keep the estimated total as (occupied + open).
-Return ONLY JSON in the format:
-{"open_spots": X, "occupied": Y}
-"""
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    # label by route template (/ingest/jobs/{job_id}), not the raw path, to keep cardinality bounded
+    t0 = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUESTS.observe(time.perf_counter() - t0, method=request.method,
+                              route=getattr(route, "path", "unmatched"), status=status_code)
 
 # ---------- Utils ----------
-def read_history() -> List[dict]:
-    if not os.path.exists(HISTORY_JSON):
-        return []
-    with open(HISTORY_JSON, "r") as f:
-        try:
-            return json.load(f)
-        except Exception:
-            return []
+def get_lot(lot_id: str = DEFAULT_LOT, create: bool = True) -> Lot:
+    try:
+        lot = lots.get(lot_id, create=create)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if lot is None:
+        raise HTTPException(status_code=404, detail=f"unknown lot: {lot_id}")
+    return lot
+
+def check_iso(name: str, value: Optional[str]):
+    """400 unless value is an ISO 8601 timestamp (or absent)."""
+    if value is None:
+        return
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 timestamp, got {value!r}")
+
+def read_history(lot_id: str = DEFAULT_LOT) -> List[dict]:
+    return get_lot(lot_id).history.read_all()
+
+def write_history(records: List[dict], lot_id: str = DEFAULT_LOT):
+    get_lot(lot_id).rewrite(records)
+
+def append_history(record: dict, lot_id: str = DEFAULT_LOT):
+    get_lot(lot_id).append(record)
+
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+# Preview JPEG writes happen here, off the ingest path
+preview_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+
+def _save_preview(im: "Image.Image", path: str):
+    # atomic: StaticFiles never serves a half-written latest.jpg
+    tmp = path + ".tmp"
+    im.save(tmp, format="JPEG", quality=90)
+    os.replace(tmp, path)
+
+def write_preview(im: "Image.Image", path: str = LATEST_SNAPSHOT):
+    preview_pool.submit(_save_preview, im, path)
+
+def to_image(frame: np.ndarray) -> "Image.Image":
+    """BGR (OpenCV order) or grayscale uint8 array → PIL image, no encode/decode."""
+    from PIL import Image
+    if frame.ndim == 3 and frame.shape[2] == 3:
+        return Image.fromarray(np.ascontiguousarray(frame[:, :, ::-1]))
+    return Image.fromarray(frame.squeeze())
 
-def write_history(records: List[dict]):
-    with open(HISTORY_JSON, "w") as f:
-        json.dump(records, f, indent=2)
+def history_version(lot_id: str = DEFAULT_LOT):
+    """(record count, last timestamp) — cheap, served from the ring buffer."""
+    return get_lot(lot_id).version()
 
-def append_history(record: dict):
-    hist = read_history()
-    hist.append(record)
-    write_history(hist)
+def _stream_records(records: Iterable[dict], fmt: str, chunk: int = 200):
+    """
+    Encode records lazily: a JSON array by default, or one object per line (NDJSON).
+    """
+    it = iter(records)
+    first = True
+    if fmt != "ndjson":
+        yield "["
+    while True:
+        batch = list(islice(it, chunk))
+        if not batch:
+            break
+        if fmt == "ndjson":
+            yield "".join(json.dumps(r) + "\n" for r in batch)
+        else:
+            yield ("" if first else ",") + ",".join(json.dumps(r) for r in batch)
+        first = False
+    if fmt != "ndjson":
+        yield "]"
 
 # ---------- Schemas ----------
 class FramePath(BaseModel):
     path: str
+    lot: str = DEFAULT_LOT
+    captured_at: Optional[float] = None  # epoch seconds, for the telemetry join
 
 # ---------- Routes ----------
 @app.get("/status")
-def status():
-    return {"ok": True, "using_gemini": USE_GEMINI, "history_count": len(read_history())}
+def status(lot: str = DEFAULT_LOT):
+    current = get_lot(lot, create=False)
+    return {
+        "ok": True,
+        "using_gemini": get_detector().name == "gemini",
+        "detector": current.detector.name,
+        "lot": current.id,
+        "lots": lots.ids(),
+        "history_count": current.history.count(),
+        "forecast_cache": current.forecast_snapshot(),
+        "rollups": current.rollups.snapshot(),
+        "frame_cache": current.frame_cache.snapshot(),
+        "ingest_queue": ingest_jobs.snapshot(),
+        "events": events.snapshot(),
+        "telemetry": {**telemetry.snapshot(), "connected": telemetry_service.connected},
+        "telemetry_gate": {"enabled": GATE_ENABLED, "geofence": current.geofence is not None, **gate_stats},
+    }
+
+@app.get("/telemetry/latest")
+def get_telemetry_latest():
+    """
+    Newest drone telemetry sample (streaming/flying flags, battery %, position)
+    """
+    return telemetry.latest()
+
+@app.get("/telemetry/series")
+def get_telemetry_series(resolution: str = "1m", since: Optional[float] = None, until: Optional[float] = None):
+    """
+    Telemetry as columns (t, lat, lon, alt, battery, ...); resolution raw | 1s | 1m | 1h, since/until in epoch seconds
+    """
+    if resolution != "raw" and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be raw or one of {sorted(RESOLUTIONS)}")
+    return telemetry.series(resolution, since=since, until=until)
+
+@app.post("/telemetry")
+def post_telemetry(payload: dict = Body(...)):
+    """
+    Push one telemetry message (same JSON as the MQTT topic), e.g. from a relay or a local broker stand-in
+    """
+    if not telemetry.feed(payload):
+        raise HTTPException(status_code=400, detail="unusable or out-of-order telemetry message")
+    return {"ok": True}
+
+CAPTURE_STAGES = ("open", "read", "encode")
+# lot label values: lots on disk at startup plus METRICS_LOTS; lots created later report as "other"
+METRICS_LOTS = frozenset(lots.ids()) | {x.strip() for x in os.getenv("METRICS_LOTS", "").split(",") if x.strip()}
+
+def record_capture_timings(header: Optional[str], lot_id: str):
+    """
+    X-Capture-Timings from the snapshot worker: {"open": s, "read": s, "encode": s}.
+    Only those stages are recorded, and the lot label is one of METRICS_LOTS or
+    "other", so clients cannot grow the label sets by sending new lot ids.
+    """
+    lot_label = lot_id if lot_id in METRICS_LOTS else "other"
+    if not header:
+        return
+    try:
+        timings = json.loads(header)
+    except ValueError:
+        return
+    if not isinstance(timings, dict):
+        return
+    for stage in CAPTURE_STAGES:
+        try:
+            seconds = float(timings.get(stage, "nan"))
+        except (ValueError, TypeError):
+            continue
+        if 0 <= seconds < float("inf"):
+            CAPTURE_STAGE.observe(seconds, stage=stage, lot=lot_label)
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus text format: request, ingest-stage, forecast and capture latency histograms plus
+    fallback / parse-failure / 429 / gate-skip counters
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def _sse(event) -> str:
+    event_id, kind, data = event
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/events")
+async def get_events(request: Request, lot: Optional[str] = None):
+    """
+    Server-Sent Events: `record` (new occupancy record) and `forecast` (model refit, refetch /forecast).
+    lot filters to one lot/camera; reconnects resume after the Last-Event-ID header.
+    """
+    sub = events.subscribe()
+    last_id = request.headers.get("last-event-id", "")
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            backlog = events.since(int(last_id)) if last_id.isdigit() else []
+            sent = int(last_id) if last_id.isdigit() else 0
+            while not sub.overflowed:
+                if backlog:
+                    event = backlog.pop(0)
+                else:
+                    try:
+                        event = await asyncio.wait_for(sub.queue.get(), timeout=SSE_KEEPALIVE_SEC)
+                    except asyncio.TimeoutError:
+                        if await request.is_disconnected():
+                            break
+                        yield ": keepalive\n\n"
+                        continue
+                if event[0] <= sent:
+                    continue  # already replayed from the backlog
+                sent = event[0]
+                if lot is None or event[2].get("lot") == lot:
+                    yield _sse(event)
+        finally:
+            events.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/history")
-def get_history(limit: Optional[int] = 200):
-    hist = read_history()
-    return hist[-limit:] if limit else hist
+def get_history(limit: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+                cursor: Optional[int] = None, format: Literal["json", "ndjson"] = "json", lot: str = DEFAULT_LOT):
+    """
+    History records.
+    - limit only: newest N records (default 200), served from the in-memory ring buffer (0 = everything)
+    - since/until: ISO timestamps, since <= timestamp < until, streamed from disk; the whole range
+      unless limit is given explicitly
+    - cursor: sequence number to resume from; the next cursor is in the X-Next-Cursor header
+      (not combinable with since/until)
+    - format: json (array) | ndjson
+    - lot: lot/camera id
+    """
+    check_iso("since", since)
+    check_iso("until", until)
+    if cursor is not None and (since or until):
+        raise HTTPException(status_code=400, detail="cursor cannot be combined with since/until")
+    if limit is None and not (since or until):
+        limit = HISTORY_DEFAULT_LIMIT  # a range query returns the whole range unless asked otherwise
+    history_store = get_lot(lot, create=False).history
+    headers = {}
+    if cursor is not None:
+        records, next_cursor = history_store.after(cursor, limit)
+        headers["X-Next-Cursor"] = str(next_cursor)
+    elif since or until:
+        records = history_store.range(since=since, until=until)
+        if limit:
+            records = islice(records, limit)
+    elif limit:
+        records = history_store.tail(limit)
+    else:
+        records = history_store.range()
+
+    # hot path: small in-memory answers go out as a plain response
+    if isinstance(records, list) and format != "ndjson":
+        return JSONResponse(records, headers=headers)
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(_stream_records(records, format), media_type=media_type, headers=headers)
+
+FORECAST_MODELS = ("auto", "seasonal")
+FORECAST_MAX_HOURS = 24 * 31
+FORECAST_MAX_STEPS = int(os.getenv("FORECAST_MAX_STEPS", "10000"))  # same cap as backend.predictor.MAX_STEPS
+
+def aggregate_forecast(selected: List[Lot], h: int, step: int, model: str = DEFAULT_MODEL):
+    """
+    Sum per-lot forecasts on one time grid starting at the newest lot's last record.
+    Lots without history are left out (they would only add demo numbers).
+    """
+    versions = [(lot, lot.version()) for lot in selected]
+    versions = [(lot, v) for lot, v in versions if v[0]]
+    if not versions:
+        from backend.predictor import predict_horizon
+        return predict_horizon(None, h, step)
+    start = max(datetime.fromisoformat(v[1]) for _, v in versions)
+    rows = None
+    for lot, v in versions:
+        part = lot.forecast_rows(v, h, step, start=start, model=model)
+        if rows is None:
+            rows = [dict(r) for r in part]
+            continue
+        for row, r in zip(rows, part):
+            row["taken_spots"] += r["taken_spots"]
+            row["estimated_total"] += r["estimated_total"]
+    return rows
+
+@app.get("/rollups")
+def get_rollups(kind: str = "hourly", since: Optional[str] = None, until: Optional[str] = None,
+                lot: str = DEFAULT_LOT):
+    """
+    Pre-aggregated occupancy: kind=hourly (buckets, since/until ISO) | dow_hour (7 x 24 grid, Monday first)
+    """
+    rollups = get_lot(lot, create=False).rollups
+    if kind == "hourly":
+        check_iso("since", since)
+        check_iso("until", until)
+        return rollups.hourly_rows(since=since, until=until)
+    if kind == "dow_hour":
+        return rollups.dow_hour()
+    raise HTTPException(status_code=400, detail="kind must be hourly or dow_hour")
 
 @app.get("/forecast")
-def get_forecast(h: int = 24, step: int = 60):
+def get_forecast(h: int = Query(24, gt=0, le=FORECAST_MAX_HOURS), step: int = Query(60, gt=0, le=24 * 60),
+                 lot: str = DEFAULT_LOT, model: str = DEFAULT_MODEL, bands: bool = False,
+                 quantiles: str = DEFAULT_QUANTILES):
     """
     Return ML forecast based on parking history.
+    - h: horizon in hours, step: minutes between rows (at most FORECAST_MAX_STEPS rows)
+    - model=auto: moving average / random forest (cached model, see ForecastModelCache)
+    - model=seasonal: online day-of-week x hour profile + trend, updated on ingest (no refits)
+    - bands=true: add p10/p50/p90 (or `quantiles`) per row — per-tree spread of the forest,
+      error-variance bands for the seasonal model
+    lot=all (or a comma-separated list of lot ids) returns the summed forecast (no bands).
     """
-    history = read_history()
-    return forecast_from_history(history_records=history, horizon_hours=h, step_minutes=step)
+    if model not in FORECAST_MODELS:
+        raise HTTPException(status_code=400, detail=f"model must be one of {list(FORECAST_MODELS)}")
+    if -(-h * 60 // step) > FORECAST_MAX_STEPS:
+        raise HTTPException(status_code=400, detail=f"h/step gives more than {FORECAST_MAX_STEPS} rows; use a larger step")
+    qs = None
+    if bands:
+        try:
+            qs = tuple(sorted({float(q) for q in quantiles.split(",") if q.strip()}))
+        except ValueError:
+            qs = None
+        if not qs or not all(0 < q < 100 for q in qs):
+            raise HTTPException(status_code=400, detail="quantiles must be numbers between 0 and 100, e.g. 10,50,90")
+    if lot == "all" or "," in lot:
+        if qs:
+            raise HTTPException(status_code=400, detail="bands are per lot; quantiles do not add up across lots")
+        ids = lots.ids() if lot == "all" else [x.strip() for x in lot.split(",") if x.strip()]
+        return aggregate_forecast([get_lot(i, create=False) for i in ids], h, step, model)
+    current = get_lot(lot, create=False)
+    version = current.version()
+    # origin = newest record (with FORECAST_TRAIN_ON=rollups the model's last point is an hour start)
+    return current.forecast_rows(version, h, step, start=version[1], model=model, quantiles=qs)
 
-@app.post("/ingest/frame")
-def ingest_frame(body: FramePath = Body(...)):
+def analyze_frame(img, frame_name: Optional[str] = None, lot_id: str = DEFAULT_LOT, position: Optional[dict] = None):
     """
-    Ingest a frame (image path) → run Gemini (if enabled) → save JSON record to history
+    Run the lot's detector on an image path or an in-memory BGR array → save JSON record to its history.
+    Runs on an ingest worker thread, never on a request handler.
+    position: lat/lon/alt of the drone when the frame was taken (nearest telemetry sample)
     """
-    img_path = body.path
-    if not os.path.exists(img_path):
-        return {"ok": False, "error": f"file not found: {img_path}"}
+    lot = lots.get(lot_id)
+    detector, stall_tracker, frame_cache = lot.detector, lot.stalls, lot.frame_cache
+    timestamp = datetime.utcnow().isoformat()
+    if isinstance(img, str):
+        frame_name = frame_name or os.path.basename(img)
+        im = None  # opened lazily: nothing to decode without a detector
+    else:
+        with timed(INGEST_STAGE, stage="decode", detector=detector.name):
+            im = to_image(img)
+        write_preview(im, lot.preview_path)
 
     # Default fallback
     occupied, open_spots = 0, 0
+    source = detector.source
+    extra = {}
 
-    if USE_GEMINI:
+    if stall_tracker is not None:
         try:
-            im = Image.open(img_path)
-            resp = gemini_model.generate_content([PROMPT, im])
-            raw = (resp.text or "").strip()
-
-            # Clean markdown fences
-            if raw.startswith("```"):
-                raw = raw.strip("`")
-                if raw.lower().startswith("json"):
-                    raw = raw[4:].strip()
-
-            if raw.startswith("{") and raw.endswith("}"):
-                parsed = json.loads(raw)
-                occupied = int(parsed.get("occupied", 0))
-                open_spots = int(parsed.get("open_spots", 0))
+            # stall-level path: straight from the BGR array, only moved stalls re-classified
+            if isinstance(img, str):
+                import cv2
+                with timed(INGEST_STAGE, stage="decode", detector=detector.name):
+                    bgr = cv2.imread(img)
             else:
-                occupied, open_spots = 100, 80  # soft default
+                bgr = img
+            with timed(INGEST_STAGE, stage="detect", detector=detector.name):
+                result = stall_tracker.update(bgr, timestamp)
+            occupied, open_spots = result["occupied"], result["open_spots"]
+            extra = {k: result[k] for k in ("stall_state", "stalls_evaluated", "stalls_changed")}
         except Exception:
+            FALLBACKS.inc(reason="stall_error")
+            occupied, open_spots = 100, 80
+    elif not isinstance(detector, NullDetector):
+        try:
+            if im is None:
+                from PIL import Image
+                with timed(INGEST_STAGE, stage="decode", detector=detector.name):
+                    im = Image.open(img)
+                    im.load()
+            with timed(INGEST_STAGE, stage="cache_lookup", detector=detector.name):
+                frame_hash = dhash(im) if detector.cacheable else None
+                hit = frame_cache.lookup(frame_hash) if detector.cacheable else None
+            if hit:
+                # Near-identical to a recent frame: reuse its counts, skip the model call
+                cached, distance = hit
+                occupied, open_spots = cached["taken_spots"], cached["open_spots"]
+                source = f"{detector.source} (cached)"
+                extra = {"cached_from": cached["frame"], "hash_distance": distance}
+            else:
+                with timed(INGEST_STAGE, stage="detect", detector=detector.name):
+                    result = detector.detect(im)
+                if not result["ok"]:
+                    FALLBACKS.inc(reason="soft_default")
+                occupied, open_spots = result["occupied"], result["open_spots"]
+                if "occupied_stalls" in result:
+                    extra["occupied_stalls"] = result["occupied_stalls"]
+                if result["ok"] and detector.cacheable:
+                    frame_cache.store(frame_hash, {"frame": frame_name,
+                                                   "taken_spots": occupied, "open_spots": open_spots})
+        except Exception:
+            FALLBACKS.inc(reason="detector_error")
             occupied, open_spots = 100, 80
 
     total = max(1, occupied + open_spots)
     record = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "frame": os.path.basename(img_path),
+        "timestamp": timestamp,
+        "frame": frame_name,
         "taken_spots": occupied,
         "open_spots": open_spots,
         "estimated_total": total,
-        "confidence": 0.75 if USE_GEMINI else 0.4,
-        "source": "Gemini scan" if USE_GEMINI else "fallback"
+        "confidence": detector.confidence,
+        "source": source,
+        **extra
     }
-    append_history(record)
+    if lot_id != DEFAULT_LOT:
+        record["lot"] = lot_id
+    if position:
+        record.update(position)
+    with timed(INGEST_STAGE, stage="history_write", detector=detector.name):
+        lot.append(record)
     return {"ok": True, "appended": record}
 
+# Bounded worker pool draining ingest jobs (INGEST_WORKERS / INGEST_QUEUE_SIZE)
+ingest_jobs = JobQueue(handler=analyze_frame)
+
+def frame_position(lot: Lot, captured_at: Optional[float]):
+    """
+    Join the frame with the nearest telemetry sample → (position stamp or None, skip reason or None)
+    """
+    sample = telemetry.nearest(captured_at if captured_at is not None else time.time())
+    reason = gate(sample, lot.geofence) if GATE_ENABLED else None
+    position = None
+    if sample is not None and sample["lat"] == sample["lat"]:
+        position = {"lat": sample["lat"], "lon": sample["lon"],
+                    "alt": None if sample["alt"] != sample["alt"] else sample["alt"]}
+    return position, reason
+
+def enqueue_frame(img, frame_name: Optional[str] = None, lot_id: str = DEFAULT_LOT,
+                  captured_at: Optional[float] = None, capture_timings: Optional[str] = None):
+    lot = get_lot(lot_id)  # validate the id (400) and create the shard before queueing
+    record_capture_timings(capture_timings, lot_id)
+    position, reason = frame_position(lot, captured_at)
+    if reason:
+        # not over the lot / on the ground: no queue slot, no decode, no model call
+        gate_stats["skipped"] += 1
+        gate_stats["reasons"][reason] = gate_stats["reasons"].get(reason, 0) + 1
+        TELEMETRY_SKIPS.inc(reason=reason)
+        return {"ok": True, "skipped": True, "reason": reason}
+    gate_stats["passed"] += 1
+    try:
+        job = ingest_jobs.submit(img, frame_name, lot_id, position)
+    except QueueFull:
+        RATE_LIMITED.inc(source="api")
+        raise HTTPException(status_code=429, detail="ingest queue is full, retry later")
+    return JSONResponse({"ok": True, "job_id": job["id"], "status": job["status"]}, status_code=202)
+
+def _stall_tracker(lot_id: str):
+    tracker = get_lot(lot_id, create=False).stalls
+    if tracker is None:
+        raise HTTPException(status_code=404, detail="no stall layout in use (set DETECTOR=local and STALL_LAYOUT)")
+    return tracker
+
+@app.get("/stalls")
+def get_stalls(geometry: bool = False, lot: str = DEFAULT_LOT):
+    """
+    Current per-stall state: ids and a 0/1 state vector in the same order (polygons with geometry=true)
+    """
+    return _stall_tracker(lot).snapshot(geometry=geometry)
+
+@app.get("/stalls/changes")
+def get_stall_changes(since: Optional[str] = None, lot: str = DEFAULT_LOT):
+    """
+    Stall state changes after `since`: a change sequence number (from a previous call) or an ISO timestamp
+    """
+    stall_tracker = _stall_tracker(lot)
+    if since is not None and since.isdigit():
+        changes = stall_tracker.changes(since_seq=int(since))
+    else:
+        changes = stall_tracker.changes(since_ts=since)
+    return {"changes": changes, "next": stall_tracker.change_seq}
+
+@app.post("/ingest/frame")
+def ingest_frame(body: FramePath = Body(...), x_capture_timings: Optional[str] = Header(None)):
+    """
+    Queue a frame (image path) for analysis and return its job id immediately
+    """
+    img_path = body.path
+    if not os.path.exists(img_path):
+        return {"ok": False, "error": f"file not found: {img_path}"}
+    return enqueue_frame(img_path, lot_id=body.lot, captured_at=body.captured_at, capture_timings=x_capture_timings)
+
+@app.post("/ingest/raw")
+async def ingest_raw(request: Request, width: int = Query(..., gt=0, le=RAW_MAX_SIDE),
+                     height: int = Query(..., gt=0, le=RAW_MAX_SIDE), channels: int = 3,
+                     name: Optional[str] = None, lot: str = DEFAULT_LOT, captured_at: Optional[float] = None):
+    """
+    Queue an uncompressed frame: body = height*width*channels uint8 bytes in OpenCV (BGR) order,
+    channels 1 (grayscale) or 3 (BGR).
+    The array goes straight to inference — no JPEG round trip, no file on disk.
+    captured_at (epoch seconds) is matched against drone telemetry; defaults to now.
+    """
+    if channels not in RAW_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"channels must be one of {list(RAW_CHANNELS)}, got {channels}")
+    expected = width * height * channels
+    # size check before reading anything: Content-Length first, then a capped read for chunked bodies
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) != expected:
+        raise HTTPException(status_code=413 if int(declared) > expected else 400,
+                            detail=f"expected {expected} bytes, got {declared}")
+    # first use of a lot opens its store and rollups (disk reads): keep that off the event loop
+    await run_in_threadpool(get_lot, lot)
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > expected:
+            raise HTTPException(status_code=413, detail=f"expected {expected} bytes, got more")
+    if len(data) != expected:
+        raise HTTPException(status_code=400, detail=f"expected {expected} bytes, got {len(data)}")
+    frame = np.frombuffer(bytes(data), dtype=np.uint8).reshape(height, width, channels)
+    return enqueue_frame(frame, name or f"raw_{int(time.time() * 1000)}", lot, captured_at,
+                         request.headers.get("x-capture-timings"))
+
+@app.get("/ingest/jobs/{job_id}")
+def get_ingest_job(job_id: str):
+    """
+    Poll a queued ingest: status is queued | running | done | error; result holds the record
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"unknown job: {job_id}")
+    return job
+
 @app.post("/ingest/upload")
-async def upload_and_ingest(file: UploadFile = File(...)):
+async def upload_and_ingest(file: UploadFile = File(...), lot: str = DEFAULT_LOT):
     """
-    Upload a file directly to images/ and run ingestion
+    Upload a file directly to the lot's images/ folder and queue it for ingestion
     """
-    name = f"upload_{int(time.time())}.jpg"
-    path = os.path.join(IMAGES_DIR, name)
-    with open(path, "wb") as f:
-        f.write(await file.read())
-    return ingest_frame(FramePath(path=path))
+    name = f"upload_{int(time.time() * 1000)}.jpg"
+    path = os.path.join((await run_in_threadpool(get_lot, lot)).images_dir, name)
+    data = await file.read()
+    await run_in_threadpool(_write_file, path, data)
+    return enqueue_frame(path, lot_id=lot)
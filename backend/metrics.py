@@ -0,0 +1,154 @@
+"""
+Minimal Prometheus-style metrics (text exposition format 0.0.4), no dependency.
+
+    INGEST_STAGE.observe(0.012, stage="decode")
+    with timed(INGEST_STAGE, stage="model_call"):
+        ...
+    FALLBACKS.inc(reason="detector_error")
+
+Everything registers in REGISTRY; GET /metrics returns REGISTRY.render().
+"""
+import time, threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+# seconds: 1 ms .. 30 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def header(self) -> str:
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> str:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + "".join(f"{self.name}_total{_labels(self.label_names, k)} {v:g}\n" for k, v in items)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets=LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> str:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [self.header()]
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), key + (le,))} {cumulative}\n")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {series[-1]:.6f}\n")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}\n")
+        return "".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(m.render() for m in metrics)
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels=()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets=buckets))
+
+
+@contextmanager
+def timed(hist: Histogram, **labels):
+    """Observe the wall time of the block (also when it raises)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        hist.observe(time.perf_counter() - t0, **labels)
+
+
+# ---------- Shared metrics ----------
+HTTP_REQUESTS = histogram("parking_http_request_seconds", "API request latency by route",
+                          ("method", "route", "status"))
+INGEST_STAGE = histogram("parking_ingest_stage_seconds",
+                         "Ingest stages: queue_wait, decode, cache_lookup, detect (whole detector call; "
+                         "Gemini also splits it into model_call and parse), history_write",
+                         ("stage", "detector"))
+FORECAST_STAGE = histogram("parking_forecast_stage_seconds", "Forecaster fit / predict / bands time",
+                           ("stage", "model"))
+MODEL_BATCH = histogram("parking_model_batch_frames", "Frames per model request (GEMINI_BATCH_SIZE > 1)",
+                        ("detector",), buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+CAPTURE_STAGE = histogram("parking_capture_stage_seconds",
+                          "Snapshot worker stages (open, read, encode), reported with each frame", ("stage", "lot"))
+FALLBACKS = counter("parking_fallbacks", "Records written with the 100/80 default or a detector soft default",
+                    ("reason",))
+PARSE_FAILURES = counter("parking_parse_failures", "Model responses that could not be parsed into counts",
+                         ("detector",))
+RATE_LIMITED = counter("parking_rate_limited", "429s: ingest queue full (api) or model quota errors (model)",
+                       ("source",))
+TELEMETRY_SKIPS = counter("parking_telemetry_gate_skips", "Frames skipped by the telemetry gate", ("reason",))
@@ -1,31 +1,69 @@
+import os
+import time
+import threading
 import pandas as pd
 import numpy as np
 import statistics
-from datetime import datetime, timedelta
-from sklearn.ensemble import RandomForestRegressor
+from statistics import NormalDist
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
 
+from backend.metrics import FORECAST_STAGE, timed
 
-def train_random_forest(df: pd.DataFrame):
+MIN_RF_RECORDS = 20  # below this the moving average is used
+RETRAIN_EVERY = int(os.getenv("FORECAST_RETRAIN_EVERY", "10"))  # new records before a refit
+DEFAULT_QUANTILES = (10, 50, 90)
+MAX_STEPS = int(os.getenv("FORECAST_MAX_STEPS", "10000"))  # forecast rows per request
+
+
+def time_features(timestamps: pd.DatetimeIndex) -> np.ndarray:
     """
-    Train a Random Forest Regressor on time-based features (day/hour cycles).
-    Returns the trained model, estimated_total, and the last timestamp.
+    Cyclical day-of-week / hour encoding as an (n, 4) matrix:
+    [day_sin, day_cos, hour_sin, hour_cos].
+    """
+    day = 2 * np.pi * np.asarray(timestamps.dayofweek, dtype=float) / 7
+    hour = 2 * np.pi * np.asarray(timestamps.hour, dtype=float) / 24
+    return np.column_stack([np.sin(day), np.cos(day), np.sin(hour), np.cos(hour)])
+
+
+def horizon_index(last_ts, horizon_hours: int, step_minutes: int) -> pd.DatetimeIndex:
+    """
+    The forecast timestamps after last_ts: one every step_minutes, covering horizon_hours
+    (h=12&step=60 → 12 points, h=168&step=5 → 2016 points), at most MAX_STEPS of them.
     """
+    if horizon_hours <= 0 or step_minutes <= 0:
+        raise ValueError(f"horizon and step must be positive, got h={horizon_hours} step={step_minutes}")
+    steps = min(MAX_STEPS, -(-horizon_hours * 60 // step_minutes))
+    return pd.DatetimeIndex(pd.Timestamp(last_ts) + pd.to_timedelta(
+        np.arange(1, steps + 1) * step_minutes, unit="m"))
 
-    # Extract features
-    df["day_of_week"] = df["timestamp"].dt.dayofweek
-    df["hour"] = df["timestamp"].dt.hour
 
-    # Cyclical encoding
-    df["day_sin"] = np.sin(2 * np.pi * df["day_of_week"] / 7)
-    df["day_cos"] = np.cos(2 * np.pi * df["day_of_week"] / 7)
-    df["hour_sin"] = np.sin(2 * np.pi * df["hour"] / 24)
-    df["hour_cos"] = np.cos(2 * np.pi * df["hour"] / 24)
+def _iso(timestamps: pd.DatetimeIndex) -> list:
+    # Same strings as Timestamp.isoformat(), without a Python-level loop for naive times
+    if timestamps.tz is not None:
+        return [t.isoformat() for t in timestamps]
+    unit = "us" if (timestamps.microsecond != 0).any() else "s"
+    return np.datetime_as_string(timestamps.values, unit=unit).tolist()
 
-    X = df[["day_sin", "day_cos", "hour_sin", "hour_cos"]]
-    y = df["taken_spots"]
 
+def _rows(timestamps: pd.DatetimeIndex, taken: np.ndarray, est_total: int) -> list:
+    return [{"time": t, "taken_spots": v, "estimated_total": est_total}
+            for t, v in zip(_iso(timestamps), taken.tolist())]
+
+
+def train_random_forest(df: pd.DataFrame):
+    """
+    Train a Random Forest Regressor on time-based features (day/hour cycles).
+    An optional "weight" column (records per rollup bucket) becomes sample_weight.
+    Returns the trained model, estimated_total, and the last timestamp.
+    """
+    X = time_features(pd.DatetimeIndex(df["timestamp"]))
+    y = df["taken_spots"].to_numpy()
+    weight = df["weight"].to_numpy() if "weight" in df else None
+
+    from sklearn.ensemble import RandomForestRegressor  # ~2 s to import: only when a forest is fitted
     model = RandomForestRegressor(n_estimators=200, random_state=42)
-    model.fit(X, y)
+    model.fit(X, y, sample_weight=weight)
 
     # Pick a stable "total spots" estimate
     est_total = int(statistics.median([max(1, t) for t in df["estimated_total"].tolist()]))
@@ -33,68 +71,326 @@ def train_random_forest(df: pd.DataFrame):
     return model, est_total, df["timestamp"].iloc[-1]
 
 
-def forecast_from_history(history_records: list, horizon_hours: int = 12, step_minutes: int = 60):
+def fit_forecaster(history_records: list):
     """
-    Forecast parking occupancy using:
-    - Random Forest (if enough historical data is available)
-    - Moving average fallback (if dataset is tiny)
+    Fit the forecaster that matches the amount of history:
+    - None when there is no data (demo output)
+    - ("ma", taken_ma, est_total, last_ts) for tiny datasets
+    - ("rf", model, est_total, last_ts) otherwise
+    Records may also be hourly rollup buckets (see OccupancyRollups.training_records).
+    The fit time goes to parking_forecast_stage_seconds{stage="fit"}.
     """
+    t0 = time.perf_counter()
+    fitted = _fit_forecaster(history_records)
+    FORECAST_STAGE.observe(time.perf_counter() - t0, stage="fit", model=fitted[0] if fitted else "none")
+    return fitted
+
 
+def _fit_forecaster(history_records: list):
     if not history_records:
-        # No data at all: demo output
-        now = datetime.utcnow()
-        return [
-            {"time": (now + timedelta(minutes=step_minutes * i)).isoformat(),
-             "taken_spots": 130 + i * 5,
-             "estimated_total": 200}
-            for i in range(horizon_hours)
-        ]
+        return None
 
     # Convert history to DataFrame
     df = pd.DataFrame(history_records)
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601")  # datetime.isoformat() drops .ffffff when zero
     df = df.sort_values("timestamp")
 
     # If we don’t have enough records → fallback to moving average
-    if len(df) < 20:  # tweak threshold as you like
+    if len(df) < MIN_RF_RECORDS:
         window = max(1, min(5, len(df)))
         taken_ma = int(df["taken_spots"].tail(window).mean())
         est_total = int(statistics.median([max(1, t) for t in df["estimated_total"].tolist()]))
-        start = df["timestamp"].iloc[-1]
-
-        horizon = []
-        for i in range(1, horizon_hours + 1):
-            ts = start + timedelta(minutes=step_minutes * i)
-            horizon.append({
-                "time": ts.isoformat(),
-                "taken_spots": taken_ma,  # flat line forecast
-                "estimated_total": est_total
-            })
-        return horizon
+        return ("ma", taken_ma, est_total, df["timestamp"].iloc[-1])
 
     # Otherwise → train Random Forest
     model, est_total, last_ts = train_random_forest(df)
+    return ("rf", model, est_total, last_ts)
+
+
+def predict_horizon(fitted, horizon_hours: int = 12, step_minutes: int = 60, start=None,
+                    quantiles=None, band_table=None):
+    """
+    Roll a fitted forecaster (see fit_forecaster) forward over the horizon.
+    `start` overrides the last history timestamp as the origin (used to put
+    several lots on one time grid). With `quantiles` (e.g. (10, 50, 90)) each
+    row also gets p10/p50/p90 keys; band_table is a cached quantile_table().
+    """
+    if fitted is None:
+        # No data at all: demo output
+        times = horizon_index(datetime.utcnow(), horizon_hours, step_minutes) - pd.Timedelta(minutes=step_minutes)
+        return _rows(times, 130 + 5 * np.arange(len(times)), 200)
+
+    kind, model, est_total, last_ts = fitted
+    times = horizon_index(start if start is not None else last_ts, horizon_hours, step_minutes)
+    with timed(FORECAST_STAGE, stage="predict", model=kind):
+        rows = _rows(times, predict_at(fitted, times), est_total)
+    if quantiles:
+        with timed(FORECAST_STAGE, stage="bands", model=kind):
+            keys = [f"p{q:g}" for q in quantiles]
+            for row, band in zip(rows, predict_bands(fitted, times, quantiles, band_table).tolist()):
+                row.update(zip(keys, band))
+    return rows
+
+
+def predict_at(fitted, times: pd.DatetimeIndex) -> np.ndarray:
+    """Predicted taken_spots at arbitrary timestamps (fitted from fit_forecaster / SeasonalForecaster)."""
+    kind, model = fitted[0], fitted[1]
+    if kind == "ma":
+        # flat line forecast
+        return np.full(len(times), model)
+    if kind == "seasonal":
+        return model.predict(times)
+    # One predict call over the whole horizon
+    return model.predict(time_features(times)).astype(int)
+
+
+def quantile_table(fitted, quantiles=DEFAULT_QUANTILES) -> np.ndarray:
+    """
+    (7, 24, len(quantiles)) per-tree quantiles of a fitted forest for every
+    day-of-week x hour cell. The features only see day and hour, so this one
+    pass over estimators_ (168 rows per tree) covers any horizon.
+    """
+    cells = pd.date_range("2024-01-01", periods=7 * 24, freq="h")  # a Monday 00:00
+    per_tree = np.stack([tree.predict(time_features(cells)) for tree in fitted[1].estimators_])
+    return np.percentile(per_tree, quantiles, axis=0).T.reshape(7, 24, len(quantiles))
+
+
+def predict_bands(fitted, times: pd.DatetimeIndex, quantiles=DEFAULT_QUANTILES, band_table=None) -> np.ndarray:
+    """(len(times), len(quantiles)) integer bands for a fitted forecaster."""
+    kind, model = fitted[0], fitted[1]
+    if kind == "rf":
+        table = band_table if band_table is not None else quantile_table(fitted, quantiles)
+        return np.rint(table[times.dayofweek, times.hour]).astype(int)
+    if kind == "seasonal":
+        return model.predict_bands(times, quantiles)
+    # moving average: no spread to speak of
+    return np.full((len(times), len(quantiles)), model)
+
+
+def forecast_from_history(history_records: list, horizon_hours: int = 12, step_minutes: int = 60):
+    """
+    Forecast parking occupancy using:
+    - Random Forest (if enough historical data is available)
+    - Moving average fallback (if dataset is tiny)
+    """
+    return predict_horizon(fit_forecaster(history_records), horizon_hours, step_minutes)
+
+
+class SeasonalForecaster:
+    """
+    Online additive seasonal model: level + damped trend (per hour) + a
+    day-of-week x hour profile, each updated by exponential smoothing.
+
+    update() is O(1) per record and predict() is a table lookup plus a damped
+    trend, so there is nothing to refit: it keeps pace with ingest and answers
+    /forecast?model=seasonal without touching history.
+
+    alpha/gamma are per-record weights for the level and the profile cell;
+    beta is the trend weight per elapsed hour and phi its hourly damping.
+    """
 
-    horizon = []
-    for i in range(1, horizon_hours + 1):
-        ts = last_ts + timedelta(minutes=step_minutes * i)
-
-        # Features for prediction
-        day = ts.dayofweek
-        hour = ts.hour
-        features = {
-            "day_sin": np.sin(2 * np.pi * day / 7),
-            "day_cos": np.cos(2 * np.pi * day / 7),
-            "hour_sin": np.sin(2 * np.pi * hour / 24),
-            "hour_cos": np.cos(2 * np.pi * hour / 24),
+    def __init__(self, alpha: float = 0.01, beta: float = 0.005, gamma: float = 0.3, phi: float = 0.98):
+        self.alpha, self.beta, self.gamma, self.phi = alpha, beta, gamma, phi
+        self._lock = threading.Lock()
+        self.season = np.zeros((7, 24))
+        self.seen = np.zeros((7, 24), dtype=bool)
+        self.level = None
+        self.trend = 0.0
+        self.total = None
+        self.last_ts = None
+        self.err_var = 0.0
+        self.n = 0
+
+    def update(self, timestamp, taken: float, total: float = None):
+        ts = pd.Timestamp(timestamp)
+        d, h = ts.dayofweek, ts.hour
+        with self._lock:
+            if self.level is None:
+                self.level, self.last_ts = float(taken), ts
+                self.total = float(total or 1)
+            dt = (ts - self.last_ts).total_seconds() / 3600 if ts > self.last_ts else 0.0  # hours
+            s = self.season[d, h] if self.seen[d, h] else 0.0
+            prev = self.level
+            if self.n:
+                # one-step-ahead error, for the prediction bands
+                err = taken - (prev + self.trend * dt + s)
+                self.err_var = 0.02 * err * err + 0.98 * self.err_var
+            self.level = self.alpha * (taken - s) + (1 - self.alpha) * (prev + self.trend * dt)
+            if dt > 0:
+                # smoothing weight scales with elapsed time, so dense sampling does not amplify noise
+                w = min(1.0, self.beta * dt)
+                self.trend = w * (self.level - prev) / dt + (1 - w) * self.trend
+            if self.seen[d, h]:
+                self.season[d, h] = self.gamma * (taken - self.level) + (1 - self.gamma) * s
+            else:
+                self.season[d, h], self.seen[d, h] = taken - self.level, True
+            if total:
+                self.total = 0.05 * float(total) + 0.95 * self.total
+            self.last_ts = max(self.last_ts, ts)
+            self.n += 1
+
+    def add(self, record: dict):
+        try:
+            self.update(record["timestamp"], float(record["taken_spots"]), float(record.get("estimated_total") or 0))
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    def predict(self, times: pd.DatetimeIndex) -> np.ndarray:
+        with self._lock:
+            ahead = np.maximum((times - self.last_ts).total_seconds().to_numpy() / 3600, 0)
+            # damped trend: sum of phi^i for i = 1..k hours
+            damped = self.phi * (1 - self.phi ** ahead) / (1 - self.phi)
+            taken = self.level + self.trend * damped + self.season[times.dayofweek, times.hour]
+            return np.clip(np.rint(taken), 0, max(1, round(self.total))).astype(int)
+
+    def predict_bands(self, times: pd.DatetimeIndex, quantiles=DEFAULT_QUANTILES) -> np.ndarray:
+        """Gaussian bands around predict() from the smoothed one-step error variance."""
+        taken = self.predict(times).astype(float)
+        with self._lock:
+            sigma, cap = np.sqrt(self.err_var), max(1, round(self.total))
+        z = np.array([NormalDist().inv_cdf(q / 100) for q in quantiles])
+        return np.clip(np.rint(taken[:, None] + z[None, :] * sigma), 0, cap).astype(int)
+
+    def fitted(self):
+        """The fit_forecaster-style tuple for predict_horizon (None before the first record)."""
+        with self._lock:
+            if self.level is None:
+                return None
+            return ("seasonal", self, max(1, int(round(self.total))), self.last_ts)
+
+
+class ForecastModelCache:
+    """
+    Keeps the last fitted forecaster keyed by the history version (record count,
+    last timestamp) so /forecast does not refit on every dashboard refresh.
+
+    - same version → hit
+    - RF model, fewer than retrain_every new records → stale hit (old model served)
+    - RF model, enough new records → stale hit + refit in a background worker
+    - no model yet, or moving-average mode (cheap) → refit inline (miss); concurrent
+      misses for the same version share that one fit (single-flight)
+
+    stats count /forecast requests only; refresh() after ingest is not a request.
+    """
+
+    def __init__(self, load_history, retrain_every: int = RETRAIN_EVERY, pool: ThreadPoolExecutor = None,
+                 on_update=None):
+        self.load_history = load_history  # () -> list of history records
+        self.on_update = on_update  # on_update(version, kind) after every refit, e.g. to push an event
+        self.retrain_every = max(1, retrain_every)
+        self._lock = threading.Lock()
+        # several caches (one per lot) can share one training pool
+        self._pool = pool or ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast-train")
+        self._training = None  # Future of the running background refit
+        self._inflight = {}    # version -> Future of an inline fit other callers wait on
+        self._fitted = None
+        self._version = None
+        self._bands = {}  # quantiles -> quantile_table() of the current forest
+        self.stats = {
+            "hits": 0, "stale_hits": 0, "misses": 0,
+            "trainings": 0, "background_trainings": 0,
+            "last_train_seconds": None, "total_train_seconds": 0.0,
         }
 
-        taken_pred = int(model.predict([list(features.values())])[0])
+    def _train(self, version):
+        t0 = time.perf_counter()
+        fitted = fit_forecaster(self.load_history())
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self._fitted, self._version, self._bands = fitted, version, {}
+            self.stats["trainings"] += 1
+            self.stats["last_train_seconds"] = round(elapsed, 4)
+            self.stats["total_train_seconds"] = round(self.stats["total_train_seconds"] + elapsed, 4)
+        if self.on_update is not None:
+            self.on_update(version, fitted[0] if fitted else None)
+        return fitted
+
+    def _train_background(self, version):
+        try:
+            self._train(version)
+        except Exception as e:
+            print("⚠️ forecast retrain failed:", e)
+        finally:
+            with self._lock:
+                self._training = None
+
+    def get(self, version, count: bool = True):
+        """
+        version = (record_count, last_timestamp). Returns a fitted forecaster.
+        count=False leaves the request stats alone (internal refreshes).
+        """
+        with self._lock:
+            if self._version == version:
+                if count:
+                    self.stats["hits"] += 1
+                return self._fitted
+            fitted, cached = self._fitted, self._version
+            is_rf = fitted is not None and fitted[0] == "rf"
+            if is_rf and version[0] >= cached[0]:
+                if count:
+                    self.stats["stale_hits"] += 1
+                if version[0] - cached[0] >= self.retrain_every and self._training is None:
+                    self.stats["background_trainings"] += 1
+                    self._training = self._pool.submit(self._train_background, version)
+                return fitted
+            if count:
+                self.stats["misses"] += 1
+            pending = self._inflight.get(version)
+            if pending is None:
+                pending = self._inflight[version] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return pending.result()  # another caller is already fitting this version
+        try:
+            fitted = self._train(version)
+            pending.set_result(fitted)
+            return fitted
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(version, None)
+
+    def refresh(self, version):
+        """
+        Bring the model up to date with `version` off the caller's thread (called
+        after ingest), so viewers get a forecast-updated event instead of polling.
+        """
+        with self._lock:
+            if self._version == version or self._training is not None:
+                return
+        self._pool.submit(self._refresh, version)
+
+    def _refresh(self, version):
+        try:
+            self.get(version, count=False)
+        except Exception as e:
+            print("⚠️ forecast refresh failed:", e)
+
+    def band_table(self, fitted, quantiles):
+        """quantile_table() for the cached forest, computed once per model and quantile set."""
+        if fitted is None or fitted[0] != "rf":
+            return None
+        key = tuple(quantiles)
+        with self._lock:
+            table = self._bands.get(key) if self._fitted is fitted else None
+        if table is None:
+            table = quantile_table(fitted, key)
+            with self._lock:
+                if self._fitted is fitted:
+                    self._bands[key] = table
+        return table
 
-        horizon.append({
-            "time": ts.isoformat(),
-            "taken_spots": taken_pred,
-            "estimated_total": est_total
-        })
+    def forecast(self, version, horizon_hours: int = 12, step_minutes: int = 60, start=None, quantiles=None):
+        fitted = self.get(version)
+        table = self.band_table(fitted, quantiles) if quantiles else None
+        return predict_horizon(fitted, horizon_hours, step_minutes, start=start, quantiles=quantiles, band_table=table)
 
-    return horizon
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, training=self._training is not None,
+                        model=self._fitted[0] if self._fitted else None,
+                        trained_on=self._version[0] if self._version else 0)
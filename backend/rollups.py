@@ -0,0 +1,151 @@
+"""
+Occupancy rollups maintained on ingest.
+
+Two views, both updated in O(1) per record:
+- hourly: one bucket per clock hour (UTC), keyed by epoch hour
+- dow_hour: a 7 x 24 grid (Monday = 0) as NumPy arrays
+
+Each cell keeps count, sum/min/max of the occupancy rate (taken / total) and
+sums of taken_spots and estimated_total, so means come out without rescanning
+history. The forecaster can train on the hourly buckets (FORECAST_TRAIN_ON=
+rollups), which makes training cost depend on hours covered, not records.
+
+save()/load() keep a compact JSON snapshot next to the history, so a restart
+only folds in the records appended after it instead of rescanning everything.
+"""
+import os, json, threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# hourly bucket layout: [count, rate_sum, rate_min, rate_max, taken_sum, total_sum]
+COUNT, RATE_SUM, RATE_MIN, RATE_MAX, TAKEN_SUM, TOTAL_SUM = range(6)
+SNAPSHOT_VERSION = 1
+GRIDS = ("count", "rate_sum", "rate_min", "rate_max", "taken_sum")
+
+
+def _epoch_hour(timestamp: str) -> int:
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() // 3600)
+
+
+def _hour_iso(epoch_hour: int) -> str:
+    return datetime.fromtimestamp(epoch_hour * 3600, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+
+class OccupancyRollups:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hourly: Dict[int, list] = {}
+        self.count = np.zeros((7, 24), dtype=np.int64)
+        self.rate_sum = np.zeros((7, 24))
+        self.rate_min = np.full((7, 24), np.inf)
+        self.rate_max = np.full((7, 24), -np.inf)
+        self.taken_sum = np.zeros((7, 24))
+        self.records = 0
+
+    def add(self, record: dict):
+        try:
+            hour = _epoch_hour(record["timestamp"])
+            taken = float(record.get("taken_spots", 0))
+            total = float(max(1, record.get("estimated_total", 1)))
+        except (KeyError, TypeError, ValueError):
+            return
+        rate = taken / total
+        # epoch hour 0 was a Thursday (dow 3)
+        dow, hod = (hour // 24 + 3) % 7, hour % 24
+        with self._lock:
+            b = self.hourly.get(hour)
+            if b is None:
+                self.hourly[hour] = [1, rate, rate, rate, taken, total]
+            else:
+                b[COUNT] += 1
+                b[RATE_SUM] += rate
+                b[RATE_MIN] = min(b[RATE_MIN], rate)
+                b[RATE_MAX] = max(b[RATE_MAX], rate)
+                b[TAKEN_SUM] += taken
+                b[TOTAL_SUM] += total
+            self.count[dow, hod] += 1
+            self.rate_sum[dow, hod] += rate
+            self.rate_min[dow, hod] = min(self.rate_min[dow, hod], rate)
+            self.rate_max[dow, hod] = max(self.rate_max[dow, hod], rate)
+            self.taken_sum[dow, hod] += taken
+            self.records += 1
+
+    def hourly_rows(self, since: Optional[str] = None, until: Optional[str] = None) -> List[dict]:
+        """Hour buckets, oldest first; since <= hour start < until (ISO timestamps)."""
+        lo = _epoch_hour(since) if since else None
+        hi = _epoch_hour(until) if until else None
+        with self._lock:
+            items = sorted((h, list(b)) for h, b in self.hourly.items()
+                           if (lo is None or h >= lo) and (hi is None or h < hi))
+        return [{"hour": _hour_iso(h), "count": b[COUNT],
+                 "rate_mean": round(b[RATE_SUM] / b[COUNT], 4),
+                 "rate_min": round(b[RATE_MIN], 4), "rate_max": round(b[RATE_MAX], 4),
+                 "taken_mean": round(b[TAKEN_SUM] / b[COUNT], 2),
+                 "total_mean": round(b[TOTAL_SUM] / b[COUNT], 2)} for h, b in items]
+
+    def dow_hour(self) -> dict:
+        """7 x 24 grids (row = Monday..Sunday, column = hour); empty cells are null."""
+        with self._lock:
+            count = self.count.copy()
+            rate_sum, rmin, rmax, taken = self.rate_sum.copy(), self.rate_min.copy(), self.rate_max.copy(), self.taken_sum.copy()
+        empty = count == 0
+        safe = np.maximum(count, 1)
+
+        def grid(values, digits):
+            return np.where(empty, None, np.round(values, digits)).tolist()
+
+        return {"count": count.tolist(), "rate_mean": grid(rate_sum / safe, 4),
+                "rate_min": grid(rmin, 4), "rate_max": grid(rmax, 4), "taken_mean": grid(taken / safe, 2)}
+
+    def training_records(self) -> List[dict]:
+        """
+        One pseudo-record per hour bucket for fit_forecaster: mean taken/total,
+        with the bucket's record count as sample weight.
+        """
+        with self._lock:
+            items = sorted((h, b[COUNT], b[TAKEN_SUM], b[TOTAL_SUM]) for h, b in self.hourly.items())
+        return [{"timestamp": _hour_iso(h), "taken_spots": taken / n, "estimated_total": total / n, "weight": n}
+                for h, n, taken, total in items]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"records": self.records, "hours": len(self.hourly)}
+
+    def save(self, path: str, **meta):
+        """
+        Write a snapshot (temp file + rename, so a crash never leaves half a file).
+        meta says which history it covers, e.g. seq (records folded) and last_timestamp.
+        """
+        with self._lock:
+            state = {"version": SNAPSHOT_VERSION, **meta, "records": self.records,
+                     "hourly": [[h, *b] for h, b in self.hourly.items()],
+                     **{name: getattr(self, name).tolist() for name in GRIDS}}
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[Tuple["OccupancyRollups", dict]]:
+        """(rollups, meta) from a snapshot written by save(), or None if it is missing or unreadable."""
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            if state.pop("version") != SNAPSHOT_VERSION:
+                return None
+            rollups = cls()
+            rollups.records = int(state.pop("records"))
+            rollups.hourly = {int(h): list(b) for h, *b in state.pop("hourly")}
+            for name in GRIDS:
+                grid = np.array(state.pop(name), dtype=getattr(rollups, name).dtype)
+                if grid.shape != (7, 24):
+                    return None
+                setattr(rollups, name, grid)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return rollups, state
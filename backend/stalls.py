@@ -0,0 +1,129 @@
+"""
+Stall-level occupancy state with frame-differencing change detection.
+
+State is one uint8 per stall (0 = open, 1 = occupied) aligned with the layout's
+stall ids. Each frame is first diffed against the previous one inside the stall
+ROIs; only stalls whose pixels moved are re-classified by the detector, so a
+mostly static lot costs one absdiff + bincount per frame.
+"""
+import os, threading
+from collections import deque
+from typing import List, Optional
+
+import numpy as np
+
+from backend.detectors import LocalStallDetector
+
+MOTION_DELTA = int(os.getenv("STALL_MOTION_DELTA", "25"))         # per-pixel change, any channel
+MOTION_FRACTION = float(os.getenv("STALL_MOTION_FRACTION", "0.05"))  # share of a stall that moved
+FULL_EVERY = int(os.getenv("STALL_FULL_EVERY", "50"))              # full re-check every N frames
+MAX_CHANGES = 10000
+
+
+def pack_state(state: np.ndarray) -> str:
+    """uint8/bool vector → hex string (1 bit per stall) for history records."""
+    return np.packbits(state.astype(bool)).tobytes().hex()
+
+
+def unpack_state(hex_bits: str, n: int) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(bytes.fromhex(hex_bits), dtype=np.uint8))[:n].astype(np.uint8)
+
+
+class StallTracker:
+    def __init__(self, detector: LocalStallDetector, motion_delta: int = MOTION_DELTA,
+                 motion_fraction: float = MOTION_FRACTION, full_every: int = FULL_EVERY):
+        self.detector = detector
+        self.ids: List[str] = detector.stall_ids
+        self.n = detector.n
+        self.motion_delta = motion_delta
+        self.motion_fraction = motion_fraction
+        self.full_every = max(1, full_every)
+
+        self.state = np.zeros(self.n, dtype=np.uint8)
+        self.known = False
+        self.updated_at: Optional[str] = None
+        self._prev = None
+        self._frames = 0
+        self._lock = threading.Lock()
+
+        # change log of (seq, timestamp, stall index, new state) tuples, oldest first
+        self.change_seq = 0
+        self._changes = deque(maxlen=MAX_CHANGES)
+        self.stats = {"frames": 0, "stalls_evaluated": 0, "stalls_skipped": 0, "changes": 0}
+
+    def restore(self, hex_bits: str, timestamp: Optional[str] = None):
+        """Seed the state from the last history record after a restart."""
+        with self._lock:
+            self.state = unpack_state(hex_bits, self.n)
+            self.known = True
+            self.updated_at = timestamp
+
+    def _moved(self, roi: np.ndarray) -> np.ndarray:
+        if self._prev is None or self._prev.shape != roi.shape:
+            return np.ones(self.n, dtype=bool)
+        import cv2  # loaded by LocalStallDetector already; a dict lookup here
+        # max over channels: a red car on grey asphalt barely changes luminance
+        moved = cv2.absdiff(roi, self._prev).max(axis=2) > self.motion_delta
+        frac = np.bincount(self.detector.labels.ravel(), weights=moved.ravel(),
+                           minlength=self.n + 1)[1:] / self.detector.area
+        return frac > self.motion_fraction
+
+    def update(self, bgr: np.ndarray, timestamp: str) -> dict:
+        """
+        Classify the frame, re-evaluating only stalls that moved since the last
+        frame (plus everything on the first frame and every full_every frames).
+        """
+        roi = self.detector.roi(bgr)
+        with self._lock:
+            self._frames += 1
+            full = not self.known or self._frames % self.full_every == 0
+            todo = np.arange(self.n) if full else np.flatnonzero(self._moved(roi))
+            self._prev = roi.copy()
+
+            changed = np.empty(0, dtype=np.int64)
+            if len(todo):
+                occupied = self.detector.classify_roi(roi, None if full else todo)
+                new = occupied[todo].astype(np.uint8)
+                changed = todo[new != self.state[todo]]
+                self.state[todo] = new
+                for i in changed:
+                    self.change_seq += 1
+                    self._changes.append((self.change_seq, timestamp, int(i), int(self.state[i])))
+            self.known = True
+            self.updated_at = timestamp
+
+            self.stats["frames"] += 1
+            self.stats["stalls_evaluated"] += len(todo)
+            self.stats["stalls_skipped"] += self.n - len(todo)
+            self.stats["changes"] += len(changed)
+            taken = int(self.state.sum())
+            return {"occupied": taken, "open_spots": self.n - taken, "ok": True,
+                    "stall_state": pack_state(self.state),
+                    "stalls_evaluated": int(len(todo)), "stalls_changed": int(len(changed))}
+
+    def snapshot(self, geometry: bool = False) -> dict:
+        with self._lock:
+            out = {
+                "ids": self.ids,
+                "state": self.state.tolist(),
+                "occupied": int(self.state.sum()),
+                "total": self.n,
+                "known": self.known,
+                "updated_at": self.updated_at,
+                "change_seq": self.change_seq,
+                "stats": dict(self.stats),
+            }
+        if geometry:
+            out["polygons"] = self.detector.polygons
+        return out
+
+    def changes(self, since_seq: Optional[int] = None, since_ts: Optional[str] = None) -> List[dict]:
+        """Changes after sequence number since_seq, or at/after timestamp since_ts."""
+        with self._lock:
+            entries = list(self._changes)
+        if since_seq is not None:
+            entries = [c for c in entries if c[0] > since_seq]
+        if since_ts is not None:
+            entries = [c for c in entries if c[1] and c[1] >= since_ts]
+        return [{"seq": seq, "timestamp": ts, "stall": self.ids[i], "occupied": bool(state)}
+                for seq, ts, i, state in entries]
@@ -0,0 +1,333 @@
+"""
+Storage engines for the parking occupancy history.
+
+The API used to keep every record in one JSON array that was re-read and
+rewritten on each ingest. The engines below keep the same record dicts but
+append them in O(1) and answer tail / time-range queries through an index:
+
+- JsonlHistoryStore: append-only JSON Lines file + in-memory timestamp index
+- SqliteHistoryStore: SQLite in WAL mode with an index on the timestamp
+
+Pick one with HISTORY_ENGINE=jsonl|sqlite (default: jsonl).
+
+Both engines keep the newest HISTORY_RING_SIZE records in an in-process ring
+buffer, so "latest N" and cursor polls never touch the disk.
+"""
+import os, json, bisect, sqlite3, threading
+from collections import deque
+from typing import Iterator, List, Optional
+
+RING_SIZE = int(os.getenv("HISTORY_RING_SIZE", "1000"))
+CHUNK_ROWS = 500  # SQLite rows fetched per round trip when streaming
+
+
+def _ts(record: dict) -> str:
+    # ISO-8601 strings in one format sort lexicographically == chronologically
+    return str(record.get("timestamp", ""))
+
+
+class HistoryStore:
+    """
+    Common interface for history engines. All methods are thread-safe.
+
+    Every record gets a sequence number (0-based, insertion order) which doubles
+    as the /history pagination cursor. Subclasses implement the _-prefixed disk
+    methods; the public ones serve from the ring buffer whenever they can.
+    """
+
+    def __init__(self, ring_size: int = RING_SIZE):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=max(1, ring_size))  # (seq, record), oldest first
+
+    # ----- engine hooks -----
+    def _append(self, record: dict) -> int:
+        raise NotImplementedError
+
+    def _read_seq(self, start: int, stop: int) -> Iterator[dict]:
+        """Records with start <= seq < stop, read from disk."""
+        raise NotImplementedError
+
+    def _rewrite(self, records: List[dict]):
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def range(self, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[dict]:
+        """Records with since <= timestamp < until, in timestamp order."""
+        raise NotImplementedError
+
+    # ----- ring buffer -----
+    def _warm(self):
+        self._recent.clear()
+        total = self.count()
+        start = max(0, total - self._recent.maxlen)
+        for seq, record in enumerate(self._read_seq(start, total), start):
+            self._recent.append((seq, record))
+
+    def _ring_start(self) -> int:
+        return self._recent[0][0] if self._recent else self.count()
+
+    # ----- public API -----
+    def append(self, record: dict) -> int:
+        """Persist one record and return its sequence number."""
+        with self._lock:
+            seq = self._append(record)
+            self._recent.append((seq, record))
+            return seq
+
+    def tail(self, n: int) -> List[dict]:
+        """Last n records in insertion order."""
+        if n <= 0:
+            return []
+        with self._lock:
+            if n <= len(self._recent) or len(self._recent) == self.count():
+                return [r for _, r in list(self._recent)[-n:]]
+            total = self.count()
+            records = self._read_seq(max(0, total - n), total)  # positions taken under the lock, read lazily
+        return list(records)
+
+    def after(self, cursor: int, limit: Optional[int] = None):
+        """
+        Records with seq >= cursor in insertion order (at most limit of them).
+        Returns (records, next_cursor); records is a list when served from the
+        ring buffer and a lazy disk iterator otherwise.
+        """
+        cursor = max(0, cursor)
+        with self._lock:
+            total = self.count()
+            stop = total if not limit else min(total, cursor + limit)
+            stop = max(stop, cursor)
+            if cursor >= self._ring_start():
+                return [r for seq, r in self._recent if cursor <= seq < stop], stop
+            return self._read_seq(cursor, stop), stop
+
+    def rewrite(self, records: List[dict]):
+        """Replace the whole history (admin / repair path, not the hot path)."""
+        with self._lock:
+            self._rewrite(records)
+            self._warm()
+
+    def read_all(self) -> List[dict]:
+        return list(self.range())
+
+    def migrate_from_json(self, legacy_path: str) -> int:
+        """
+        One-shot import of the old whole-file JSON history.
+        Only runs when this store is still empty; returns the number of imported records.
+        """
+        if self.count() or not os.path.exists(legacy_path):
+            return 0
+        with open(legacy_path, "r") as f:
+            try:
+                records = json.load(f)
+            except Exception:
+                return 0
+        if not isinstance(records, list):
+            return 0
+        self.rewrite(records)
+        return len(records)
+
+
+class JsonlHistoryStore(HistoryStore):
+    """
+    One JSON object per line. The file is scanned once at startup to build:
+    - _offsets: byte offset of every record in insertion order (tail queries)
+    - _index_ts/_index_off: offsets sorted by timestamp (bisect range queries)
+    """
+
+    def __init__(self, path: str, ring_size: int = RING_SIZE):
+        super().__init__(ring_size)
+        self.path = path
+        self._offsets: List[int] = []
+        self._index_ts: List[str] = []
+        self._index_off: List[int] = []
+        if not os.path.exists(path):
+            open(path, "ab").close()
+        self._load_index()
+        self._warm()
+
+    def _load_index(self):
+        self._offsets, self._index_ts, self._index_off = [], [], []
+        pairs = []
+        with open(self.path, "rb") as f:
+            offset = 0
+            line = b""
+            for line in f:
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except Exception:
+                        record = None  # corrupt line: skip it
+                    if record is not None and line.endswith(b"\n"):
+                        self._offsets.append(offset)
+                        pairs.append((_ts(record), offset))
+                offset += len(line)
+        if line and not line.endswith(b"\n"):
+            # torn last write from a crash: cut it off, or the next append would be glued onto it
+            with open(self.path, "r+b") as f:
+                f.truncate(offset - len(line))
+            print(f"⚠️ {self.path}: dropped a torn last line ({len(line)} bytes)")
+        pairs.sort()
+        self._index_ts = [p[0] for p in pairs]
+        self._index_off = [p[1] for p in pairs]
+
+    def _index_add(self, ts: str, offset: int):
+        if not self._index_ts or ts >= self._index_ts[-1]:
+            self._index_ts.append(ts)
+            self._index_off.append(offset)
+        else:
+            # out-of-order timestamp (rare): keep the index sorted
+            i = bisect.bisect_right(self._index_ts, ts)
+            self._index_ts.insert(i, ts)
+            self._index_off.insert(i, offset)
+
+    def _read_at(self, f, offset: int) -> dict:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def _append(self, record: dict) -> int:
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            f.write(line)
+        self._offsets.append(offset)
+        self._index_add(_ts(record), offset)
+        return len(self._offsets) - 1
+
+    def _read_offsets(self, offsets: List[int]) -> Iterator[dict]:
+        with open(self.path, "rb") as f:
+            for off in offsets:
+                yield self._read_at(f, off)
+
+    def _read_seq(self, start: int, stop: int) -> Iterator[dict]:
+        # slice now (under the caller's lock), read lazily
+        return self._read_offsets(self._offsets[start:stop])
+
+    def count(self) -> int:
+        return len(self._offsets)
+
+    def range(self, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[dict]:
+        with self._lock:
+            lo = bisect.bisect_left(self._index_ts, since) if since else 0
+            hi = bisect.bisect_left(self._index_ts, until) if until else len(self._index_ts)
+            offsets = self._index_off[lo:hi]
+        return self._read_offsets(offsets)
+
+    def _rewrite(self, records: List[dict]):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        os.replace(tmp, self.path)
+        self._load_index()
+
+
+class SqliteHistoryStore(HistoryStore):
+    """
+    SQLite in WAL mode, so readers never block the writer. The count, the
+    sequence numbers and the ring buffer are kept in this process, so run one
+    API process per data dir (as with the JSONL engine).
+    """
+
+    def __init__(self, path: str, ring_size: int = RING_SIZE):
+        super().__init__(ring_size)
+        self.path = path
+        # the connection is shared across threads; generators hold it only per chunk
+        self._lock_io = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " ts TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_ts ON history(ts)")
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        self._warm()
+
+    def _append(self, record: dict) -> int:
+        with self._lock_io:
+            self._db.execute(
+                "INSERT INTO history (ts, data) VALUES (?, ?)",
+                (_ts(record), json.dumps(record, separators=(",", ":"))),
+            )
+            self._db.commit()
+        self._count += 1
+        return self._count - 1
+
+    def _read_seq(self, start: int, stop: int) -> Iterator[dict]:
+        # seq is dense from 1 (only _rewrite deletes rows, and it resets the counter): cursor seq = row seq - 1
+        while start < stop:
+            n = min(CHUNK_ROWS, stop - start)
+            with self._lock_io:
+                rows = self._db.execute(
+                    "SELECT data FROM history WHERE seq > ? AND seq <= ? ORDER BY seq", (start, start + n)
+                ).fetchall()
+            for r in rows:
+                yield json.loads(r[0])
+            if len(rows) < n:
+                return
+            start += n
+
+    def count(self) -> int:
+        return self._count
+
+    def range(self, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[dict]:
+        # keyset pagination over (ts, seq) so deep scans stream in bounded chunks
+        last = None
+        while True:
+            sql, args = "SELECT seq, ts, data FROM history WHERE 1=1", []
+            if since:
+                sql += " AND ts >= ?"
+                args.append(since)
+            if until:
+                sql += " AND ts < ?"
+                args.append(until)
+            if last:
+                sql += " AND (ts, seq) > (?, ?)"
+                args.extend(last)
+            sql += " ORDER BY ts, seq LIMIT ?"
+            args.append(CHUNK_ROWS)
+            with self._lock_io:
+                rows = self._db.execute(sql, args).fetchall()
+            for r in rows:
+                yield json.loads(r[2])
+            if len(rows) < CHUNK_ROWS:
+                return
+            last = (rows[-1][1], rows[-1][0])
+
+    def _rewrite(self, records: List[dict]):
+        with self._lock_io, self._db:
+            self._db.execute("DELETE FROM history")
+            self._db.execute("DELETE FROM sqlite_sequence WHERE name = 'history'")
+            self._db.executemany(
+                "INSERT INTO history (ts, data) VALUES (?, ?)",
+                [(_ts(r), json.dumps(r, separators=(",", ":"))) for r in records],
+            )
+        self._count = len(records)
+
+
+ENGINES = {
+    "jsonl": (JsonlHistoryStore, "parking_history.jsonl"),
+    "sqlite": (SqliteHistoryStore, "parking_history.db"),
+}
+
+
+def open_store(data_dir: str, engine: Optional[str] = None, legacy_json: Optional[str] = None) -> HistoryStore:
+    """
+    Open (or create) the history store in data_dir and migrate legacy_json into it once.
+    """
+    engine = (engine or os.getenv("HISTORY_ENGINE", "jsonl")).lower()
+    if engine not in ENGINES:
+        raise ValueError(f"unknown HISTORY_ENGINE: {engine} (expected one of {', '.join(ENGINES)})")
+    cls, filename = ENGINES[engine]
+    store = cls(os.path.join(data_dir, filename))
+    if legacy_json:
+        migrated = store.migrate_from_json(legacy_json)
+        if migrated:
+            print(f"📦 Migrated {migrated} records from {legacy_json} into {store.path}")
+    return store
@@ -1,5 +1,8 @@
 # backend/streaming/snapshot_worker.py
-import os, time, requests, cv2
+import os, json, time, threading, requests, cv2
+import multiprocessing as mp
+from typing import Optional
+import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,14 +10,38 @@ load_dotenv()
 API = os.getenv("API_URL", "http://127.0.0.1:8000")
 STREAM_URL = os.getenv("STREAM_URL", "")
 FALLBACK_URL = os.getenv("FALLBACK_URL", "")
+# raw: POST the decoded frame bytes to /ingest/raw (API writes the preview)
+# path: write latest.jpg here and POST its path to /ingest/frame (API on the same host)
+INGEST_MODE = os.getenv("INGEST_MODE", "raw")
+# Many lots: JSON list of {"lot": "...", "stream_url": "...", "fallback_url": "...", "interval": 30}
+LOTS_CONFIG = os.getenv("LOTS_CONFIG", "")
+DEFAULT_LOT = "default"
 
 # Save where FastAPI serves/reads: backend/data/images/latest.jpg
 BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 IMAGES_DIR = os.path.join(BACKEND_DIR, "data", "images")
 LATEST = os.path.join(IMAGES_DIR, "latest.jpg")
 
-INTERVAL_SECONDS = 30
+INTERVAL_SECONDS = 30  # fixed interval, and the adaptive scheduler's starting point
+
+# ---------- Adaptive sampling (ADAPTIVE_SAMPLING=0 keeps the fixed interval) ----------
+# Sample faster while the scene or the counts move, back off exponentially while
+# it is static; a big scene change between samples triggers one right away.
+ADAPTIVE_SAMPLING = os.getenv("ADAPTIVE_SAMPLING", "1") == "1"
+SAMPLE_MIN_SEC = float(os.getenv("SAMPLE_MIN_SEC", "5"))     # also how often the scene is checked
+SAMPLE_MAX_SEC = float(os.getenv("SAMPLE_MAX_SEC", "600"))
+SAMPLE_BACKOFF = float(os.getenv("SAMPLE_BACKOFF", "2"))     # interval x this per static sample, / this when busy
+DIFF_HIGH = float(os.getenv("SAMPLE_DIFF_HIGH", "0.04"))     # mean abs pixel change (0..1) that counts as busy
+DIFF_STATIC = float(os.getenv("SAMPLE_DIFF_STATIC", "0.01"))
+OCC_DELTA_HIGH = float(os.getenv("SAMPLE_OCC_DELTA_HIGH", "0.05"))   # occupancy rate change between samples
+OCC_DELTA_STATIC = float(os.getenv("SAMPLE_OCC_DELTA_STATIC", "0.01"))
+# inferences per hour across all lots (0 = unlimited)
+INFERENCE_BUDGET_PER_HOUR = float(os.getenv("INFERENCE_BUDGET_PER_HOUR", "0"))
+SAMPLING_LOG = os.getenv("SAMPLING_LOG", "")  # optional JSONL file of scheduler decisions
 TIMEOUT_SEC = 10
+RECONNECT_MIN_SEC = 1
+RECONNECT_MAX_SEC = 60
+STALE_FRAME_SEC = 60  # don't ingest a frame held over from before an outage
 
 def _resolve(url_or_path: str) -> str:
     # URLs pass through; local paths resolved relative to backend/
@@ -30,45 +57,359 @@ def _open_capture(src: str):
         return None
     return cap
 
-def grab_one_frame():
-    os.makedirs(IMAGES_DIR, exist_ok=True)
+class CaptureSession(threading.Thread):
+    """
+    Keeps the source open and continuously drains it into a single-slot
+    "latest frame" buffer, so sampling never pays for connect + codec
+    negotiation + keyframe wait. Reconnects with exponential backoff.
+    Local files are paced at their native FPS and looped at EOF.
+    """
+
+    def __init__(self, stream_url: str = STREAM_URL, fallback_url: str = FALLBACK_URL, lot: str = DEFAULT_LOT):
+        super().__init__(name=f"capture-{lot}", daemon=True)
+        self.stream_url = stream_url
+        self.fallback_url = fallback_url
+        self.lot = lot
+        self.cond = threading.Condition()
+        self.frame = None
+        self.frame_ts = 0.0
+        self.source = None
+        self.reconnects = 0
+        self.running = True
+        self.timings = {}  # stage -> seconds, sent to the API with the next frame (X-Capture-Timings)
+
+    def _connect(self):
+        # try live first, fallback to local MP4 if live fails
+        candidates = []
+        if self.stream_url:
+            candidates.append(("STREAM_URL", _resolve(self.stream_url)))
+        if self.fallback_url:
+            candidates.append(("FALLBACK_URL", _resolve(self.fallback_url)))
+        for name, src in candidates:
+            t0 = time.perf_counter()
+            cap = _open_capture(src)
+            if cap is not None:
+                opened = time.perf_counter() - t0
+                self.timings["open"] = opened  # reported once per (re)connect
+                print(f"[capture:{self.lot}] opened {name} in {opened:.2f}s")
+                return cap, name, os.path.exists(src)
+        return None, None, False
+
+    def run(self):
+        backoff = RECONNECT_MIN_SEC
+        while self.running:
+            cap, name, is_file = self._connect()
+            if cap is None:
+                print(f"⚠️ [capture:{self.lot}] cannot open any source (STREAM_URL and FALLBACK_URL), retry in {backoff}s")
+                time.sleep(backoff)
+                backoff = min(RECONNECT_MAX_SEC, backoff * 2)
+                continue
+
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            pace = 1.0 / fps if is_file else 0.0
+            got_any = False
+            while self.running:
+                t0 = time.perf_counter()
+                ok, frame = cap.read()
+                if not ok or frame is None:
+                    break
+                got_any = True
+                with self.cond:
+                    self.frame, self.frame_ts, self.source = frame, time.time(), name
+                    self.timings["read"] = time.perf_counter() - t0
+                    self.cond.notify_all()
+                if pace:
+                    time.sleep(pace)
+            cap.release()
+
+            if got_any:
+                backoff = RECONNECT_MIN_SEC  # the source worked, this is a drop or EOF
+            self.reconnects += 1
+            print(f"[capture:{self.lot}] {name} ended, reconnect #{self.reconnects} in {backoff}s")
+            time.sleep(backoff)
+            if not got_any:
+                backoff = min(RECONNECT_MAX_SEC, backoff * 2)
+
+    def latest(self, timeout: float = TIMEOUT_SEC):
+        """Newest frame as (frame, captured_at, source); waits up to timeout for the first one."""
+        with self.cond:
+            if self.frame is None:
+                self.cond.wait_for(lambda: self.frame is not None, timeout=timeout)
+            return self.frame, self.frame_ts, self.source
+
+    def take_timings(self) -> dict:
+        """Stage timings since the last call; `open` only appears after a (re)connect."""
+        with self.cond:
+            timings = dict(self.timings)
+            self.timings.pop("open", None)
+        return timings
+
+    def stop(self):
+        self.running = False
+
 
-    # try live first
-    live_src = _resolve(STREAM_URL) if STREAM_URL else None
-    cap = _open_capture(live_src) if live_src else None
-    source = "STREAM_URL"
+def _lot_images_dir(lot: str) -> str:
+    # mirrors backend/lots.py: the default lot keeps data/images/latest.jpg
+    return IMAGES_DIR if lot == DEFAULT_LOT else os.path.join(IMAGES_DIR, lot)
 
-    # fallback to local MP4 if live fails
-    if cap is None and FALLBACK_URL:
-        fb_src = _resolve(FALLBACK_URL)
-        cap = _open_capture(fb_src)
-        source = "FALLBACK_URL"
+sessions = {}
 
-    if cap is None:
-        raise RuntimeError("Cannot open any source (STREAM_URL and FALLBACK_URL).")
+def grab_one_frame(lot: str = DEFAULT_LOT, stream_url: str = STREAM_URL, fallback_url: str = FALLBACK_URL,
+                   log: bool = True):
+    session = sessions.get(lot)
+    if session is None:
+        session = sessions[lot] = CaptureSession(stream_url, fallback_url, lot)
+        session.start()
 
-    ok, frame = cap.read()
-    cap.release()
-    if not ok or frame is None:
-        raise RuntimeError(f"Failed to read frame from {source}")
+    frame, captured_at, source = session.latest()
+    if frame is None:
+        raise RuntimeError("No frame from STREAM_URL or FALLBACK_URL yet.")
+    if time.time() - captured_at > STALE_FRAME_SEC:
+        raise RuntimeError(f"Latest frame from {source} is stale (source down, {session.reconnects} reconnects)")
 
-    cv2.imwrite(LATEST, frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-    return LATEST, source
+    if log:
+        print(f"[capture:{lot}] sample from {source}: frame age {time.time() - captured_at:.2f}s, "
+              f"reconnects {session.reconnects}")
+    return frame, source, captured_at
 
-def post_ingest(frame_path):
-    # FastAPI expects {"path": "..."} at /ingest/frame
-    payload = {"path": frame_path}
-    r = requests.post(f"{API}/ingest/frame", json=payload, timeout=TIMEOUT_SEC)
+def save_latest(frame, lot: str = DEFAULT_LOT):
+    # atomic: the API's StaticFiles mount never sees a half-written latest.jpg
+    images_dir = _lot_images_dir(lot)
+    os.makedirs(images_dir, exist_ok=True)
+    latest = os.path.join(images_dir, "latest.jpg")
+    tmp = os.path.join(images_dir, "latest.tmp.jpg")
+    cv2.imwrite(tmp, frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    os.replace(tmp, latest)
+    return latest
+
+def _timing_headers(timings: Optional[dict]) -> dict:
+    return {"X-Capture-Timings": json.dumps({k: round(v, 6) for k, v in timings.items()})} if timings else {}
+
+def post_raw(frame, source, lot: str = DEFAULT_LOT, captured_at: Optional[float] = None,
+             timings: Optional[dict] = None):
+    # FastAPI reshapes the body back into a (height, width, channels) uint8 array
+    h, w = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    params = {"width": w, "height": h, "channels": channels, "lot": lot,
+              "name": f"{source}_{int(time.time())}.raw"}
+    if captured_at is not None:
+        params["captured_at"] = captured_at  # joined with drone telemetry by the API
+    timings = dict(timings or {})
+    t0 = time.perf_counter()
+    body = frame.tobytes()
+    timings["encode"] = time.perf_counter() - t0
+    r = requests.post(f"{API}/ingest/raw", params=params, data=body,
+                      headers={"Content-Type": "application/octet-stream", **_timing_headers(timings)},
+                      timeout=TIMEOUT_SEC)
     r.raise_for_status()
     return r.json()
 
-if __name__ == "__main__":
-    print(f"[worker] STREAM_URL set? {bool(STREAM_URL)} | FALLBACK_URL set? {bool(FALLBACK_URL)}")
+def post_ingest(frame_path, lot: str = DEFAULT_LOT, captured_at: Optional[float] = None,
+                timings: Optional[dict] = None):
+    # FastAPI expects {"path": "...", "lot": "...", "captured_at": ...} at /ingest/frame
+    payload = {"path": frame_path, "lot": lot, "captured_at": captured_at}
+    r = requests.post(f"{API}/ingest/frame", json=payload, headers=_timing_headers(timings), timeout=TIMEOUT_SEC)
+    r.raise_for_status()
+    return r.json()
+
+# ---------- Adaptive sampling ----------
+def scene_thumb(frame):
+    """Small grayscale copy for change detection (cheap; no inference involved)."""
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+def scene_diff(thumb, previous) -> Optional[float]:
+    """Mean absolute pixel change, 0..1; None when there is nothing to compare with yet."""
+    if previous is None:
+        return None
+    return float(np.abs(thumb - previous).mean() / 255)
+
+def job_rate(job_id: str) -> Optional[float]:
+    """Occupancy rate (taken / total) of a finished ingest job, None while it is still queued or failed."""
+    try:
+        job = requests.get(f"{API}/ingest/jobs/{job_id}", timeout=TIMEOUT_SEC).json()
+        record = (job.get("result") or {}).get("appended") if job.get("status") == "done" else None
+    except Exception:
+        return None
+    if not record:
+        return None
+    return record.get("taken_spots", 0) / max(1, record.get("estimated_total", 1))
+
+class InferenceBudget:
+    """
+    Inferences per hour shared by every lot process (token bucket refilled at
+    per_hour / 3600 per second, bursts up to 5 minutes' worth). 0 = unlimited.
+    """
+
+    def __init__(self, per_hour: float = INFERENCE_BUDGET_PER_HOUR):
+        self.per_hour = per_hour
+        if per_hour > 0:
+            self.rate = per_hour / 3600
+            self.capacity = max(1.0, per_hour / 12)
+            self._tokens = mp.Value("d", self.capacity, lock=False)
+            self._updated = mp.Value("d", time.time(), lock=False)
+            self._lock = mp.Lock()
+
+    def take(self) -> bool:
+        if self.per_hour <= 0:
+            return True
+        with self._lock:
+            now = time.time()
+            self._tokens.value = min(self.capacity, self._tokens.value + (now - self._updated.value) * self.rate)
+            self._updated.value = now
+            if self._tokens.value >= 1:
+                self._tokens.value -= 1
+                return True
+            return False
+
+    def give_back(self):
+        # the frame did not reach the model (e.g. skipped by the telemetry gate)
+        if self.per_hour > 0:
+            with self._lock:
+                self._tokens.value = min(self.capacity, self._tokens.value + 1)
+
+class AdaptiveScheduler:
+    """
+    Next sampling interval from what changed since the previous sample:
+    busy (scene diff or occupancy delta above the high marks) divides the
+    interval by SAMPLE_BACKOFF, static (both below the static marks)
+    multiplies it, anything in between keeps it; always within
+    [min_sec, max_sec]. The occupancy delta lags one sample, since counts
+    come back from the async ingest job. Also tallies what a fixed
+    base-second schedule would have sent, for the savings in the log.
+    """
+
+    def __init__(self, base: float = INTERVAL_SECONDS, min_sec: float = SAMPLE_MIN_SEC,
+                 max_sec: float = SAMPLE_MAX_SEC, adaptive: bool = ADAPTIVE_SAMPLING):
+        self.base, self.min_sec, self.max_sec, self.adaptive = base, min_sec, max_sec, adaptive
+        self.interval = min(max(base, min_sec), max_sec) if adaptive else base
+        self.peek = min_sec if adaptive else base  # how often the scene is checked between samples
+        self.started = time.time()
+        self.sent = self.gate_skipped = self.budget_skipped = 0
+
+    def update(self, diff: Optional[float], occ_delta: Optional[float]) -> str:
+        if not self.adaptive:
+            return "fixed"
+        if diff is None:
+            return "steady"  # first sample, nothing to compare with
+        moved = abs(occ_delta) if occ_delta is not None else 0.0
+        if diff >= DIFF_HIGH or moved >= OCC_DELTA_HIGH:
+            self.interval = max(self.min_sec, self.interval / SAMPLE_BACKOFF)
+            return "busy"
+        if diff < DIFF_STATIC and moved < OCC_DELTA_STATIC:
+            self.interval = min(self.max_sec, self.interval * SAMPLE_BACKOFF)
+            return "static"
+        return "steady"
+
+    def savings(self) -> dict:
+        fixed = 1 + int((time.time() - self.started) // self.base)
+        return {"sent": self.sent, "gate_skipped": self.gate_skipped, "budget_skipped": self.budget_skipped,
+                "fixed_would_send": fixed, "saved_pct": round(100 * (1 - self.sent / fixed), 1)}
+
+def log_decision(lot: str, decision: dict):
+    line = json.dumps(decision)
+    print(f"[sampler:{lot}] {line}")
+    if SAMPLING_LOG:
+        with open(SAMPLING_LOG, "a") as f:
+            f.write(line + "\n")
+
+def load_lots():
+    """Capture configs: LOTS_CONFIG (JSON file) or the single STREAM_URL/FALLBACK_URL lot."""
+    if not LOTS_CONFIG:
+        return [{"lot": DEFAULT_LOT, "stream_url": STREAM_URL, "fallback_url": FALLBACK_URL}]
+    with open(_resolve(LOTS_CONFIG), "r") as f:
+        return json.load(f)
+
+def run_lot(cfg: dict, budget: Optional[InferenceBudget] = None):
+    """
+    Capture + ingest loop for one lot (runs in its own process under the supervisor).
+    cfg may override interval / min_interval / max_interval per lot.
+    """
+    lot = cfg.get("lot", DEFAULT_LOT)
+    budget = budget or InferenceBudget()
+    scheduler = AdaptiveScheduler(cfg.get("interval", INTERVAL_SECONDS), cfg.get("min_interval", SAMPLE_MIN_SEC),
+                                  cfg.get("max_interval", SAMPLE_MAX_SEC))
+    print(f"[worker:{lot}] STREAM_URL set? {bool(cfg.get('stream_url'))} | "
+          f"FALLBACK_URL set? {bool(cfg.get('fallback_url'))} | "
+          f"{'adaptive' if scheduler.adaptive else 'fixed'} sampling, start {scheduler.interval:g}s")
+    last_thumb, last_rate, pending_job = None, None, None
+    next_due = 0.0
+    starved = False  # out of budget: no scene-change triggers until the next scheduled sample
     while True:
         try:
-            path, src = grab_one_frame()
-            resp = post_ingest(path)
-            print(f"✅ frame ({src}) -> /ingest/frame | spots logged -> history count may grow")
+            frame, src, captured_at = grab_one_frame(lot, cfg.get("stream_url", ""), cfg.get("fallback_url", ""),
+                                                     log=False)
+            thumb = scene_thumb(frame)
+            diff = scene_diff(thumb, last_thumb)
+            now = time.time()
+            if now >= next_due or (scheduler.adaptive and not starved and diff is not None and diff >= DIFF_HIGH):
+                decision = {"t": round(now, 3), "lot": lot, "trigger": "schedule" if now >= next_due else "scene_change",
+                            "diff": round(diff, 4) if diff is not None else None}
+                occ_delta = None
+                if pending_job:
+                    rate = job_rate(pending_job)
+                    if rate is not None:
+                        occ_delta = rate - last_rate if last_rate is not None else None
+                        last_rate = rate
+                decision["occ_delta"] = round(occ_delta, 4) if occ_delta is not None else None
+
+                starved = not budget.take()
+                if starved:
+                    scheduler.budget_skipped += 1
+                    decision["action"] = "budget_skip"
+                else:
+                    timings = sessions[lot].take_timings()
+                    if INGEST_MODE == "path":
+                        t0 = time.perf_counter()
+                        path = save_latest(frame, lot)
+                        timings["encode"] = time.perf_counter() - t0
+                        resp = post_ingest(path, lot, captured_at, timings)
+                    else:
+                        resp = post_raw(frame, src, lot, captured_at, timings)
+                    if resp.get("skipped"):
+                        budget.give_back()
+                        scheduler.gate_skipped += 1
+                        decision["action"] = "gate_skip"
+                        print(f"⏭️ [{lot}] frame ({src}) skipped by telemetry gate: {resp.get('reason')}")
+                    else:
+                        scheduler.sent += 1
+                        pending_job = resp.get("job_id")
+                        decision["action"] = "sent"
+                        print(f"✅ [{lot}] frame ({src}) -> /ingest/{'frame' if INGEST_MODE == 'path' else 'raw'} "
+                              f"| queued as job {pending_job}")
+                    last_thumb = thumb
+
+                decision["state"] = scheduler.update(diff, occ_delta)
+                decision["interval"] = round(scheduler.interval, 2)
+                decision.update(scheduler.savings())
+                log_decision(lot, decision)
+                next_due = time.time() + scheduler.interval
         except Exception as e:
-            print("⚠️ worker error:", e)
-        time.sleep(INTERVAL_SECONDS)
\ No newline at end of file
+            print(f"⚠️ [{lot}] worker error:", e)
+            next_due = time.time() + scheduler.interval
+        time.sleep(max(0.0, min(scheduler.peek, next_due - time.time())))
+
+def supervise(configs, check_every: float = 5.0):
+    """
+    One process per lot, so decoding for many cameras spreads across cores.
+    Dead processes are restarted. The inference budget is shared by all of them.
+    """
+    budget = InferenceBudget()
+    procs = {}
+    while True:
+        for cfg in configs:
+            lot = cfg.get("lot", DEFAULT_LOT)
+            p = procs.get(lot)
+            if p is None or not p.is_alive():
+                if p is not None:
+                    print(f"⚠️ [supervisor] {lot} exited with {p.exitcode}, restarting")
+                p = procs[lot] = mp.Process(target=run_lot, args=(cfg, budget), name=f"lot-{lot}", daemon=True)
+                p.start()
+        time.sleep(check_every)
+
+if __name__ == "__main__":
+    configs = load_lots()
+    if len(configs) == 1:
+        run_lot(configs[0])
+    else:
+        supervise(configs)
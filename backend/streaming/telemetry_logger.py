@@ -1,12 +1,9 @@
-import json
+# Prints the drone telemetry feed; run from the repo root:
+#   python -m backend.streaming.telemetry_logger
+# The API keeps its own subscription (backend/telemetry.py) — this is only a console tap.
 import paho.mqtt.client as mqtt
 
-# Connection settings
-MQTT_HOST = "mqtt.hextronics.net"
-MQTT_PORT = 1883
-MQTT_USER = "hexair-hack"
-MQTT_PASS = "305hack"
-TOPIC = "hexair/hexair-hack/telemetry"
+from backend.telemetry import MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS, TOPIC, FLAG_FLYING, FLAG_STREAMING, parse_message
 
 # Callback when connected
 def on_connect(client, userdata, flags, rc):
@@ -19,25 +16,25 @@ def on_connect(client, userdata, flags, rc):
 
 # Callback when a message arrives
 def on_message(client, userdata, msg):
-    try:
-        payload = msg.payload.decode("utf-8")
-        data = json.loads(payload)
-        # Print telemetry summary
-        print("\n--- TELEMETRY UPDATE ---")
-        print(f"Streaming: {data.get('isStreaming')}")
-        print(f"Flying: {data.get('isFlying')}")
-        if data.get("currentPosition"):
-            pos = data["currentPosition"]
-            print(f"Position: {pos['latitude']}, {pos['longitude']} @ {pos['altitude']}m")
-        if data.get("devices") and data["devices"]["aircraft"]:
-            bat = data["devices"]["aircraft"]["batteries"][0]
-            print(f"Battery: {round(bat['level']*100,1)}%")
-        print("------------------------")
-    except Exception as e:
-        print("⚠️ Error decoding message:", e)
+    sample = parse_message(msg.payload)
+    if sample is None:
+        print("⚠️ Error decoding message")
+        return
+    # Print telemetry summary
+    print("\n--- TELEMETRY UPDATE ---")
+    print(f"Streaming: {bool(sample['flags'] & FLAG_STREAMING)}")
+    print(f"Flying: {bool(sample['flags'] & FLAG_FLYING)}")
+    if sample["lat"] == sample["lat"]:
+        print(f"Position: {sample['lat']}, {sample['lon']} @ {sample['alt']}m")
+    if sample["battery"] == sample["battery"]:
+        print(f"Battery: {sample['battery']}%")
+    print("------------------------")
 
 def main():
-    client = mqtt.Client()
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    except AttributeError:  # paho-mqtt < 2.0
+        client = mqtt.Client()
     client.username_pw_set(MQTT_USER, MQTT_PASS)
     client.on_connect = on_connect
     client.on_message = on_message
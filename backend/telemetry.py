@@ -0,0 +1,352 @@
+"""
+Drone telemetry service: one MQTT subscription for the whole backend.
+
+Messages are parsed into a columnar ring buffer (NumPy arrays: time, lat,
+lon, altitude, battery, flags) and folded into 1 s / 1 min / 1 h rollups as
+they arrive. The API serves /telemetry/latest and /telemetry/series from
+memory, so the dashboard and forecaster never open their own broker
+connections.
+
+The MQTT client is optional: feed() accepts raw payloads directly, which is
+how tests and local broker stand-ins drive it.
+"""
+import os, json, time, threading
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+MQTT_HOST = os.getenv("MQTT_HOST", "mqtt.hextronics.net")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_USER = os.getenv("MQTT_USER", "hexair-hack")
+MQTT_PASS = os.getenv("MQTT_PASS", "305hack")
+TOPIC = os.getenv("MQTT_TOPIC", "hexair/hexair-hack/telemetry")
+
+RAW_CAPACITY = int(os.getenv("TELEMETRY_CAPACITY", "86400"))  # ~1 day at 1 Hz
+RESOLUTIONS = {"1s": 1, "1m": 60, "1h": 3600}
+ROLLUP_CAPACITY = {"1s": 3600, "1m": 1440, "1h": 24 * 30}
+
+# Ingest gating (see gate()): off by default, frames are only stamped with position
+GATE_ENABLED = os.getenv("TELEMETRY_GATE", "0") == "1"
+MIN_ALTITUDE = float(os.getenv("TELEMETRY_MIN_ALT", "0"))
+MAX_GAP_SEC = float(os.getenv("TELEMETRY_MAX_GAP", "5"))  # nearest sample must be this close to the frame
+REQUIRE_TELEMETRY = os.getenv("TELEMETRY_REQUIRED", "0") == "1"
+MAX_FUTURE_SEC = 300  # samples stamped further ahead than this are dropped as unusable
+
+FLAG_STREAMING = 1
+FLAG_FLYING = 2
+FIELDS = ("lat", "lon", "alt", "battery")
+
+
+def _coord(value) -> float:
+    # null (no GPS fix yet) -> NaN; anything non-numeric raises
+    return np.nan if value is None else float(value)
+
+
+def parse_timestamp(value) -> float:
+    """
+    Epoch seconds from a numeric timestamp in seconds, milliseconds or
+    microseconds, or an ISO 8601 string (naive = UTC, like the history
+    timestamps, which are written with utcnow()); None/empty means now.
+    """
+    if value is None or value == "":
+        return time.time()
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt.timestamp()
+    t = float(value)
+    if t > 1e14:
+        t /= 1e6
+    elif t > 1e11:
+        t /= 1e3
+    return t
+
+
+def parse_message(payload) -> Optional[dict]:
+    """
+    Raw MQTT payload (bytes/str/dict) → flat sample, or None if it is unusable
+    (bad JSON, non-numeric fields, a timestamp that is not finite or more than
+    MAX_FUTURE_SEC ahead of the clock). Missing values are NaN so every sample
+    fits the same columns.
+    """
+    try:
+        data = payload if isinstance(payload, dict) else json.loads(
+            payload.decode("utf-8") if isinstance(payload, (bytes, bytearray)) else payload)
+        t = parse_timestamp(data.get("timestamp"))
+        if not np.isfinite(t) or t > time.time() + MAX_FUTURE_SEC:
+            return None  # one bad clock would otherwise push every later sample out as out_of_order
+        sample = {"t": t, "lat": np.nan, "lon": np.nan, "alt": np.nan, "battery": np.nan,
+                  "flags": (FLAG_STREAMING if data.get("isStreaming") else 0)
+                           | (FLAG_FLYING if data.get("isFlying") else 0)}
+        pos = data.get("currentPosition")
+        if pos:
+            sample["lat"] = _coord(pos.get("latitude"))
+            sample["lon"] = _coord(pos.get("longitude"))
+            sample["alt"] = _coord(pos.get("altitude"))
+    except Exception:
+        return None
+    try:
+        bat = data["devices"]["aircraft"]["batteries"][0]
+        sample["battery"] = round(float(bat["level"]) * 100, 1)
+    except Exception:
+        pass
+    return sample
+
+
+def point_in_polygon(lat: float, lon: float, polygon) -> bool:
+    """Even-odd ray casting; polygon is [[lat, lon], ...] (small areas, planar is fine)."""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        yi, xi = polygon[i]
+        yj, xj = polygon[j]
+        if (xi > lon) != (xj > lon) and lat < (yj - yi) * (lon - xi) / (xj - xi) + yi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def load_geofence(path: str):
+    """[[lat, lon], ...] from a JSON file (a bare list or {"polygon": [...]}), or None if absent."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        data = json.load(f)
+    polygon = data.get("polygon") if isinstance(data, dict) else data
+    return [(float(lat), float(lon)) for lat, lon in polygon] if polygon else None
+
+
+def gate(sample: Optional[dict], geofence=None, min_altitude: float = MIN_ALTITUDE) -> Optional[str]:
+    """
+    Why a frame should skip inference, or None to process it.
+    Without a matching telemetry sample the frame passes unless TELEMETRY_REQUIRED=1.
+    """
+    if sample is None:
+        return "no telemetry near frame time" if REQUIRE_TELEMETRY else None
+    if not sample["flags"] & FLAG_FLYING:
+        return "drone not flying"
+    if min_altitude and not sample["alt"] >= min_altitude:
+        return f"below minimum altitude ({min_altitude} m)"
+    if geofence:
+        if sample["lat"] != sample["lat"]:
+            return "no position"
+        if not point_in_polygon(sample["lat"], sample["lon"], geofence):
+            return "outside lot geofence"
+    return None
+
+
+class Ring:
+    """Fixed-capacity columnar buffer; index math only, no per-sample objects."""
+
+    def __init__(self, capacity: int, columns):
+        self.capacity = capacity
+        self.t = np.zeros(capacity, dtype=np.float64)
+        self.cols = {c: np.full(capacity, np.nan, dtype=np.float64) for c in columns}  # float64: lat/lon need it
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.n = 0      # samples ever written
+        self.head = 0   # next write slot
+
+    def append(self, t: float, values: dict, flags: int = 0):
+        i = self.head
+        self.t[i] = t
+        for c, arr in self.cols.items():
+            arr[i] = values.get(c, np.nan)
+        self.flags[i] = flags
+        self.head = (i + 1) % self.capacity
+        self.n += 1
+
+    def _order(self) -> np.ndarray:
+        size = min(self.n, self.capacity)
+        return (np.arange(size) + (self.head - size)) % self.capacity
+
+    def nearest(self, t: float) -> Optional[int]:
+        """Physical slot of the sample closest in time to t (binary search over the ring)."""
+        size = min(self.n, self.capacity)
+        if not size:
+            return None
+        start = self.head - size
+        lo, hi = 0, size
+        while lo < hi:  # first logical position with time >= t
+            mid = (lo + hi) // 2
+            if self.t[(start + mid) % self.capacity] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        candidates = [k for k in (lo - 1, lo) if 0 <= k < size]
+        k = min(candidates, key=lambda k: abs(self.t[(start + k) % self.capacity] - t))
+        return (start + k) % self.capacity
+
+    def window(self, since: Optional[float] = None, until: Optional[float] = None):
+        """(t, {col: values}, flags) between since and until, oldest first."""
+        idx = self._order()
+        t = self.t[idx]
+        lo = np.searchsorted(t, since, "left") if since is not None else 0
+        hi = np.searchsorted(t, until, "right") if until is not None else len(t)
+        idx = idx[lo:hi]
+        return self.t[idx], {c: a[idx] for c, a in self.cols.items()}, self.flags[idx]
+
+
+class Rollup:
+    """
+    Per-bucket mean of each field at one resolution. The open bucket is kept as
+    running sums; closed buckets go into a Ring.
+    """
+
+    def __init__(self, seconds: int, capacity: int):
+        self.seconds = seconds
+        self.ring = Ring(capacity, FIELDS + ("count",))
+        self.bucket = None
+        self.sums = dict.fromkeys(FIELDS, 0.0)
+        self.counts = dict.fromkeys(FIELDS, 0)
+        self.samples = 0
+        self.flags = 0
+
+    def _close(self):
+        values = {f: (self.sums[f] / self.counts[f]) if self.counts[f] else np.nan for f in FIELDS}
+        values["count"] = self.samples
+        self.ring.append(self.bucket * self.seconds, values, self.flags)
+
+    def add(self, sample: dict):
+        bucket = int(sample["t"] // self.seconds)
+        if self.bucket is not None and bucket > self.bucket:
+            self._close()
+            self.sums = dict.fromkeys(FIELDS, 0.0)
+            self.counts = dict.fromkeys(FIELDS, 0)
+            self.samples, self.flags = 0, 0
+        if self.bucket is None or bucket >= self.bucket:
+            self.bucket = bucket
+        for f in FIELDS:
+            v = sample[f]
+            if v == v:  # not NaN
+                self.sums[f] += v
+                self.counts[f] += 1
+        self.samples += 1
+        self.flags |= sample["flags"]
+
+
+class TelemetryStore:
+    """
+    Raw samples plus rollups for one drone feed. feed() is the only writer, so
+    the MQTT thread, a test or a local broker stand-in all go through it.
+    """
+
+    def __init__(self, capacity: int = RAW_CAPACITY):
+        self._lock = threading.Lock()
+        self.raw = Ring(capacity, FIELDS)
+        self.rollups = {name: Rollup(sec, ROLLUP_CAPACITY[name]) for name, sec in RESOLUTIONS.items()}
+        self.last = None
+        self.stats = {"messages": 0, "dropped": 0, "out_of_order": 0}
+
+    def feed(self, payload) -> bool:
+        """Ingest one raw message; returns False if it could not be parsed."""
+        sample = parse_message(payload)
+        with self._lock:
+            self.stats["messages"] += 1
+            if sample is None:
+                self.stats["dropped"] += 1
+                return False
+            if self.last is not None and sample["t"] < self.last["t"]:
+                # the ring must stay time-ordered for searchsorted; late samples are dropped
+                self.stats["out_of_order"] += 1
+                return False
+            self.raw.append(sample["t"], sample, sample["flags"])
+            for rollup in self.rollups.values():
+                rollup.add(sample)
+            self.last = sample
+            return True
+
+    def nearest(self, t: float, max_gap: float = MAX_GAP_SEC) -> Optional[dict]:
+        """The raw sample closest to epoch time t, or None if none is within max_gap seconds."""
+        with self._lock:
+            i = self.raw.nearest(t)
+            if i is None or abs(self.raw.t[i] - t) > max_gap:
+                return None
+            sample = {c: float(a[i]) for c, a in self.raw.cols.items()}
+            sample["t"] = float(self.raw.t[i])
+            sample["flags"] = int(self.raw.flags[i])
+            return sample
+
+    def latest(self) -> dict:
+        with self._lock:
+            s = self.last
+        if s is None:
+            return {"isStreaming": False, "isFlying": False, "battery": None, "position": None, "timestamp": None}
+        position = None if s["lat"] != s["lat"] else (s["lat"], s["lon"], s["alt"])
+        return {
+            "isStreaming": bool(s["flags"] & FLAG_STREAMING),
+            "isFlying": bool(s["flags"] & FLAG_FLYING),
+            "battery": None if s["battery"] != s["battery"] else s["battery"],
+            "position": position,
+            "timestamp": s["t"],
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "buffered": min(self.raw.n, self.raw.capacity),
+                    "rollups": {name: min(r.ring.n, r.ring.capacity) for name, r in self.rollups.items()}}
+
+    def series(self, resolution: str = "1m", since: Optional[float] = None, until: Optional[float] = None) -> dict:
+        """Columnar series: {"t": [...], "lat": [...], ...}; resolution raw|1s|1m|1h."""
+        with self._lock:
+            ring = self.raw if resolution == "raw" else self.rollups[resolution].ring
+            t, cols, flags = ring.window(since, until)
+        out = {"resolution": resolution, "t": t.tolist()}
+        for c, values in cols.items():
+            out[c] = [None if v != v else round(float(v), 6) for v in values]
+        out["isStreaming"] = ((flags & FLAG_STREAMING) > 0).tolist()
+        out["isFlying"] = ((flags & FLAG_FLYING) > 0).tolist()
+        return out
+
+
+class TelemetryService:
+    """Owns the single MQTT subscription and feeds a TelemetryStore."""
+
+    def __init__(self, store: TelemetryStore):
+        self.store = store
+        self.client = None
+        self.connected = False
+
+    def start(self):
+        if self.client is not None:
+            return
+        import paho.mqtt.client as mqtt
+        try:
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        except AttributeError:  # paho-mqtt < 2.0
+            client = mqtt.Client()
+        client.username_pw_set(MQTT_USER, MQTT_PASS)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        client.connect_async(MQTT_HOST, MQTT_PORT, 60)
+        client.loop_start()  # paho's network thread; reconnects on its own
+        self.client = client
+
+    def _on_connect(self, client, userdata, flags, rc):
+        self.connected = rc == 0
+        if rc == 0:
+            client.subscribe(TOPIC)
+            print(f"📡 Telemetry subscribed to {TOPIC}")
+        else:
+            print(f"❌ Telemetry MQTT connection failed with code {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        # paho re-raises callback errors and its network thread dies with them
+        try:
+            self.store.feed(msg.payload)
+        except Exception as e:
+            print(f"⚠️ Telemetry message dropped: {e}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+
+    def stop(self):
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.client = None
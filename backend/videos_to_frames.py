@@ -1,14 +1,65 @@
 import cv2
 import os
+import argparse
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_frames(video_path, output_dir, num_frames=10):
+videos_dir = "backend/data/videos/"
+frames_dir = "backend/data/frames/"
+
+# Seeking decodes from the previous keyframe every time. When sampled frames are
+# at least this many frames apart seeking wins; denser sampling is cheaper as
+# one sequential grab() pass (see backend/benchmarks/bench_frame_extraction.py).
+SEEK_MIN_GAP = 30
+
+
+def sample_indices(total_frames, fps, num_frames=10, every_seconds=None):
+    """
+    Frame indices to keep: `num_frames` evenly spaced ones, or one every
+    `every_seconds` of video when that is given.
+    """
+    if every_seconds:
+        step = max(1, int(round(every_seconds * (fps or 30))))
+        return np.arange(0, total_frames, step, dtype=int)
+    return np.unique(np.linspace(0, total_frames - 1, num_frames, dtype=int))
+
+
+def _read_seek(cap, indices):
+    for idx in indices:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+        ret, frame = cap.read()
+        if ret:
+            yield frame
+
+
+def _read_sequential(cap, indices):
+    # grab() demuxes/decodes without converting to BGR; retrieve() only for kept frames
+    wanted = iter(indices)
+    target = next(wanted, None)
+    pos = 0
+    while target is not None:
+        if not cap.grab():
+            return
+        if pos == target:
+            ret, frame = cap.retrieve()
+            if ret:
+                yield frame
+            target = next(wanted, None)
+        pos += 1
+
+
+def extract_frames(video_path, output_dir, num_frames=10, every_seconds=None, mode="auto",
+                   max_width=None, ext="jpg", quality=90):
     """
-    Extract a fixed number of evenly spaced frames from a video.
-    
+    Extract frames from a video.
+
     video_path: path to the video
     output_dir: folder to save images
-    num_frames: how many frames to extract total
+    num_frames: how many evenly spaced frames to extract total
+    every_seconds: instead of num_frames, keep one frame every N seconds
+    mode: "seek", "sequential" or "auto" (pick by sampling density)
+    max_width: downscale wider frames to this width
+    ext: "jpg" or "webp" (smaller files at the same quality)
     """
     os.makedirs(output_dir, exist_ok=True)
     cap = cv2.VideoCapture(video_path)
@@ -16,31 +67,69 @@ def extract_frames(video_path, output_dir, num_frames=10):
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     if total_frames <= 0:
         print(f"⚠️ Could not read {video_path}")
-        return
+        cap.release()
+        return 0
 
-    # pick evenly spaced frame indices
-    frame_indices = np.linspace(0, total_frames - 1, num_frames, dtype=int)
+    frame_indices = sample_indices(total_frames, cap.get(cv2.CAP_PROP_FPS), num_frames, every_seconds)
+    if mode == "auto":
+        gap = total_frames / max(1, len(frame_indices))
+        mode = "seek" if gap >= SEEK_MIN_GAP else "sequential"
+    reader = _read_seek if mode == "seek" else _read_sequential
 
+    params = [cv2.IMWRITE_WEBP_QUALITY, quality] if ext == "webp" else [cv2.IMWRITE_JPEG_QUALITY, quality]
     saved_count = 0
-    for idx in frame_indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ret, frame = cap.read()
-        if not ret:
-            continue
+    for frame in reader(cap, frame_indices):
+        if max_width and frame.shape[1] > max_width:
+            h = int(frame.shape[0] * max_width / frame.shape[1])
+            frame = cv2.resize(frame, (max_width, h), interpolation=cv2.INTER_AREA)
         filename = os.path.join(
-            output_dir, f"{os.path.basename(video_path)}_frame_{saved_count:04d}.jpg"
+            output_dir, f"{os.path.basename(video_path)}_frame_{saved_count:04d}.{ext}"
         )
-        cv2.imwrite(filename, frame)
+        cv2.imwrite(filename, frame, params)
         saved_count += 1
 
     cap.release()
-    print(f"✅ Extracted {saved_count} frames from {os.path.basename(video_path)}")
+    print(f"✅ Extracted {saved_count} frames from {os.path.basename(video_path)} ({mode})")
+    return saved_count
 
 
-# Process ALL videos in data/videos/
-videos_dir = "backend/data/videos/"
-frames_dir = "backend/data/frames/"
+def _extract_job(job):
+    video_path, output_dir, kwargs = job
+    return extract_frames(video_path, output_dir, **kwargs)
+
+
+def extract_all(videos, output_dir, workers=None, **kwargs):
+    """Process several videos in parallel, one per worker process."""
+    jobs = [(v, output_dir, kwargs) for v in videos]
+    if workers == 1 or len(jobs) <= 1:
+        return sum(_extract_job(j) for j in jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(_extract_job, jobs))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Extract frames from drone videos.")
+    ap.add_argument("videos", nargs="*", help="video files (default: every .mp4 in --videos-dir)")
+    ap.add_argument("--videos-dir", default=videos_dir)
+    ap.add_argument("--output", default=frames_dir)
+    ap.add_argument("--num-frames", type=int, default=10)
+    ap.add_argument("--every-seconds", type=float, help="sample one frame every N seconds instead")
+    ap.add_argument("--mode", choices=["auto", "seek", "sequential"], default="auto")
+    ap.add_argument("--max-width", type=int, help="downscale frames wider than this")
+    ap.add_argument("--format", choices=["jpg", "webp"], default="jpg")
+    ap.add_argument("--quality", type=int, default=90)
+    ap.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    args = ap.parse_args()
+
+    videos = args.videos or [
+        os.path.join(args.videos_dir, v) for v in sorted(os.listdir(args.videos_dir))
+        if v.lower().endswith(".mp4")
+    ]
+    total = extract_all(videos, args.output, workers=args.workers, num_frames=args.num_frames,
+                        every_seconds=args.every_seconds, mode=args.mode, max_width=args.max_width,
+                        ext=args.format, quality=args.quality)
+    print(f"📂 {total} frames from {len(videos)} videos -> {args.output}")
+
 
-for video in os.listdir(videos_dir):
-    if video.lower().endswith(".mp4"):
-        extract_frames(os.path.join(videos_dir, video), frames_dir, num_frames=10)
+if __name__ == "__main__":
+    main()
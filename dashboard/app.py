@@ -1,62 +1,87 @@
 import os
+import json
+import threading
 from dotenv import load_dotenv
 import streamlit as st
 import requests
 import pandas as pd
 import plotly.express as px
-import json
-import paho.mqtt.client as mqtt
-import threading
 
 # Load env variables
 load_dotenv()
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
 
-# --- MQTT CONFIG (drone telemetry) ---
-MQTT_HOST = "mqtt.hextronics.net"
-MQTT_PORT = 1883
-MQTT_USER = "hexair-hack"
-MQTT_PASS = "305hack"
-TOPIC = "hexair/hexair-hack/telemetry"
-
-telemetry_data = {"isStreaming": False, "isFlying": False, "battery": None, "position": None}
-
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        client.subscribe(TOPIC)
-    else:
-        print("MQTT connect fail", rc)
-
-def on_message(client, userdata, msg):
-    global telemetry_data
+HISTORY_TTL = 5    # seconds; memoized responses are also invalidated by /events
+FORECAST_TTL = 60
+
+# --- Shared HTTP client (one connection pool per server process, not per rerun) ---
+@st.cache_resource(show_spinner=False)
+def http():
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
+
+# --- Live feed: one /events subscription per server process ---
+class LiveFeed:
+    """
+    Follows the API's Server-Sent Events. Keeps the newest record and bumps a
+    generation counter per event kind, which the memoized fetches below use as
+    part of their cache key: reruns cost nothing until something changed.
+    """
+
+    def __init__(self):
+        self.latest = None
+        self.generation = {"record": 0, "forecast": 0}
+        self.connected = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        last_id = None
+        while True:
+            try:
+                headers = {"Last-Event-ID": last_id} if last_id else {}
+                with http().get(f"{API_URL}/events", headers=headers, stream=True, timeout=(3, 60)) as r:
+                    self.connected = True
+                    kind = None
+                    for line in r.iter_lines(decode_unicode=True):
+                        if line.startswith("id:"):
+                            last_id = line[3:].strip()
+                        elif line.startswith("event:"):
+                            kind = line[6:].strip()
+                        elif line.startswith("data:") and kind in self.generation:
+                            data = json.loads(line[5:])
+                            if kind == "record" and data.get("lot", "default") == "default":
+                                self.latest = data["record"]
+                            self.generation[kind] += 1
+            except Exception:
+                pass
+            self.connected = False
+            threading.Event().wait(3)
+
+@st.cache_resource(show_spinner=False)
+def live_feed():
+    return LiveFeed()
+
+@st.cache_data(ttl=HISTORY_TTL, show_spinner=False)
+def fetch_history(limit: int, generation: int):
+    return http().get(f"{API_URL}/history", params={"limit": limit}, timeout=5).json()
+
+@st.cache_data(ttl=FORECAST_TTL, show_spinner=False)
+def fetch_forecast(h: int, step: int, generation: int):
+    return http().get(f"{API_URL}/forecast", params={"h": h, "step": step}, timeout=30).json()
+
+# --- Drone telemetry ---
+# The API holds the single MQTT subscription; the dashboard just reads its latest sample.
+def fetch_telemetry():
     try:
-        data = json.loads(msg.payload.decode("utf-8"))
-        telemetry_data["isStreaming"] = data.get("isStreaming", False)
-        telemetry_data["isFlying"] = data.get("isFlying", False)
-        if data.get("currentPosition"):
-            telemetry_data["position"] = (
-                data["currentPosition"]["latitude"],
-                data["currentPosition"]["longitude"],
-                data["currentPosition"]["altitude"]
-            )
-        if data.get("devices") and data["devices"]["aircraft"]:
-            bat = data["devices"]["aircraft"]["batteries"][0]
-            telemetry_data["battery"] = round(bat["level"] * 100, 1)
-    except:
-        pass
-
-def start_mqtt():
-    client = mqtt.Client()
-    client.username_pw_set(MQTT_USER, MQTT_PASS)
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.connect(MQTT_HOST, MQTT_PORT, 60)
-    client.loop_forever()
-
-threading.Thread(target=start_mqtt, daemon=True).start()
+        return http().get(f"{API_URL}/telemetry/latest", timeout=3).json()
+    except Exception:
+        return {"isStreaming": False, "isFlying": False, "battery": None, "position": None}
 
 # --- STREAMLIT UI ---
-st.set_page_config(page_title="Smart Parking Dashboard", layout="wide")
+st.set_page_config(page_title="Smart Parking Dashboard", layout="wide")  # must stay the first Streamlit call
+feed = live_feed()
 st.sidebar.title("Smart Parking Detection")
 mode = st.sidebar.radio("Mode", ["Live", "Demo"])
 
@@ -65,7 +90,7 @@ st.title("🚗 Smart Parking in the General Area")
 # Section 1: KPI – Estimated occupancy
 st.subheader("Estimated Parking Occupancy (Entire Area)")
 try:
-    history_response = requests.get(f"{API_URL}/history?limit=1").json()
+    history_response = [feed.latest] if feed.latest else fetch_history(1, feed.generation["record"])
     if history_response:
         latest = history_response[-1]
         taken_spots = latest["taken_spots"]
@@ -88,7 +113,7 @@ except Exception as e:
 # Section 2: Forecast – Parking occupancy trends
 st.subheader("Forecast: Parking Occupancy Over Time")
 try:
-    forecast_response = requests.get(f"{API_URL}/forecast?h=12&step=60").json()
+    forecast_response = fetch_forecast(12, 60, feed.generation["forecast"])
     df_forecast = pd.DataFrame(forecast_response)
     df_forecast["occupancy_rate"] = df_forecast["taken_spots"] / df_forecast["estimated_total"]
 
@@ -123,6 +148,7 @@ col3, col4 = st.columns(2)
 
 with col3:
     st.write("**Telemetry Data:**")
+    telemetry_data = fetch_telemetry()
     if telemetry_data["isFlying"]:
         st.success("Drone is in the air ✈️ — live feed active")
     else:
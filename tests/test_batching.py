@@ -0,0 +1,89 @@
+import json
+
+from backend.batching import MicroBatcher, extract_json, parse_batch, parse_counts, request_parts
+from backend.detectors import FakeGenerativeModel, GeminiDetector
+
+
+# ---------- Single-frame answers ----------
+def test_plain_and_fenced_objects():
+    assert parse_counts('{"open_spots": 3, "occupied": 5}') == (5, 3)
+    assert parse_counts('```json\n{"open_spots": 3, "occupied": 5}\n```') == (5, 3)
+    assert parse_counts('```JSON\n{"occupied": 7, "open_spots": 1}```') == (7, 1)
+
+
+def test_object_inside_prose():
+    assert parse_counts('Sure! Here you go: {"open_spots": 3, "occupied": "5"} hope that helps') == (5, 3)
+
+
+def test_one_element_array():
+    assert parse_counts('[{"open_spots": 3, "occupied": 5}]') == (5, 3)
+
+
+def test_unusable_answers():
+    assert parse_counts("I can see roughly 40 cars.") is None
+    assert parse_counts('{"open_spots": 2, "occupied": ') is None         # truncated
+    assert parse_counts('{"open_spots": "about 3", "occupied": 1}') is None
+    assert parse_counts('{"open_spots": -1, "occupied": 1}') is None
+    assert parse_counts('{"open_spots": true, "occupied": 1}') is None
+    assert parse_counts("") is None
+
+
+def test_extract_json_skips_brackets_that_are_not_answers():
+    assert extract_json('see [1] then [{"open_spots": 1, "occupied": 2}]') == [{"open_spots": 1, "occupied": 2}]
+    assert extract_json("no json here") is None
+
+
+# ---------- Multi-frame answers ----------
+def test_frame_numbers_reorder_entries():
+    text = json.dumps([{"frame": 2, "open_spots": 1, "occupied": 2},
+                       {"frame": 1, "open_spots": 9, "occupied": 8},
+                       {"frame": 3, "open_spots": 4, "occupied": 0}])
+    assert parse_batch(f"```json\n{text}\n```", 3) == [(8, 9), (2, 1), (0, 4)]
+
+
+def test_invalid_frame_numbers_fall_back_to_position():
+    text = json.dumps([{"frame": 0, "open_spots": 1, "occupied": 2}, {"frame": 0, "open_spots": 3, "occupied": 4}])
+    assert parse_batch(text, 2) == [(2, 1), (4, 3)]
+
+
+def test_partial_entries_only_fail_their_frame():
+    text = json.dumps([{"frame": 1, "open_spots": "unclear", "occupied": 3},
+                       {"frame": 2, "open_spots": 5, "occupied": 6}])
+    assert parse_batch(text, 2) == [None, (6, 5)]
+    # missing trailing entries
+    assert parse_batch('[{"open_spots": 1, "occupied": 2}]', 3) == [(2, 1), None, None]
+    # extra entries are ignored
+    assert parse_batch('[{"open_spots": 1, "occupied": 2}, {"open_spots": 3, "occupied": 4}]', 1) == [(2, 1)]
+
+
+def test_wrapped_array():
+    text = '{"results": [{"open_spots": 1, "occupied": 2}, {"open_spots": 5, "occupied": 6}]}'
+    assert parse_batch(text, 2) == [(2, 1), (6, 5)]
+
+
+def test_garbage_gives_all_none():
+    assert parse_batch("sorry, I cannot help with that", 3) == [None, None, None]
+
+
+def test_request_parts():
+    assert len(request_parts(["im"])) == 2
+    parts = request_parts(["a", "b"])
+    assert parts[1:] == ["Image 1:", "a", "Image 2:", "b"]
+
+
+# ---------- Against the stub backend ----------
+def test_micro_batcher_fans_out_results():
+    model = FakeGenerativeModel(latency_ms=20, jitter_ms=0, per_image_ms=0, seed=1)
+    batcher = MicroBatcher(model, max_batch=4, max_wait_ms=200, concurrency=1, name="test")
+    futures = [batcher.submit(object()) for _ in range(4)]
+    results = [f.result(timeout=5) for f in futures]
+    assert all(isinstance(r, tuple) and len(r) == 2 for r in results)
+
+
+def test_detector_soft_defaults_on_errors():
+    detector = GeminiDetector(FakeGenerativeModel(latency_ms=0, jitter_ms=0, error_rate=1.0, seed=1))
+    assert detector.detect(None) == {"occupied": 100, "open_spots": 80, "ok": False}
+    detector = GeminiDetector(FakeGenerativeModel(latency_ms=0, jitter_ms=0, malformed_rate=1.0, seed=1))
+    assert detector.detect(None)["ok"] is False
+    detector = GeminiDetector(FakeGenerativeModel(latency_ms=0, jitter_ms=0, seed=1))
+    assert detector.detect(None)["ok"] is True
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.predictor import MIN_RF_RECORDS, ForecastModelCache
+
+T0 = datetime(2026, 1, 5)
+
+
+def records(n):
+    return [{"timestamp": (T0 + timedelta(hours=i)).isoformat(), "taken_spots": i % 24, "open_spots": 30,
+             "estimated_total": 30 + i % 24} for i in range(n)]
+
+
+def version(history):
+    return len(history), history[-1]["timestamp"]
+
+
+class History:
+    """Stubbed load_history: counts fits and can be slowed down to widen races."""
+
+    def __init__(self, n, delay=0.0):
+        self.records = records(n)
+        self.delay = delay
+        self.loads = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.loads += 1
+        time.sleep(self.delay)
+        return list(self.records)
+
+    def grow(self, n):
+        self.records = records(len(self.records) + n)
+        return version(self.records)
+
+
+@pytest.fixture
+def pool():
+    pool = ThreadPoolExecutor(max_workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def drain(pool):
+    pool.submit(lambda: None).result()  # single worker: everything queued before has finished
+
+
+# ---------- Cache misses ----------
+def test_concurrent_misses_share_one_fit(pool):
+    history = History(5, delay=0.2)
+    cache = ForecastModelCache(history, pool=pool)
+    v = version(history.records)
+    with ThreadPoolExecutor(max_workers=8) as callers:
+        results = list(callers.map(lambda _: cache.get(v), range(8)))
+    assert history.loads == 1
+    assert all(r is results[0] for r in results)
+    assert cache.stats["misses"] == 8 and cache.stats["trainings"] == 1
+
+
+def test_failed_fit_is_not_cached(pool):
+    history = History(5)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("disk hiccup")
+        return history()
+
+    cache = ForecastModelCache(flaky, pool=pool)
+    v = version(history.records)
+    with pytest.raises(RuntimeError):
+        cache.get(v)
+    assert cache.get(v)[0] == "ma"
+    assert cache._inflight == {}
+
+
+# ---------- Invalidation ----------
+def test_same_version_hits_new_version_refits_small_models(pool):
+    history = History(5)
+    cache = ForecastModelCache(history, pool=pool)
+    v1 = version(history.records)
+    first = cache.get(v1)
+    assert first[0] == "ma" and cache.get(v1) is first
+    assert (history.loads, cache.stats["hits"]) == (1, 1)
+
+    v2 = history.grow(1)  # moving average: cheap, refit inline on every new version
+    assert cache.get(v2) is not first
+    assert history.loads == 2 and cache.stats["misses"] == 2
+
+
+def test_forest_is_served_stale_then_refit_in_background(pool):
+    history = History(MIN_RF_RECORDS + 10)
+    updates = []
+    cache = ForecastModelCache(history, retrain_every=5, pool=pool, on_update=lambda v, kind: updates.append((v, kind)))
+    v1 = version(history.records)
+    forest = cache.get(v1)
+    assert forest[0] == "rf"
+
+    v2 = history.grow(2)  # below retrain_every: old forest, no fit
+    assert cache.get(v2) is forest
+    drain(pool)
+    assert history.loads == 1 and cache.stats["stale_hits"] == 1
+
+    v3 = history.grow(5)  # enough new records: still served stale, refit queued
+    assert cache.get(v3) is forest
+    drain(pool)
+    assert history.loads == 2 and cache.stats["background_trainings"] == 1
+    assert cache.snapshot()["trained_on"] == v3[0] and not cache.snapshot()["training"]
+    assert cache.get(v3) is not forest and cache.stats["hits"] == 1
+    assert [v for v, _ in updates] == [v1, v3]
+
+
+def test_refresh_does_not_count_as_a_request(pool):
+    history = History(5)
+    cache = ForecastModelCache(history, pool=pool)
+    cache.refresh(version(history.records))
+    drain(pool)
+    assert history.loads == 1
+    assert (cache.stats["hits"], cache.stats["misses"], cache.stats["trainings"]) == (0, 0, 1)
+    cache.get(version(history.records))
+    assert cache.stats["hits"] == 1 and history.loads == 1
@@ -0,0 +1,88 @@
+import json
+import time
+
+import pytest
+from PIL import Image
+
+from backend.detectors import FakeGenerativeModel
+from backend.frames_to_json import CheckpointWriter, TokenBucket, load_checkpoint, process_frames, run
+
+
+def make_frames(directory, n):
+    directory.mkdir()
+    for i in range(n):
+        Image.new("RGB", (8, 8)).save(directory / f"frame_{i:03d}.jpg")
+    return str(directory)
+
+
+# ---------- Rate limiting ----------
+def test_token_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=20, capacity=3)
+    t0 = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - t0 < 0.05
+    for _ in range(4):
+        bucket.acquire()
+    assert time.monotonic() - t0 >= 0.15  # 4 more tokens at 20/s
+
+
+# ---------- Checkpoint ----------
+def test_load_checkpoint_skips_torn_line(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    path.write_text(json.dumps({"frame": "a.jpg"}) + "\n" + '{"frame": "b.j')
+    assert list(load_checkpoint(str(path))) == ["a.jpg"]
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_writer_drops_torn_line_before_appending(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    path.write_text(json.dumps({"frame": "a.jpg"}) + "\n" + '{"frame": "b.j')
+    writer = CheckpointWriter(str(path))
+    writer.write({"frame": "c.jpg"})
+    writer.close()
+    assert list(load_checkpoint(str(path))) == ["a.jpg", "c.jpg"]
+
+
+def test_resume_after_torn_checkpoint(tmp_path):
+    frames = make_frames(tmp_path / "frames", 6)
+    checkpoint = tmp_path / "progress.jsonl"
+    model = FakeGenerativeModel(latency_ms=0, jitter_ms=0, seed=1)
+
+    first = run(model, frames, str(checkpoint), workers=2, rate=1000, burst=10, batch_size=4)
+    assert [r["frame"] for r in first] == [f"frame_{i:03d}.jpg" for i in range(6)]
+
+    # simulate a crash mid-write: keep two full lines and half of the third
+    lines = checkpoint.read_text().splitlines(keepends=True)
+    checkpoint.write_text("".join(lines[:2]) + lines[2][:10])
+    kept = {json.loads(line)["frame"] for line in lines[:2]}
+
+    calls = []
+    counting = FakeGenerativeModel(latency_ms=0, jitter_ms=0, seed=2)
+    generate = counting.generate_content
+    counting.generate_content = lambda parts: calls.append(parts) or generate(parts)
+
+    second = run(counting, frames, str(checkpoint), workers=2, rate=1000, burst=10, batch_size=1)
+    assert len(calls) == 4  # only the frames that were not checkpointed
+    assert [r["frame"] for r in second] == [f"frame_{i:03d}.jpg" for i in range(6)]
+    assert set(load_checkpoint(str(checkpoint))) == {r["frame"] for r in second}
+    assert kept <= set(load_checkpoint(str(checkpoint)))
+
+
+# ---------- Unreadable frames ----------
+def test_corrupt_frame_is_skipped(tmp_path):
+    frames = make_frames(tmp_path / "frames", 4)
+    good = (tmp_path / "frames" / "frame_001.jpg").read_bytes()
+    (tmp_path / "frames" / "frame_001.jpg").write_bytes(good[:len(good) // 2])  # truncated
+    (tmp_path / "frames" / "frame_002.jpg").write_bytes(b"not a jpeg")
+    model = FakeGenerativeModel(latency_ms=0, jitter_ms=0, seed=1)
+
+    records = run(model, frames, str(tmp_path / "progress.jsonl"), workers=2, rate=1000, burst=10, batch_size=2)
+    assert [r["frame"] for r in records] == ["frame_000.jpg", "frame_003.jpg"]
+
+
+def test_batch_of_only_bad_frames_makes_no_request(tmp_path):
+    (tmp_path / "bad.jpg").write_bytes(b"")
+    model = FakeGenerativeModel(latency_ms=0, jitter_ms=0, seed=1)
+    model.generate_content = lambda parts: pytest.fail("no request expected")
+    assert process_frames(model, [str(tmp_path / "bad.jpg")], TokenBucket(rate=1000, capacity=1)) == []
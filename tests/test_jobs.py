@@ -0,0 +1,92 @@
+import importlib
+import threading
+import time
+
+import pytest
+
+from backend.jobs import JobQueue, QueueFull
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Blocked:
+    """Handler that holds its worker until release() is called."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+
+    def __call__(self, value):
+        self.gate.wait(5)
+        if value == "boom":
+            raise ValueError("bad frame")
+        return {"value": value}
+
+    def release(self):
+        self.gate.set()
+
+
+# ---------- JobQueue ----------
+def test_full_queue_rejects_and_jobs_move_through_states():
+    handler = Blocked()
+    jobs = JobQueue(handler, workers=1, max_pending=2)
+    running = jobs.submit("a")
+    wait_for(lambda: jobs.get(running["id"])["status"] == "running")
+    queued = [jobs.submit("b"), jobs.submit("boom")]
+    assert all(j["status"] == "queued" for j in queued)
+    with pytest.raises(QueueFull):
+        jobs.submit("c")
+    assert jobs.snapshot()["rejected"] == 1 and jobs.pending() == 2
+
+    handler.release()
+    wait_for(lambda: jobs.snapshot()["done"] + jobs.snapshot()["failed"] == 3)
+    assert jobs.get(running["id"])["result"] == {"value": "a"}
+    assert jobs.get(queued[0]["id"])["status"] == "done"
+    failed = jobs.get(queued[1]["id"])
+    assert (failed["status"], failed["error"]) == ("error", "bad frame")
+    assert failed["finished_at"] >= failed["submitted_at"]
+
+
+def test_finished_jobs_are_trimmed():
+    jobs = JobQueue(lambda value: value, workers=1, max_pending=10, keep_finished=2)
+    ids = []
+    for i in range(5):
+        ids.append(jobs.submit(i)["id"])
+        wait_for(lambda: jobs.get(ids[-1])["status"] == "done")
+    jobs.submit(5)
+    assert jobs.get(ids[0]) is None and jobs.get(ids[-1]) is not None
+
+
+# ---------- API ----------
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setenv("PARKING_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("TELEMETRY_MQTT", "0")
+    monkeypatch.setenv("DETECTOR", "none")
+    from fastapi.testclient import TestClient
+    import backend.main as main
+    main = importlib.reload(main)  # module-level paths follow PARKING_DATA_DIR
+    return main, TestClient(main.app)
+
+
+def test_ingest_answers_429_when_the_queue_is_full(api, monkeypatch):
+    main, client = api
+    handler = Blocked()
+    jobs = JobQueue(lambda frame, name, lot, position: handler(name), workers=1, max_pending=1)
+    monkeypatch.setattr(main, "ingest_jobs", jobs)
+    frame = bytes(4 * 4 * 3)
+
+    first = client.post("/ingest/raw?width=4&height=4", content=frame)
+    assert first.status_code == 202
+    wait_for(lambda: client.get(f"/ingest/jobs/{first.json()['job_id']}").json()["status"] == "running")
+    second = client.post("/ingest/raw?width=4&height=4", content=frame)
+    assert second.status_code == 202 and second.json()["status"] == "queued"
+    assert client.post("/ingest/raw?width=4&height=4", content=frame).status_code == 429
+
+    handler.release()
+    wait_for(lambda: client.get(f"/ingest/jobs/{second.json()['job_id']}").json()["status"] == "done")
+    assert client.get("/ingest/jobs/nope").status_code == 404
@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import lots as lots_module
+from backend.detectors import NullDetector
+from backend.lots import Lot
+from backend.rollups import OccupancyRollups
+
+T0 = datetime(2026, 1, 5)
+
+
+def record(i, taken=None):
+    taken = i % 40 if taken is None else taken
+    return {"timestamp": (T0 + timedelta(minutes=7 * i)).isoformat(), "taken_spots": taken,
+            "open_spots": 40 - taken, "estimated_total": 40}
+
+
+@pytest.fixture
+def open_lot(tmp_path, monkeypatch):
+    monkeypatch.setenv("HISTORY_ENGINE", "jsonl")
+    monkeypatch.setattr(lots_module, "ROLLUP_SAVE_EVERY", 50)
+    pool = ThreadPoolExecutor(max_workers=1)
+    yield lambda: Lot("test", str(tmp_path / "data"), str(tmp_path / "images"), NullDetector(), pool)
+    pool.shutdown()
+
+
+def full_scan(lot):
+    rollups = OccupancyRollups()
+    for r in lot.history.range():
+        rollups.add(r)
+    return rollups
+
+
+# ---------- Rollup snapshots ----------
+def test_reopen_folds_only_newer_records(open_lot, monkeypatch):
+    lot = open_lot()
+    for i in range(120):
+        lot.append(record(i))
+    lot.save_rollups()
+    for i in range(120, 130):  # after the last snapshot
+        lot.append(record(i))
+
+    folded = []
+    add = OccupancyRollups.add
+    monkeypatch.setattr(OccupancyRollups, "add", lambda self, r: folded.append(r) or add(self, r))
+    reopened = open_lot()
+    assert len(folded) == 10
+    assert reopened.rollups.snapshot() == {"records": 130, "hours": full_scan(reopened).snapshot()["hours"]}
+    assert reopened.rollups.hourly_rows() == full_scan(reopened).hourly_rows()
+    assert reopened.rollups.dow_hour() == full_scan(reopened).dow_hour()
+
+
+def test_snapshot_of_other_history_is_ignored(open_lot):
+    lot = open_lot()
+    for i in range(60):
+        lot.append(record(i))
+    lot.save_rollups()
+    # history replaced behind the snapshot's back: same length, different last record
+    lot.history.rewrite([record(i, taken=1) for i in range(59)] + [record(999)])
+    reopened = open_lot()
+    assert reopened.rollups.hourly_rows() == full_scan(reopened).hourly_rows()
+
+
+def test_rewrite_rebuilds_and_saves(open_lot):
+    lot = open_lot()
+    for i in range(30):
+        lot.append(record(i))
+    lot.rewrite([record(i, taken=5) for i in range(3)])
+    assert lot.rollups.snapshot()["records"] == 3
+    assert open_lot().rollups.snapshot()["records"] == 3
+
+
+def test_unreadable_snapshot_falls_back_to_scan(open_lot):
+    lot = open_lot()
+    for i in range(60):
+        lot.append(record(i))
+    with open(lot.rollups_path, "w") as f:
+        f.write('{"version": 1, "hourly": [')
+    assert open_lot().rollups.snapshot()["records"] == 60
+
+
+# ---------- Online seasonal forecaster ----------
+def test_seasonal_replay_keeps_appends_made_meanwhile(open_lot, monkeypatch):
+    from backend.predictor import SeasonalForecaster
+    lot = open_lot()
+    for i in range(20):
+        lot.append(record(i))
+
+    add = SeasonalForecaster.add
+    injected = []
+
+    def add_during_replay(self, r):
+        if not injected and r == record(5):
+            injected.append(lot.append(record(20)))  # an ingest lands while history is replayed
+        add(self, r)
+
+    monkeypatch.setattr(SeasonalForecaster, "add", add_during_replay)
+    model = lot.seasonal
+    monkeypatch.setattr(SeasonalForecaster, "add", add)
+    assert injected and model.n == 21
+
+    lot.append(record(21))  # folded in by append() once the model is published
+    replayed = SeasonalForecaster()
+    for r in lot.history.range():
+        replayed.add(r)
+    assert model.n == replayed.n == 22
+    assert model.level == pytest.approx(replayed.level)
@@ -0,0 +1,91 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from backend.detectors import LocalStallDetector
+from backend.stalls import StallTracker, pack_state, unpack_state
+
+STALLS = 4
+W, H = 50, 80  # stall size in pixels, stalls side by side
+
+
+@pytest.fixture
+def detector(tmp_path):
+    reference = np.full((H + 20, STALLS * W + 20, 3), 128, dtype=np.uint8)
+    cv2.imwrite(str(tmp_path / "empty.png"), reference)
+    stalls = [{"id": f"A{i + 1}", "polygon": [[10 + i * W, 10], [10 + (i + 1) * W - 1, 10],
+                                              [10 + (i + 1) * W - 1, 10 + H - 1], [10 + i * W, 10 + H - 1]]}
+              for i in range(STALLS)]
+    layout = tmp_path / "stall_layout.json"
+    layout.write_text(json.dumps({"reference": "empty.png", "stalls": stalls}))
+    return LocalStallDetector(str(layout))
+
+
+def frame(*cars):
+    """The empty lot with a car (red box with a dark windscreen) parked in each given stall."""
+    im = np.full((H + 20, STALLS * W + 20, 3), 128, dtype=np.uint8)
+    for i in cars:
+        x = 10 + i * W
+        cv2.rectangle(im, (x + 5, 15), (x + W - 6, 10 + H - 6), (30, 30, 200), -1)
+        cv2.rectangle(im, (x + 10, 25), (x + W - 11, 40), (20, 20, 20), -1)
+    return im
+
+
+# ---------- Dirty-stall skipping ----------
+def test_only_moved_stalls_are_reevaluated(detector):
+    tracker = StallTracker(detector, full_every=100)
+
+    first = tracker.update(frame(1), "2026-01-01T10:00:00")
+    assert (first["stalls_evaluated"], first["stalls_changed"], first["occupied"]) == (4, 1, 1)
+
+    same = tracker.update(frame(1), "2026-01-01T10:01:00")
+    assert (same["stalls_evaluated"], same["stalls_changed"]) == (0, 0)
+    assert same["stall_state"] == first["stall_state"]
+
+    moved = tracker.update(frame(2), "2026-01-01T10:02:00")  # car leaves A2 and parks in A3
+    assert (moved["stalls_evaluated"], moved["stalls_changed"], moved["occupied"]) == (2, 2, 1)
+    assert tracker.snapshot()["state"] == [0, 0, 1, 0]
+    assert tracker.stats == {"frames": 3, "stalls_evaluated": 6, "stalls_skipped": 6, "changes": 3}
+
+
+def test_full_recheck_every_n_frames(detector):
+    tracker = StallTracker(detector, full_every=2)
+    tracker.update(frame(), "2026-01-01T10:00:00")
+    assert tracker.update(frame(), "2026-01-01T10:01:00")["stalls_evaluated"] == 4
+
+
+def test_changes_replay(detector):
+    tracker = StallTracker(detector, full_every=100)
+    tracker.update(frame(1), "2026-01-01T10:00:00")
+    tracker.update(frame(1), "2026-01-01T10:01:00")
+    tracker.update(frame(2), "2026-01-01T10:02:00")
+
+    changes = tracker.changes(since_seq=0)
+    assert [(c["seq"], c["stall"], c["occupied"]) for c in changes] == \
+        [(1, "A2", True), (2, "A2", False), (3, "A3", True)]
+    assert [c["seq"] for c in tracker.changes(since_seq=1)] == [2, 3]
+    assert [c["seq"] for c in tracker.changes(since_ts="2026-01-01T10:01:00")] == [2, 3]
+    assert tracker.change_seq == 3
+
+
+# ---------- stall_state encoding ----------
+@pytest.mark.parametrize("bits", [[1, 0, 1, 1], [0] * 9, [1] * 17, [0, 1, 0, 0, 0, 0, 0, 0, 1]])
+def test_stall_state_hex_round_trip(bits):
+    state = np.array(bits, dtype=np.uint8)
+    hex_bits = pack_state(state)
+    assert len(hex_bits) == 2 * -(-len(bits) // 8)
+    assert unpack_state(hex_bits, len(bits)).tolist() == bits
+
+
+def test_restore_from_history_record(detector):
+    tracker = StallTracker(detector, full_every=100)
+    record = tracker.update(frame(0, 3), "2026-01-01T10:00:00")
+
+    restarted = StallTracker(detector, full_every=100)
+    restarted.restore(record["stall_state"], "2026-01-01T10:00:00")
+    assert restarted.snapshot()["state"] == [1, 0, 0, 1] and restarted.known
+    # no previous frame yet, so every stall is re-checked; the restored state means none of them changed
+    result = restarted.update(frame(0, 3), "2026-01-01T10:05:00")
+    assert (result["stalls_evaluated"], result["stalls_changed"]) == (4, 0)
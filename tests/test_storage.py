@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from backend.storage import JsonlHistoryStore, SqliteHistoryStore, open_store
+
+
+def record(i, minute=None):
+    minute = i if minute is None else minute
+    return {"timestamp": f"2026-01-01T{minute // 60:02d}:{minute % 60:02d}:00", "taken_spots": i,
+            "open_spots": 10, "estimated_total": 10 + i}
+
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def make_store(request, tmp_path):
+    cls, name = {"jsonl": (JsonlHistoryStore, "h.jsonl"), "sqlite": (SqliteHistoryStore, "h.db")}[request.param]
+    return lambda ring_size=5: cls(str(tmp_path / name), ring_size=ring_size)
+
+
+def taken(records):
+    return [r["taken_spots"] for r in records]
+
+
+# ---------- Both engines ----------
+def test_append_returns_dense_seq(make_store):
+    store = make_store()
+    assert [store.append(record(i)) for i in range(3)] == [0, 1, 2]
+    assert store.count() == 3
+
+
+def test_tail_from_ring_and_from_disk(make_store):
+    store = make_store(ring_size=5)
+    for i in range(12):
+        store.append(record(i))
+    assert taken(store.tail(3)) == [9, 10, 11]       # ring buffer
+    assert taken(store.tail(8)) == list(range(4, 12))  # reaches past the ring
+    assert taken(store.tail(100)) == list(range(12))
+    assert store.tail(0) == []
+
+
+def test_range_filters_and_sorts_by_timestamp(make_store):
+    store = make_store()
+    for i in range(10):
+        store.append(record(i))
+    store.append(record(99, minute=3))  # late arrival with an older timestamp
+    assert taken(store.range(since="2026-01-01T00:03:00", until="2026-01-01T00:06:00")) == [3, 99, 4, 5]
+    assert taken(store.range(until="2026-01-01T00:02:00")) == [0, 1]
+    assert taken(store.range(since="2026-01-01T00:08:00")) == [8, 9]
+    assert len(list(store.range())) == 11
+
+
+def test_after_cursor_pages(make_store):
+    store = make_store(ring_size=4)
+    for i in range(10):
+        store.append(record(i))
+    records, nxt = store.after(2, 3)  # before the ring: read from disk
+    assert (taken(records), nxt) == ([2, 3, 4], 5)
+    records, nxt = store.after(7)     # inside the ring
+    assert (taken(records), nxt) == ([7, 8, 9], 10)
+    records, nxt = store.after(10)
+    assert (list(records), nxt) == ([], 10)
+
+
+def test_reopen_and_rewrite(make_store):
+    store = make_store()
+    for i in range(7):
+        store.append(record(i))
+    reopened = make_store()
+    assert reopened.count() == 7 and taken(reopened.tail(2)) == [5, 6]
+    reopened.rewrite([record(i) for i in range(3)])
+    assert reopened.count() == 3 and taken(reopened.range()) == [0, 1, 2]
+    assert reopened.append(record(3)) == 3
+    assert taken(make_store().range()) == [0, 1, 2, 3]
+
+
+def test_legacy_json_migrates_once(tmp_path):
+    legacy = tmp_path / "parking_history.json"
+    legacy.write_text(json.dumps([record(i) for i in range(4)]))
+    store = open_store(str(tmp_path), engine="jsonl", legacy_json=str(legacy))
+    assert store.count() == 4
+    store.append(record(4))
+    assert open_store(str(tmp_path), engine="jsonl", legacy_json=str(legacy)).count() == 5
+
+
+# ---------- JSONL ----------
+def test_jsonl_torn_tail_is_cut_off(tmp_path):
+    path = tmp_path / "h.jsonl"
+    lines = "".join(json.dumps(record(i)) + "\n" for i in range(3))
+    path.write_text(lines + '{"timestamp": "2026-01-01T00:03:00", "tak')
+    store = JsonlHistoryStore(str(path))
+    assert store.count() == 3
+    assert path.read_text() == lines
+    store.append(record(3))
+    assert taken(JsonlHistoryStore(str(path)).range()) == [0, 1, 2, 3]
+
+
+def test_jsonl_skips_corrupt_middle_line(tmp_path):
+    path = tmp_path / "h.jsonl"
+    path.write_text(json.dumps(record(0)) + "\nnot json\n" + json.dumps(record(1)) + "\n")
+    store = JsonlHistoryStore(str(path))
+    assert taken(store.range()) == [0, 1]
+    assert taken(store.tail(5)) == [0, 1]
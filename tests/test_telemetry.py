@@ -0,0 +1,71 @@
+import json
+import math
+import time
+
+from backend.telemetry import TelemetryStore, parse_message, parse_timestamp
+
+
+def message(t, lat=28.6, lon=-81.2, alt=40.0, level=0.8, **extra):
+    return json.dumps({"timestamp": t, "isStreaming": True, "isFlying": True,
+                       "currentPosition": {"latitude": lat, "longitude": lon, "altitude": alt},
+                       "devices": {"aircraft": {"batteries": [{"level": level}]}}, **extra}).encode()
+
+
+# ---------- Parsing ----------
+def test_timestamp_units():
+    assert parse_timestamp(1_700_000_000) == 1_700_000_000
+    assert parse_timestamp(1_700_000_000_500) == 1_700_000_000.5
+    assert parse_timestamp(1_700_000_000_000_000) == 1_700_000_000
+    assert parse_timestamp("1700000000") == 1_700_000_000
+    assert parse_timestamp("2023-11-14T22:13:20Z") == 1_700_000_000
+    assert parse_timestamp("2023-11-14T22:13:20") == 1_700_000_000  # naive = UTC
+    assert parse_timestamp("2023-11-14T23:13:20+01:00") == 1_700_000_000
+    assert abs(parse_timestamp(None) - time.time()) < 5
+
+
+def test_unusable_messages_are_none():
+    now = time.time()
+    assert parse_message(b"not json") is None
+    assert parse_message(b"\xff\xfe") is None
+    assert parse_message(message("yesterday-ish")) is None
+    assert parse_message(message(now, lat="north")) is None
+    assert parse_message(message(now + 3600)) is None  # clock far ahead
+
+
+def test_missing_fix_is_nan():
+    sample = parse_message(message(time.time(), lat=None, lon=None))
+    assert math.isnan(sample["lat"]) and math.isnan(sample["lon"])
+    assert sample["alt"] == 40.0 and sample["battery"] == 80.0
+
+
+# ---------- Store ----------
+def test_feed_counts_and_orders():
+    store = TelemetryStore(capacity=16)
+    now = time.time()
+    assert store.feed(message(now - 10))
+    assert store.feed(message((now - 5) * 1000))     # milliseconds
+    assert not store.feed(message(now - 8))          # late sample
+    assert not store.feed(b"garbage")
+    stats = store.snapshot()
+    assert (stats["messages"], stats["dropped"], stats["out_of_order"], stats["buffered"]) == (4, 1, 1, 2)
+
+
+def test_nearest_respects_max_gap():
+    store = TelemetryStore(capacity=16)
+    now = time.time()
+    store.feed(message(now - 10, alt=10.0))
+    store.feed(message(now - 4, alt=20.0))
+    assert store.nearest(now - 9, max_gap=2)["alt"] == 10.0
+    assert store.nearest(now - 5, max_gap=2)["alt"] == 20.0
+    assert store.nearest(now - 7, max_gap=2) is None
+    assert store.nearest(now + 60, max_gap=2) is None
+
+
+def test_latest_without_fix():
+    store = TelemetryStore(capacity=16)
+    assert store.latest()["position"] is None
+    store.feed(message(time.time(), lat=None))
+    latest = store.latest()
+    assert latest["position"] is None and latest["battery"] == 80.0 and latest["isFlying"]
+    store.feed(message(time.time() + 1))
+    assert store.latest()["position"] == (28.6, -81.2, 40.0)